@@ -4,10 +4,19 @@ import threading
 import json
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
-import io
 import ssl
-import subprocess
-import sys
+import time
+import queue
+from transfer import BatchSink, FileSink, ResumeJournal, StripedFile, IntegrityError
+from telemetry import Telemetry, TransferCounter, format_rate, format_eta
+from compression import available_codecs, decompressor
+from delta import DeltaPatcher, file_signature
+from launcher import run_apps
+from tls import TLSConnector
+from mux import KIND_CHAT, KIND_STREAM, MuxConnection
+from protocol import (FrameSocket, ProtocolError, CMD_HELLO, REPLY_HELLO_OK, REPLY_SERVER_FULL, CAP_PIPELINE, CAP_FRAMES, CAP_PARALLEL, CAP_COMPRESS, CAP_DELTA, CAP_MUX, CAP_ARCHIVE, CAP_BATCH, CAP_DIGEST,
+                      CMD_LIST_FILES, CMD_DOWNLOAD_FILES, CMD_STAT_FILES, CMD_SYNC_FILE, CMD_ARCHIVE, PREFIX_ACK, PREFIX_ACK_FINAL, LISTING_FIELDS, ENTRY_FILE,
+                      MSG_COMMAND, MSG_LISTING, MSG_FILE_HEADER, MSG_DATA, MSG_ACK, MSG_ERROR, MSG_END, MSG_COPY, MSG_BATCH, MSG_DIGEST, MAX_FRAME_SIZE, split_batch)
 
 FONT_FAMILY = "Berlin Sans FB Demi"
 FONT_NORMAL = (FONT_FAMILY, 10)
@@ -26,6 +35,25 @@ COLOR_SUCCESS = "#136F63"
 COLOR_SUCCESS_TEXT = "#FFFFFF"
 COLOR_ERROR = "#E74C3C"
 
+PIPELINE_WINDOW = 64
+HELLO_TIMEOUT = 3.0
+TEXT_RECV_SIZE = 256 * 1024
+STRIPE_THRESHOLD = 64 * 1024 * 1024
+STRIPE_MIN_CHUNK = 16 * 1024 * 1024
+PARALLEL_BATCH_FILES = 32
+PARALLEL_RAMP_INTERVAL = 1.0
+PARALLEL_STREAM_OPTIONS = ("Off", "Auto", "2", "4", "8")
+LISTING_PAGE_SIZE = 2000
+DELTA_MIN_SIZE = 1024 * 1024
+# Archive downloads: (unpack into the save folder, archive compression) per option; "Off" downloads file by file.
+ARCHIVE_OPTIONS = {"Off": None, "Unpack": (True, ""), "Save .tar": (False, ""), "Save .tar.gz": (False, "gz")}
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024: return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
 class ClientGUI(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -36,12 +64,16 @@ class ClientGUI(tk.Tk):
 
         self.setup_styles()
 
-        self.client_socket = None
+        self.client = FileClient(self)
+        self.telemetry = Telemetry(self.publish_telemetry)
+        self.telemetry.track(self.client.progress)
+        self.telemetry.start()
         self.chat_socket = None
         self.chat_window = None
         self.is_connected = False
         self.checkbuttons = {}
         self.full_file_list = []
+        self.file_sizes = {}
         self.ip_var = tk.StringVar()
 
         self.save_directory_var = tk.StringVar(value="Please select a base save folder...")
@@ -49,6 +81,10 @@ class ClientGUI(tk.Tk):
         self.specific_download_path = None
         self.select_all_var = tk.BooleanVar(value=False)
         self.last_download_info = None
+        self.parallel_streams_var = tk.StringVar(value="Off")
+        self.delta_sync_var = tk.BooleanVar(value=False)
+        self.archive_mode_var = tk.StringVar(value="Off")
+        self.single_connection_var = tk.BooleanVar(value=False)
 
         self.create_widgets()
         self.update_exit_button_style()
@@ -98,6 +134,8 @@ class ClientGUI(tk.Tk):
         self.password_input = ttk.Entry(conn_frame, width=15, show="*", state="disabled")
         self.password_input.pack(side=tk.LEFT, padx=5)
 
+        ttk.Checkbutton(conn_frame, text="Single connection", variable=self.single_connection_var).pack(side=tk.LEFT, padx=5)
+
         self.connect_btn = ttk.Button(conn_frame, text="🔗 Connect", command=self.toggle_connection)
         self.connect_btn.pack(side=tk.LEFT, padx=10)
         
@@ -153,11 +191,22 @@ class ClientGUI(tk.Tk):
         self.create_folder_btn = ttk.Button(new_folder_frame, text="➕ Create", command=self.create_new_folder, state='disabled')
         self.create_folder_btn.pack(side=tk.LEFT)
 
+        streams_frame = ttk.Frame(action_frame)
+        streams_frame.grid(row=4, column=0, sticky="ew", pady=(10, 0))
+        ttk.Label(streams_frame, text="Parallel streams:").pack(side=tk.LEFT)
+        ttk.Combobox(streams_frame, textvariable=self.parallel_streams_var, values=PARALLEL_STREAM_OPTIONS, state='readonly', width=6).pack(side=tk.LEFT, padx=(5,0))
+        ttk.Checkbutton(streams_frame, text="Only fetch changes", variable=self.delta_sync_var).pack(side=tk.LEFT, padx=(15,0))
+
+        archive_frame = ttk.Frame(action_frame)
+        archive_frame.grid(row=5, column=0, sticky="ew", pady=(10, 0))
+        ttk.Label(archive_frame, text="As one archive:").pack(side=tk.LEFT)
+        ttk.Combobox(archive_frame, textvariable=self.archive_mode_var, values=list(ARCHIVE_OPTIONS), state='readonly', width=12).pack(side=tk.LEFT, padx=(5,0))
+
         self.download_btn = ttk.Button(action_frame, text="⬇️ Download Selected", command=self.start_download, state='disabled')
-        self.download_btn.grid(row=4, column=0, sticky="ew", ipady=5, pady=(20,0), padx=20)
+        self.download_btn.grid(row=6, column=0, sticky="ew", ipady=5, pady=(20,0), padx=20)
 
         status_subframe = ttk.Frame(action_frame)
-        status_subframe.grid(row=5, column=0, sticky="ew", pady=(10, 0))
+        status_subframe.grid(row=7, column=0, sticky="ew", pady=(10, 0))
         status_subframe.grid_columnconfigure(0, weight=1)
 
         self.progress_label = ttk.Label(status_subframe, text="", anchor="center")
@@ -220,35 +269,12 @@ class ClientGUI(tk.Tk):
         is_checked = self.select_all_var.get()
         for var in self.checkbuttons.values(): var.set(is_checked)
 
-    def _recv_until_newline(self):
-        data = b""
-        while not data.endswith(b'\n'):
-            chunk = self.client_socket.recv(1)
-            if not chunk: raise ConnectionAbortedError("Socket connection broken")
-            data += chunk
-        return data.decode('utf-8').strip()
-
     def go_to_launcher(self):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        launcher_path = os.path.join(current_dir, "launcher.py")
-
-        if self.is_connected and messagebox.askyesno("Confirm Navigation", "You are currently connected. \nDisconnect and return to launcher?"):
+        if self.is_connected:
+            if not messagebox.askyesno("Confirm Navigation", "You are currently connected. \nDisconnect and return to launcher?"): return
             self.disconnect_from_server()
-            self.destroy()
-            try:
-                subprocess.run([sys.executable, launcher_path], check=True)
-            except FileNotFoundError:
-                messagebox.showerror("Error", f"Launcher.py not found at: {launcher_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to launch launcher.py: {e}")
-        elif not self.is_connected:
-            self.destroy()
-            try:
-                subprocess.run([sys.executable, launcher_path], check=True)
-            except FileNotFoundError:
-                messagebox.showerror("Error", f"Launcher.py not found at: {launcher_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to launch launcher.py: {e}")
+        self.next_app = "launcher"
+        self.destroy()
 
     def connect_to_server(self):
         ip, port_str = self.ip_input.get(), self.port_input.get()
@@ -261,11 +287,8 @@ class ClientGUI(tk.Tk):
 
     def connection_worker(self, ip, port):
         try:
-            context = ssl.create_default_context(); context.check_hostname = False; context.verify_mode = ssl.CERT_NONE
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket = context.wrap_socket(sock, server_hostname=ip)
-            self.client_socket.connect((ip, port))
-            auth_req = self.client_socket.recv(1024).decode()
+            self.client.multiplex = self.single_connection_var.get()
+            auth_req = self.client.connect(ip, port)
             if auth_req == 'NEEDS_PASS': self.after(0, self.ask_for_password)
             elif auth_req == 'NO_PASS': self.after(0, self.finish_login)
             else: raise ConnectionError(f"Unexpected response from server: {auth_req}")
@@ -289,9 +312,7 @@ class ClientGUI(tk.Tk):
 
     def login_worker(self, password):
         try:
-            self.client_socket.sendall(password.encode())
-            response = self.client_socket.recv(1024).decode()
-            if response == 'AUTH_SUCCESS': self.after(0, self.finish_login)
+            if self.client.login(password): self.after(0, self.finish_login)
             else:
                 self.after(0, lambda: messagebox.showerror("Error", "Authentication failed. Incorrect password."))
                 self.after(0, self.disconnect_from_server)
@@ -301,13 +322,13 @@ class ClientGUI(tk.Tk):
 
     def finish_login(self):
         try:
-            self.client_socket.send(b'LIST_FILES')
-            files_json = self.client_socket.recv(4096).decode('utf-8')
-            self.full_file_list = json.loads(files_json)
-            self.populate_file_list(self.full_file_list)
-            self.update_status("Connected. Ready to download.", COLOR_ACCENT)
+            self.client.negotiate()
+            self.full_file_list, self.file_sizes = [], {}
+            self.populate_file_list([])
+            self.update_status("Connected. Loading file list...", COLOR_ACCENT_ACTIVE)
             self.is_connected = True
-            self.set_download_button_to_new()
+            self.download_btn.config(state='disabled') # The listing streams over the same connection.
+            threading.Thread(target=self.listing_worker, daemon=True).start()
             self.connect_btn.config(text='❌ Disconnect', command=self.toggle_connection, state='normal')
             self.update_exit_button_style()
             self.ip_input.config(state='disabled')
@@ -319,6 +340,21 @@ class ClientGUI(tk.Tk):
             self.update_status(f"Connection Failed: {e}", COLOR_ERROR)
             self.disconnect_from_server()
 
+    def listing_worker(self):
+        try:
+            listed = 0
+            for page in self.client.iter_listing():
+                files = [entry for entry in page['entries'] if entry['type'] == ENTRY_FILE]
+                listed += len(files)
+                self.after(0, self.append_file_entries, files)
+                if not page.get('last'): self.update_status(f"Loading file list... {listed} files", COLOR_ACCENT_ACTIVE)
+            self.update_status(f"Connected. {listed} files available.", COLOR_ACCENT)
+            self.after(0, self.set_download_button_to_new)
+        except Exception as e:
+            if not self.is_connected: return
+            self.update_status(f"Listing Failed: {e}", COLOR_ERROR)
+            self.after(0, self.disconnect_from_server)
+
     def create_new_folder(self):
         base_directory = self.save_directory_var.get()
         if "Please select" in base_directory: messagebox.showerror("Error", "Please select a base save folder first."); return
@@ -358,52 +394,40 @@ class ClientGUI(tk.Tk):
         if not save_path: return
         self.last_download_info = {"files": selected_files, "path": save_path}
         self.download_btn.config(state='disabled')
-        threading.Thread(target=self.download_worker, args=(selected_files, save_path), daemon=True).start()
+        streams = self.parallel_streams_var.get()
+        streams = 1 if streams == "Off" else None if streams == "Auto" else int(streams)
+        archive = ARCHIVE_OPTIONS[self.archive_mode_var.get()]
+        if archive and set(selected_files) == set(self.full_file_list): selected_files = [""] # Everything: let the server walk the whole share.
+        threading.Thread(target=self.download_worker, args=(selected_files, save_path, False, streams, self.delta_sync_var.get(), archive), daemon=True).start()
 
     def retry_download(self):
         if self.last_download_info:
             self.download_btn.config(state='disabled')
-            threading.Thread(target=self.download_worker, args=(self.last_download_info["files"], self.last_download_info["path"]), daemon=True).start()
+            threading.Thread(target=self.download_worker, args=(self.last_download_info["files"], self.last_download_info["path"], True), daemon=True).start()
 
-    def download_worker(self, files_to_download, save_path):
+    def download_worker(self, files_to_download, save_path, resume=False, streams=1, delta=False, archive=None):
         try:
-            self.client_socket.send(b'DOWNLOAD_FILES')
-            self.client_socket.send(json.dumps(files_to_download).encode('utf-8'))
-            for filename in files_to_download:
-                file_buffer = self.download_single_file(filename)
-                if file_buffer:
-                    with open(os.path.join(save_path, filename), 'wb') as f: f.write(file_buffer.getvalue())
-                else: raise ConnectionAbortedError(f"Download failed for {filename}.")
-            final_msg = self._recv_until_newline()
-            if 'END_OF_TRANSMISSION' in final_msg: self.update_status("All downloads completed! ✅", COLOR_ACCENT)
-            else: self.update_status("Error: Unexpected final message from server.", COLOR_ERROR)
+            if resume:
+                self.update_status("Reconnecting to resume download...", COLOR_ACCENT_ACTIVE)
+                self.client.reconnect()
+            skipped = self.client.download(files_to_download, save_path, resume, streams, delta, archive)
+            if skipped: self.update_status(f"Completed. {len(skipped)} file(s) were not available or failed verification.", COLOR_ERROR)
+            else: self.update_status("All downloads completed! ✅", COLOR_ACCENT)
             self.after(0, self.set_download_button_to_new)
         except Exception as e:
             self.update_status(f"Download Error: {e}", COLOR_ERROR)
             self.after(0, self.set_download_button_to_retry)
 
-    def download_single_file(self, filename):
-        header = self._recv_until_newline()
-        try: filename_from_server, filesize_str = header.strip().split(':', 1); filesize = int(filesize_str)
-        except ValueError: raise ValueError(f"Invalid header from server: {header}")
-        self.update_status(f"Downloading: {filename_from_server}", COLOR_ACCENT_ACTIVE)
-        buffer = io.BytesIO()
-        received_bytes = 0
-        while received_bytes < filesize:
-            chunk = self.client_socket.recv(min(4096, filesize - received_bytes))
-            if not chunk: raise ConnectionAbortedError("Connection lost during download.")
-            buffer.write(chunk)
-            received_bytes += len(chunk)
-            progress = int((received_bytes / filesize) * 100)
-            self.update_progress(progress, f"{filename_from_server} ({progress}%)")
-        self.client_socket.send(b'ACK')
-        return buffer
-
     def handle_exit_button(self):
         if self.is_connected and not messagebox.askyesno("Exit Confirmation", "You are connected.\nAre you sure you want to disconnect and exit?"): return
         if self.is_connected: self.disconnect_from_server()
         self.destroy()
 
+    def destroy(self):
+        # Every way out (exit, launcher, window close) ends here; run_apps builds a new window and Telemetry next time.
+        self.telemetry.stop()
+        super().destroy()
+
     def update_exit_button_style(self):
         self.exit_btn.config(style='Error.TButton' if self.is_connected else 'Success.TButton')
 
@@ -413,12 +437,12 @@ class ClientGUI(tk.Tk):
 
     def disconnect_from_server(self):
         self.is_connected = False
-        for sock in [self.client_socket, self.chat_socket]:
-            if sock:
-                try: sock.close()
-                except: pass
-        self.client_socket, self.chat_socket = None, None
-        self.full_file_list.clear()
+        self.client.close()
+        if self.chat_socket:
+            try: self.chat_socket.close()
+            except: pass
+        self.chat_socket = None
+        self.full_file_list.clear(); self.file_sizes.clear()
         self.populate_file_list([])
         self.update_status("Disconnected", COLOR_TEXT)
         self.connect_btn.config(text='🔗 Connect', command=self.toggle_connection, state='normal')
@@ -434,33 +458,50 @@ class ClientGUI(tk.Tk):
         directory = filedialog.askdirectory(title="Select Default Download Folder")
         if directory: self.save_directory_var.set(directory)
 
+    def allowed_extensions(self):
+        filter_text = self.filter_entry.get().lower().replace('.', '').strip()
+        return [ext.strip() for ext in filter_text.split(',')] if filter_text else None
+
     def apply_filter(self):
         self.select_all_var.set(False)
-        filter_text = self.filter_entry.get().lower().replace('.', '').strip()
-        allowed = [ext.strip() for ext in filter_text.split(',')]
-        filtered = self.full_file_list if not filter_text else [f for f in self.full_file_list if os.path.splitext(f)[1].lower().replace('.', '') in allowed]
+        allowed = self.allowed_extensions()
+        filtered = self.full_file_list if not allowed else [f for f in self.full_file_list if os.path.splitext(f)[1].lower().replace('.', '') in allowed]
         self.populate_file_list(filtered)
 
+    def append_file_entries(self, entries):
+        # Pages arrive while the listing is still streaming; rows are added as they come in.
+        allowed = self.allowed_extensions()
+        for entry in entries:
+            filename = entry['name']
+            self.full_file_list.append(filename)
+            self.file_sizes[filename] = entry.get('size')
+            if not allowed or os.path.splitext(filename)[1].lower().replace('.', '') in allowed: self.add_file_row(filename)
+
     def populate_file_list(self, file_list):
         for widget in self.scrollable_frame.winfo_children(): widget.destroy()
         self.checkbuttons.clear(); self.select_all_var.set(False)
-        for filename in file_list:
-            var = tk.BooleanVar()
-            cb = ttk.Checkbutton(self.scrollable_frame, text=filename, variable=var)
-            cb.pack(anchor='w', padx=10, pady=2, fill='x')
-            self.checkbuttons[filename] = var
+        for filename in file_list: self.add_file_row(filename)
+
+    def add_file_row(self, filename):
+        var = tk.BooleanVar()
+        size = self.file_sizes.get(filename)
+        cb = ttk.Checkbutton(self.scrollable_frame, text=filename if size is None else f"{filename}  ({format_size(size)})", variable=var)
+        cb.pack(anchor='w', padx=10, pady=2, fill='x')
+        self.checkbuttons[filename] = var
 
     def update_status(self, message, color): self.after(0, lambda: self.status_label.config(text=message, foreground=color))
     def update_progress(self, value, text): self.after(0, lambda: self._update_progress_gui(value, text))
     def _update_progress_gui(self, value, text): self.progress_bar['value'] = value; self.progress_label.config(text=text)
+    def publish_telemetry(self, reports): self.after(0, self._apply_telemetry, reports[-1])
+
+    def _apply_telemetry(self, report):
+        name = report['label'] or report['file'] or "Done"
+        self._update_progress_gui(report['percent'], f"{name} ({report['percent']}%)   {format_rate(report['rate'])}   ETA {format_eta(report['eta'])}")
 
     def connect_chat(self):
         try:
             ip, chat_port = self.ip_input.get(), int(self.port_input.get()) + 1
-            context = ssl.create_default_context(); context.check_hostname = False; context.verify_mode = ssl.CERT_NONE
-            chat_sock_unwrapped = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.chat_socket = context.wrap_socket(chat_sock_unwrapped, server_hostname=ip)
-            self.chat_socket.connect((ip, chat_port))
+            self.chat_socket = self.client.mux.open_channel(KIND_CHAT) if self.client.mux else self.client.tls.connect(ip, chat_port)
             self.chat_btn.config(state='normal')
             threading.Thread(target=self.listen_for_chat, daemon=True).start()
         except Exception as e: self.update_status(f"Chat connection failed: {e}", COLOR_ERROR)
@@ -525,6 +566,428 @@ class ClientGUI(tk.Tk):
                 self.display_chat_message("You", message)
             except Exception as e: self.display_chat_message("System", f"Error sending message: {e}")
 
+class FileClient:
+    def __init__(self, gui, tls=None):
+        self.gui = gui
+        self.tls = tls or TLSConnector()
+        self.multiplex, self.mux = False, None
+        self.sock, self.frames = None, None
+        self.caps, self.window = set(), 1
+        self.address, self.password = None, None
+        self.session, self.max_streams, self.codec = None, 1, None
+        self.progress = TransferCounter("download")
+
+    def connect(self, ip, port):
+        self.address = (ip, port)
+        self.sock, self.mux = self.tls.connect(ip, port), None
+        self.frames, self.caps, self.window = None, set(), 1
+        auth_req = self.sock.recv(1024).decode()
+        self.tls.remember(ip, self.sock)
+        return auth_req
+
+    def login(self, password):
+        self.password = password
+        self.sock.sendall(password.encode())
+        return self.sock.recv(1024).decode() == 'AUTH_SUCCESS'
+
+    def _open_session(self, join=None):
+        auth_req = self.connect(*self.address)
+        if auth_req == 'NEEDS_PASS' and not self.login(self.password): raise ConnectionError("Authentication failed.")
+        self.negotiate(join)
+
+    def reconnect(self):
+        # A failed transfer leaves the stream mid-message, so retries start from a fresh session.
+        self.close()
+        self._open_session()
+
+    def open_stream(self):
+        stream = FileClient(self.gui, self.tls)
+        stream.address, stream.password = self.address, self.password
+        try:
+            if self.mux: stream.sock, stream.mux = self.mux.open_channel(KIND_STREAM), self.mux; stream.negotiate(join=self.session)
+            else: stream._open_session(join=self.session)
+            if not stream.frames: raise ConnectionError("Server did not accept a parallel stream.")
+        except BaseException: stream.close(); raise
+        return stream
+
+    def close(self):
+        if self.sock:
+            try: self.sock.close()
+            except: pass
+        self.sock, self.frames, self.mux = None, None, None
+
+    def negotiate(self, join=None):
+        hello = {'caps': [CAP_PIPELINE, CAP_FRAMES, CAP_PARALLEL, CAP_COMPRESS, CAP_DELTA, CAP_ARCHIVE, CAP_BATCH, CAP_DIGEST], 'window': PIPELINE_WINDOW, 'codecs': available_codecs()}
+        if self.multiplex and not join: hello['caps'].append(CAP_MUX)
+        if join: hello['join'] = join
+        self.sock.sendall(f"{CMD_HELLO}{json.dumps(hello)}".encode('utf-8'))
+        self.sock.settimeout(HELLO_TIMEOUT)
+        try: reply = self._recv_until_newline()
+        except socket.timeout: return # Older servers ignore HELLO; stay on the per-file ACK protocol.
+        finally: self.sock.settimeout(None)
+        if reply.startswith(REPLY_SERVER_FULL): raise ConnectionRefusedError(f"Server refused the connection ({json.loads(reply[len(REPLY_SERVER_FULL):]).get('reason')}).")
+        if reply.startswith(REPLY_HELLO_OK):
+            hello = json.loads(reply[len(REPLY_HELLO_OK):])
+            self.caps, self.window = set(hello.get('caps', [])), max(1, int(hello.get('window', 1)))
+            self.session, self.max_streams = hello.get('session'), max(1, int(hello.get('max_streams', 1)))
+            self.codec = hello.get('codec')
+            if CAP_MUX in self.caps: self.mux = MuxConnection(self.sock); self.sock = self.mux.control
+            if CAP_FRAMES in self.caps: self.frames = FrameSocket(self.sock)
+
+    def _recv_until_newline(self):
+        data = b""
+        while not data.endswith(b'\n'):
+            chunk = self.sock.recv(1)
+            if not chunk: raise ConnectionAbortedError("Socket connection broken")
+            data += chunk
+        return data.decode('utf-8').strip()
+
+    def list_files(self):
+        if self.frames:
+            self.frames.send_message(MSG_COMMAND, {'cmd': CMD_LIST_FILES})
+            return self.frames.read_message(MSG_LISTING)[1]
+        self.sock.send(CMD_LIST_FILES.encode())
+        data = b""
+        while True: # Unframed servers send the listing as one JSON blob; keep reading until it parses.
+            chunk = self.sock.recv(65536)
+            if not chunk: raise ConnectionAbortedError("Socket connection broken")
+            data += chunk
+            try: return json.loads(data.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError): continue
+
+    def iter_listing(self, cursor=None, limit=None, page_size=LISTING_PAGE_SIZE):
+        # Framed servers stream pages of {name, size, mtime, type} entries ending with a 'last' page; pass
+        # the last page's cursor to continue after `limit` entries. The generator must be run to the end.
+        if not self.frames:
+            yield {'entries': [{'name': name, 'size': None, 'mtime': None, 'type': ENTRY_FILE} for name in self.list_files()], 'cursor': None, 'more': False, 'last': True}
+            return
+        request = {'cmd': CMD_LIST_FILES, 'page_size': page_size, 'cursor': cursor}
+        if limit is not None: request['limit'] = limit
+        self.frames.send_message(MSG_COMMAND, request)
+        while True:
+            page = self.frames.read_message(MSG_LISTING)[1]
+            page['entries'] = [dict(zip(LISTING_FIELDS, entry)) for entry in page['entries']]
+            yield page
+            if page['last']: return
+
+    def stat_files(self, files):
+        self.frames.send_message(MSG_COMMAND, {'cmd': CMD_STAT_FILES, 'files': files})
+        return self.frames.read_message(MSG_LISTING)[1]
+
+    def download(self, files_to_download, save_path, resume=False, streams=1, delta=False, archive=None):
+        if self.mux and self.sock is self.mux.control:
+            # Bulk data runs on its own channel so listings and chat on this connection stay responsive.
+            stream = self.open_stream(); stream.progress = self.progress
+            try: return stream.download(files_to_download, save_path, resume, streams, delta, archive)
+            finally: stream.close()
+        self.progress.reset()
+        self.gui.update_status(f"Downloading {len(files_to_download)} file(s)...", COLOR_ACCENT_ACTIVE)
+        try:
+            # Archives are not resumable; a retry falls back to the per-file download and its journal.
+            if archive and not resume and self.frames and CAP_ARCHIVE in self.caps: return self._download_archive(files_to_download, save_path, *archive)
+            if "" in files_to_download: files_to_download = self.list_files()
+            if delta and not resume and self.frames and CAP_DELTA in self.caps:
+                synced = self._sync_files(files_to_download, save_path)
+                files_to_download = [name for name in files_to_download if name not in synced]
+                if not files_to_download: return []
+            return self._download(files_to_download, save_path, resume, streams)
+        finally: self.progress.finish()
+
+    def _sync_files(self, files, save_path):
+        # Files already in the save folder are rebuilt from the local copy plus what changed on the server.
+        # Anything that cannot be synced (missing, too small, a signature too big for one frame, refused, or failing
+        # the final check) is downloaded in full.
+        synced = set()
+        for name in files:
+            target = self.target_path(save_path, name)
+            if not os.path.isfile(target) or os.path.getsize(target) < DELTA_MIN_SIZE: continue
+            self.gui.update_status(f"Comparing: {name}", COLOR_ACCENT_ACTIVE)
+            command = json.dumps({'cmd': CMD_SYNC_FILE, 'name': name, **file_signature(target)}).encode('utf-8')
+            if len(command) > MAX_FRAME_SIZE: continue
+            self.frames.send_frame(MSG_COMMAND, command)
+            msg_type, message = self.frames.read_message(MSG_FILE_HEADER, MSG_ERROR)
+            if msg_type == MSG_ERROR: continue
+            filesize, decoder = message['size'], decompressor(message.get('codec'))
+            self.progress.begin_file(name, filesize)
+            with FileSink(target) as sink, DeltaPatcher(target, message['block_size'], sink) as patcher:
+                while True:
+                    msg_type, message = self.frames.read_message(MSG_DATA, MSG_COPY, MSG_END)
+                    if msg_type == MSG_END: break
+                    if msg_type == MSG_COPY: patcher.copy(int(message['index']), int(message['count']))
+                    else: patcher.write(decoder.decompress(message, filesize - sink.written) if decoder else message)
+                    if sink.written > filesize: raise ProtocolError("Received more data than the file header announced.")
+                    self.progress.update(sink.written)
+                patcher.close() # The local copy is replaced next, so its handle has to be closed first.
+                if sink.written != filesize or patcher.digest.hexdigest() != message.get('sha256'): sink.abort(); continue
+                sink.commit(); synced.add(name)
+        return synced
+
+    def _download_archive(self, paths, save_path, extract=True, compression=""):
+        # One tar stream for the whole selection ("" is the whole share): saved as it arrives, or unpacked
+        # member by member into the save folder with the same relative paths and the same atomic sinks.
+        import tarfile
+        from archive import ArchiveReader
+        self.frames.send_message(MSG_COMMAND, {'cmd': CMD_ARCHIVE, 'paths': paths, 'compression': "" if extract else compression})
+        header = self.frames.read_message(MSG_FILE_HEADER)[1]
+        end = {}
+        def next_chunk():
+            msg_type, message = self.frames.read_message(MSG_DATA, MSG_END)
+            if msg_type == MSG_END: end.update(message); return None
+            return message
+        reader = ArchiveReader(next_chunk)
+        self.progress.begin_file(header['name'], header['bytes']) # Unpacked bytes; close enough for a saved archive too.
+        self.gui.update_status(f"{'Unpacking' if extract else 'Saving'}: {header['name']}", COLOR_ACCENT_ACTIVE)
+        skipped = list(header.get('skipped', []))
+        if extract:
+            unpacked = 0
+            with tarfile.open(fileobj=reader, mode='r|*') as tar:
+                for member in tar:
+                    if member.isdir(): os.makedirs(self.target_path(save_path, member.name), exist_ok=True); continue
+                    if not member.isfile(): skipped.append(member.name); continue
+                    source = tar.extractfile(member)
+                    with self.open_sink(save_path, member.name) as sink:
+                        while data := source.read(TEXT_RECV_SIZE):
+                            sink.write(data); self.progress.update(unpacked + sink.written)
+                        sink.commit()
+                    unpacked += member.size
+        else:
+            with self.open_sink(save_path, header['name']) as sink:
+                while data := reader.read():
+                    sink.write(data); self.progress.update(sink.written)
+                sink.commit()
+        reader.drain()
+        return skipped + end.get('skipped', [])
+
+    def _download(self, files_to_download, save_path, resume, streams):
+        if self.frames and streams != 1 and not resume and CAP_PARALLEL in self.caps:
+            return ParallelDownload(self, files_to_download, save_path, streams).run()
+        if self.frames:
+            journal = ResumeJournal(save_path)
+            if resume: files_to_download, offsets = journal.plan(files_to_download)
+            else: journal.entries, offsets = {}, {}
+            self.frames.send_message(MSG_COMMAND, {'cmd': CMD_DOWNLOAD_FILES, 'files': files_to_download, 'offsets': offsets})
+            try: skipped = self._receive_framed(save_path, journal)
+            finally: journal.save(force=True)
+            journal.clear()
+            return skipped
+        self.sock.send(CMD_DOWNLOAD_FILES.encode())
+        self.sock.send(json.dumps(files_to_download).encode('utf-8'))
+        if CAP_PIPELINE in self.caps: final_msg = self._receive_pipelined(save_path)
+        else:
+            for filename in files_to_download:
+                self._receive_text_file(self._recv_until_newline(), save_path)
+                self.sock.send(b'ACK')
+            final_msg = self._recv_until_newline()
+        if 'END_OF_TRANSMISSION' not in final_msg: raise ConnectionError("Unexpected final message from server.")
+        return []
+
+    def _receive_framed(self, save_path, journal):
+        received, skipped, ack_every = 0, [], max(1, self.window // 2)
+        while True:
+            msg_type, message = self.frames.read_message(MSG_FILE_HEADER, MSG_ERROR, MSG_END, MSG_BATCH)
+            if msg_type == MSG_END: break
+            if msg_type == MSG_ERROR: skipped.append(message.get('name')); continue
+            if msg_type == MSG_BATCH:
+                written, failed = self._receive_batch(save_path, message)
+                for filename, filesize in written: journal.complete(filename, filesize)
+                skipped += failed; received += 1
+                if received % ack_every == 0: self.frames.send_message(MSG_ACK, {'count': received})
+                continue
+            filename, filesize, offset = message['name'], message['size'], message.get('offset', 0)
+            if offset: self.gui.update_status(f"Resuming: {filename}", COLOR_ACCENT_ACTIVE)
+            self.progress.begin_file(filename, filesize, offset)
+            journal.start(filename, filesize, offset)
+            decoder = decompressor(message.get('codec'))
+            try:
+                with self.open_sink(save_path, filename, offset, resumable=True, sha256=message.get('sha256'), trailer=message.get('trailer')) as sink:
+                    while sink.written < filesize:
+                        self.write_data(sink, self.frames, decoder, filesize)
+                        journal.progress(filename, sink.written)
+                        self.progress.update(sink.written)
+                    if message.get('trailer'): sink.expected = self.frames.read_message(MSG_DIGEST)[1].get('sha256')
+                    sink.commit()
+                journal.complete(filename)
+            except IntegrityError as e: skipped.append(filename); self.gui.update_status(str(e), COLOR_ERROR)
+            received += 1
+            if received % ack_every == 0: self.frames.send_message(MSG_ACK, {'count': received})
+        self.frames.send_message(MSG_ACK, {'count': received, 'final': True})
+        return skipped
+
+    def _receive_batch(self, save_path, payload):
+        # Small files the server packed into one frame. Returns the (name, size) of those written and the names that failed their check.
+        index, data = split_batch(payload)
+        total = sum(entry[1] for entry in index['files'])
+        if total > MAX_FRAME_SIZE: raise ProtocolError("Batch index announces more data than a frame can carry.")
+        if index.get('codec'): data = decompressor(index['codec']).decompress(data, total)
+        if total != len(data): raise ProtocolError("Batch index does not match its data.")
+        written, failed, position = [], [], 0
+        with BatchSink() as sink:
+            for filename, filesize, sha256 in index['files']:
+                self.progress.begin_file(filename, filesize)
+                try: sink.add(self.target_path(save_path, filename), data[position:position + filesize], sha256); written.append((filename, filesize))
+                except IntegrityError as e: failed.append(filename); self.gui.update_status(str(e), COLOR_ERROR)
+                position += filesize
+                self.progress.update(filesize)
+            sink.commit()
+        return written, failed
+
+    def _receive_pipelined(self, save_path):
+        # Headers and bodies arrive back to back; ACKs are cumulative so the server never waits per file.
+        received, ack_every = 0, max(1, self.window // 2)
+        while (header := self._recv_until_newline()) != 'END_OF_TRANSMISSION':
+            self._receive_text_file(header, save_path)
+            received += 1
+            if received % ack_every == 0: self.sock.sendall(f"{PREFIX_ACK}{received}\n".encode('utf-8'))
+        self.sock.sendall(f"{PREFIX_ACK_FINAL}{received}\n".encode('utf-8'))
+        return header
+
+    def _receive_text_file(self, header, save_path):
+        try: filename_from_server, filesize_str = header.strip().rsplit(':', 1); filesize = int(filesize_str)
+        except ValueError: raise ValueError(f"Invalid header from server: {header}")
+        self.progress.begin_file(filename_from_server, filesize)
+        view = memoryview(bytearray(TEXT_RECV_SIZE))
+        with self.open_sink(save_path, filename_from_server) as sink:
+            while sink.written < filesize:
+                n = self.sock.recv_into(view, min(len(view), filesize - sink.written))
+                if not n: raise ConnectionAbortedError("Connection lost during download.")
+                sink.write(view[:n])
+                self.progress.update(sink.written)
+            sink.commit()
+
+    @staticmethod
+    def target_path(save_path, filename):
+        target = os.path.abspath(os.path.join(save_path, filename))
+        if os.path.commonpath([target, os.path.abspath(save_path)]) != os.path.abspath(save_path):
+            raise ValueError(f"Refusing to write outside the save folder: {filename}")
+        return target
+
+    @staticmethod
+    def open_sink(save_path, filename, offset=0, resumable=False, sha256=None, trailer=False):
+        return FileSink(FileClient.target_path(save_path, filename), offset, resumable, sha256, trailer)
+
+    @staticmethod
+    def write_data(sink, frames, decoder, expected):
+        # One MSG_DATA frame into the sink, decompressed when the file header named a codec. Returns the bytes written.
+        data = frames.read_message(MSG_DATA)[1]
+        if decoder: data = decoder.decompress(data, expected - sink.written)
+        if sink.written + len(data) > expected: raise ProtocolError("Received more data than the file header announced.")
+        sink.write(data)
+        return len(data)
+
+class ParallelDownload:
+    # Spreads a selection over several connections joined to one server session. Files of at least
+    # STRIPE_THRESHOLD bytes are split into byte ranges so one large file also uses every stream.
+    # With streams=None the stream count starts at two and grows while total throughput still improves.
+    def __init__(self, client, files, save_path, streams=None):
+        self.client, self.save_path = client, save_path
+        self.auto = streams is None
+        self.max_streams = max(1, min(streams or client.max_streams, client.max_streams))
+        self.jobs, self.striped = queue.SimpleQueue(), []
+        self.lock, self.error = threading.Lock(), None
+        self.journal = ResumeJournal(save_path); self.journal.entries = {}
+        stats = client.stat_files(files)
+        self.skipped = sorted(set(files) - {stat['name'] for stat in stats})
+        self.total_bytes = sum(stat['size'] for stat in stats)
+        self.progress = client.progress
+        self.progress.reset(self.total_bytes)
+        small = []
+        for stat in stats:
+            name, size = stat['name'], stat['size']
+            if size < STRIPE_THRESHOLD: small.append(name); continue
+            striped = StripedFile(FileClient.target_path(save_path, name), size)
+            self.striped.append(striped)
+            chunk = max(STRIPE_MIN_CHUNK, -(-size // self.max_streams))
+            for offset in range(0, size, chunk): self.jobs.put([(name, offset, min(chunk, size - offset), striped)])
+        for i in range(0, len(small), PARALLEL_BATCH_FILES): self.jobs.put([(name, 0, None, None) for name in small[i:i + PARALLEL_BATCH_FILES]])
+
+    def run(self):
+        threads = []
+        def start_stream():
+            # An extra stream the server refuses (max_streams, max_clients) or that fails to connect only
+            # stops the ramp-up; the streams already open drain the job queue.
+            try: stream = self.client if not threads else self.client.open_stream()
+            except OSError as e:
+                self.auto, self.max_streams = False, len(threads)
+                self.client.gui.update_status(f"Continuing with {len(threads)} stream(s): {e}", COLOR_ACCENT_ACTIVE)
+                return
+            if stream is not self.client: self.progress.parts.append(stream.progress)
+            self.progress.label = f"{len(threads) + 1} streams"
+            thread = threading.Thread(target=self._stream_worker, args=(stream,), daemon=True)
+            threads.append(thread); thread.start()
+        try:
+            for _ in range(2 if self.auto else self.max_streams):
+                if len(threads) < self.max_streams and not self.jobs.empty(): start_stream()
+            last_bytes, best_rate, tick = 0, 0.0, time.monotonic()
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads: thread.join(max(0.0, tick + PARALLEL_RAMP_INTERVAL - time.monotonic()))
+                now, received = time.monotonic(), self.progress.total_done()
+                rate = (received - last_bytes) / max(now - tick, 1e-6)
+                last_bytes, tick = received, now
+                if self.auto and not self.error and not self.jobs.empty() and len(threads) < self.max_streams:
+                    if rate > best_rate * 1.1: best_rate = rate; start_stream()
+                    else: self.auto = False # Adding streams stopped paying off; keep the current count.
+            for thread in threads: thread.join()
+            if self.error: raise self.error
+        except BaseException:
+            for striped in self.striped: striped.abort()
+            raise
+        finally:
+            with self.lock: self.journal.save(force=True)
+            self.progress.done, self.progress.parts, self.progress.label = self.progress.total_done(), [], ""
+        self.journal.clear()
+        return self.skipped
+
+    def _stream_worker(self, stream):
+        try:
+            while not self.error:
+                try: batch = self.jobs.get_nowait()
+                except queue.Empty: break
+                self._fetch(stream, batch)
+        except Exception as e:
+            with self.lock: self.error = self.error or e
+        finally:
+            if stream is not self.client: stream.close()
+
+    def _fetch(self, stream, batch):
+        jobs = {job[0]: job for job in batch}
+        ranges = {name: [offset, length] for name, offset, length, striped in batch if striped}
+        stream.frames.send_message(MSG_COMMAND, {'cmd': CMD_DOWNLOAD_FILES, 'files': list(jobs), 'ranges': ranges})
+        received, ack_every = 0, max(1, stream.window // 2)
+        while True:
+            msg_type, message = stream.frames.read_message(MSG_FILE_HEADER, MSG_ERROR, MSG_END, MSG_BATCH)
+            if msg_type == MSG_END: break
+            if msg_type == MSG_ERROR:
+                with self.lock: self.skipped.append(message.get('name'))
+                continue
+            if msg_type == MSG_BATCH:
+                written, failed = stream._receive_batch(self.save_path, message)
+                with self.lock:
+                    self.skipped += failed
+                    for name, size in written: self.journal.complete(name, size)
+                received += 1
+                if received % ack_every == 0: stream.frames.send_message(MSG_ACK, {'count': received})
+                continue
+            name, size, offset, length = message['name'], message['size'], message['offset'], message['length']
+            striped = jobs.get(name, (None,) * 4)[3]
+            stream.progress.begin_file(name, length)
+            decoder = decompressor(message.get('codec'))
+            try:
+                # Stripes arrive out of order, so only files fetched whole are checked against the header or trailer digest.
+                with (striped.open_range(offset) if striped else FileClient.open_sink(self.save_path, name, sha256=message.get('sha256'), trailer=message.get('trailer'))) as sink:
+                    while sink.written < length:
+                        stream.progress.add(FileClient.write_data(sink, stream.frames, decoder, length))
+                    if message.get('trailer'):
+                        trailer = stream.frames.read_message(MSG_DIGEST)[1].get('sha256')
+                        if not striped: sink.expected = trailer
+                    finished = sink.commit()
+            except IntegrityError:
+                with self.lock: self.skipped.append(name)
+                finished = False
+            if finished:
+                with self.lock: self.journal.complete(name, size)
+            received += 1
+            if received % ack_every == 0: stream.frames.send_message(MSG_ACK, {'count': received})
+        stream.frames.send_message(MSG_ACK, {'count': received, 'final': True})
+
 if __name__ == "__main__":
-    app = ClientGUI()
-    app.mainloop()
\ No newline at end of file
+    run_apps(app=ClientGUI())
\ No newline at end of file
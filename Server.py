@@ -1,16 +1,9 @@
-import os
-import socket
-import threading
-import json
 import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
-import ssl
-import subprocess
-import sys
-import pandas as pd
-import http.server
-import socketserver
+from file_server import FileServer, ServerObserver, ENGINE_THREADED, ENGINE_ASYNCIO
+from telemetry import format_rate, format_eta
+from launcher import run_apps
 
 FONT_FAMILY = "Segoe UI"
 FONT_NORMAL = (FONT_FAMILY, 9)
@@ -30,17 +23,17 @@ COLOR_STATUS_RUNNING = "#1AAE95"
 COLOR_STATUS_STOPPED = "#C74242"
 COLOR_DANGER = "#D32F2F"
 
-CMD_LIST_FILES = "LIST_FILES"
-CMD_DOWNLOAD_FILES = "DOWNLOAD_FILES"
-PREFIX_MSG_C2S = "MSG_C2S:"
-PREFIX_MSG_S2C = "MSG_S2C:"
-PREFIX_WARN_S2C = "WARN_S2C:"
-
-class SecureHTTPServer(http.server.HTTPServer):
-    def __init__(self, server_address, HandlerClass, ssl_context):
-        super().__init__(server_address, HandlerClass)
-        self.ssl_context = ssl_context
-        self.socket = self.ssl_context.wrap_socket(self.socket, server_side=True)
+class GuiObserver(ServerObserver):
+    # Hands server events to the Tk thread.
+    def __init__(self, gui): self.gui = gui
+    def log_event(self, category, ip="-", details=""): self.gui.log_event(category, ip, details)
+    def client_connected(self, client_id, ip): self.gui.after(0, self.gui.add_client_to_tree, client_id, ip)
+    def client_status(self, client_id, status): self.gui.update_client_status(client_id, status)
+    def client_disconnected(self, client_id, ip): self.gui.after(0, self.gui.remove_client_from_tree, client_id)
+    def chat_connected(self, ip): self.gui.after(0, self.gui.add_client_to_chat_list, ip)
+    def chat_received(self, ip, message): self.gui.after(0, self.gui.receive_chat_message, ip, message)
+    def chat_disconnected(self, ip): self.gui.after(0, self.gui.remove_client_from_chat_list, ip)
+    def publish_telemetry(self, reports): self.gui.publish_telemetry(reports)
 
 class ServerGUI(tk.Tk):
     def __init__(self):
@@ -52,7 +45,7 @@ class ServerGUI(tk.Tk):
 
         self.setup_styles()
 
-        self.server = FileServer(self)
+        self.server = FileServer(GuiObserver(self))
         self.log_data = []
         self.chat_histories = {}
         self.open_chat_windows = {}
@@ -61,6 +54,7 @@ class ServerGUI(tk.Tk):
         self.share_mode_var = tk.StringVar(value='directory')
         self.require_password_var = tk.BooleanVar(value=False)
         self.show_password_var = tk.BooleanVar(value=False)
+        self.engine_var = tk.StringVar(value=ENGINE_THREADED)
         self.confirmed_password = None
 
         self.create_widgets()
@@ -149,16 +143,8 @@ class ServerGUI(tk.Tk):
             messagebox.showwarning("Server is Running", "Please stop the server before going back to the launcher.")
             return
 
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        launcher_path = os.path.join(current_dir, "launcher.py")
-
+        self.next_app = "launcher"
         self.destroy()
-        try:
-            subprocess.run([sys.executable, launcher_path], check=True)
-        except FileNotFoundError:
-            messagebox.showerror("Error", f"Launcher.py not found at: {launcher_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to launch launcher.py: {e}")
 
     def create_control_tab(self, tab):
         tab.columnconfigure(0, weight=1)
@@ -182,6 +168,9 @@ class ServerGUI(tk.Tk):
         self.max_clients_input = ttk.Entry(settings_frame, width=8)
         self.max_clients_input.insert(0, "10")
         self.max_clients_input.grid(row=0, column=3, padx=5, pady=5, sticky='w')
+        ttk.Label(settings_frame, text="Engine:", background=COLOR_FRAME_BG).grid(row=0, column=4, padx=(15, 5), pady=5, sticky='w')
+        self.engine_input = ttk.Combobox(settings_frame, textvariable=self.engine_var, values=(ENGINE_THREADED, ENGINE_ASYNCIO), state='readonly', width=10)
+        self.engine_input.grid(row=0, column=5, padx=5, pady=5, sticky='w')
         password_checkbox = ttk.Checkbutton(settings_frame, text="Require Password", variable=self.require_password_var, command=self.toggle_password_fields)
         password_checkbox.grid(row=1, column=0, padx=5, pady=5, sticky='w')
         self.password_input = ttk.Entry(settings_frame, width=15, show="*", state='disabled')
@@ -222,10 +211,11 @@ class ServerGUI(tk.Tk):
         clients_frame.grid(row=0, column=0, sticky="nsew")
         clients_frame.rowconfigure(0, weight=1)
         clients_frame.columnconfigure(0, weight=1)
-        cols = ('Client IP', 'Status', 'Current File', 'Progress')
+        cols = ('Client IP', 'Status', 'Current File', 'Progress', 'Speed', 'ETA')
         self.clients_tree = ttk.Treeview(clients_frame, columns=cols, show='headings')
         for col in cols: self.clients_tree.heading(col, text=col)
         self.clients_tree.column('Client IP', width=120, anchor='center'); self.clients_tree.column('Status', width=120, anchor='center'); self.clients_tree.column('Current File', width=180, anchor='w'); self.clients_tree.column('Progress', width=80, anchor='center')
+        self.clients_tree.column('Speed', width=90, anchor='center'); self.clients_tree.column('ETA', width=70, anchor='center')
         self.clients_tree.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
         actions_frame = ttk.LabelFrame(tab, text="Client Actions")
         actions_frame.grid(row=1, column=0, sticky="ew", pady=(10,0))
@@ -233,6 +223,22 @@ class ServerGUI(tk.Tk):
         disconnect_btn.pack(side=tk.LEFT, padx=10, pady=5)
         send_warn_btn = ttk.Button(actions_frame, text="⚠️ Send Warning", command=self.send_warning_to_client)
         send_warn_btn.pack(side=tk.LEFT, padx=10, pady=5)
+        bandwidth_frame = ttk.LabelFrame(tab, text="Bandwidth (MB/s, 0 = unlimited)")
+        bandwidth_frame.grid(row=2, column=0, sticky="ew", pady=(10,0))
+        ttk.Label(bandwidth_frame, text="Total limit:", background=COLOR_FRAME_BG).grid(row=0, column=0, padx=5, pady=5, sticky='w')
+        self.rate_input = ttk.Entry(bandwidth_frame, width=8)
+        self.rate_input.insert(0, "0")
+        self.rate_input.grid(row=0, column=1, padx=5, pady=5, sticky='w')
+        ttk.Button(bandwidth_frame, text="Apply", command=self.apply_rate_limit).grid(row=0, column=4, padx=5, pady=5, sticky='ew')
+        ttk.Label(bandwidth_frame, text="Selected client limit:", background=COLOR_FRAME_BG).grid(row=1, column=0, padx=5, pady=5, sticky='w')
+        self.client_rate_input = ttk.Entry(bandwidth_frame, width=8)
+        self.client_rate_input.insert(0, "0")
+        self.client_rate_input.grid(row=1, column=1, padx=5, pady=5, sticky='w')
+        ttk.Label(bandwidth_frame, text="Weight:", background=COLOR_FRAME_BG).grid(row=1, column=2, padx=(15, 5), pady=5, sticky='w')
+        self.client_weight_input = ttk.Entry(bandwidth_frame, width=6)
+        self.client_weight_input.insert(0, "1")
+        self.client_weight_input.grid(row=1, column=3, padx=5, pady=5, sticky='w')
+        ttk.Button(bandwidth_frame, text="Apply to Selected", command=self.apply_client_limit).grid(row=1, column=4, padx=5, pady=5, sticky='ew')
 
     def create_chat_tab(self, tab):
         tab.rowconfigure(0, weight=1)
@@ -299,6 +305,10 @@ class ServerGUI(tk.Tk):
             display_widget.see(tk.END)
             display_widget.config(state='disabled')
 
+    def receive_chat_message(self, ip, message):
+        self.update_chat_display(ip, new_message={'sender':'Client', 'msg':message})
+        if not (ip in self.open_chat_windows and self.open_chat_windows[ip]['window'].winfo_exists()): self.show_chat_notification(ip)
+
     def send_warning_to_client(self):
         if not self.clients_tree.selection():
             messagebox.showwarning("No Selection", "Please select a client from the Client Management list first.")
@@ -343,19 +353,19 @@ class ServerGUI(tk.Tk):
                 port, max_clients = int(self.port_input.get()), int(self.max_clients_input.get())
             except ValueError:
                 messagebox.showerror("Error", "Port and Max Clients must be valid numbers."); return
-            success, msg = self.server.start(port, self.selected_path_var.get(), self.share_mode_var.get(), password_to_start, max_clients)
+            success, msg = self.server.start(port, self.selected_path_var.get(), self.share_mode_var.get(), password_to_start, max_clients, self.engine_var.get())
             if success:
-                self.toggle_btn.config(text="⏹️ Stop"); self.pause_btn.config(state='normal')
+                self.toggle_btn.config(text="⏹️ Stop"); self.pause_btn.config(state='normal'); self.engine_input.config(state='disabled')
                 ip = self.server.get_local_ip()
                 self.status_label.config(text="Status: Running", foreground=COLOR_STATUS_RUNNING)
                 self.ip_label.config(text=f"Server IP: {ip}")
                 self.web_label.config(text=f"Web Access: https://{ip}:{self.server.web_port}")
-                self.log_event("Server Status", details=f"Server ({'Secure' if password_to_start else 'Open'} Mode) started on {ip}:{port}")
+                self.log_event("Server Status", details=f"Server ({'Secure' if password_to_start else 'Open'} Mode, {self.server.engine} engine) started on {ip}:{port}")
             else:
                 self.log_event("Error", details=msg); messagebox.showerror("Error", msg)
         else:
             self.server.stop()
-            self.toggle_btn.config(text="▶️ Start"); self.pause_btn.config(text='⏸️ Pause', state='disabled')
+            self.toggle_btn.config(text="▶️ Start"); self.pause_btn.config(text='⏸️ Pause', state='disabled'); self.engine_input.config(state='readonly')
             self.status_label.config(text="Status: Stopped", foreground=COLOR_STATUS_STOPPED)
             self.ip_label.config(text="Server IP: -"); self.web_label.config(text="Web Access: -")
             self.log_event(category="Server Status", details="Server stopped")
@@ -377,10 +387,25 @@ class ServerGUI(tk.Tk):
         path = filedialog.askdirectory(title="Select Directory") if self.share_mode_var.get() == 'directory' else filedialog.askopenfilename(title="Select File")
         if path: self.selected_path_var.set(path)
 
+    def apply_rate_limit(self):
+        try: rate = float(self.rate_input.get() or 0)
+        except ValueError: messagebox.showerror("Error", "The limit must be a number (0 for unlimited)."); return
+        self.server.scheduler.set_rate(int(rate * 1e6))
+        self.log_event("Server Status", details=f"Total bandwidth limit: {format_rate(rate * 1e6) if rate > 0 else 'unlimited'}.")
+
+    def apply_client_limit(self):
+        if not self.clients_tree.selection(): messagebox.showwarning("No Selection", "Please select a client from the Client Management list first."); return
+        client_ip = self.clients_tree.item(self.clients_tree.selection()[0])['values'][0]
+        try:
+            limit, weight = float(self.client_rate_input.get() or 0), float(self.client_weight_input.get() or 1)
+            self.server.scheduler.set_client(client_ip, int(limit * 1e6), weight)
+        except ValueError: messagebox.showerror("Error", "Limit must be a number and weight a positive number."); return
+        self.log_event("Server Status", client_ip, f"Bandwidth limit: {format_rate(limit * 1e6) if limit > 0 else 'unlimited'}, weight {weight:g}.")
+
     def disconnect_client(self):
         if not self.clients_tree.selection(): messagebox.showwarning("No Selection", "Please select a client to disconnect."); return
-        client_ip = self.clients_tree.item(self.clients_tree.selection()[0])['values'][0]
-        if client_ip in self.server.clients_info: self.server.clients_info[client_ip]['socket'].close()
+        client_id = self.clients_tree.selection()[0]
+        if client_id in self.server.clients_info: self.server.clients_info[client_id]['socket'].close()
 
     def log_event(self, category, ip="-", details=""):
         self.after(0, self._log_event_gui, category, ip, details)
@@ -396,7 +421,11 @@ class ServerGUI(tk.Tk):
         filepath = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel Files", "*.xlsx"), ("Text Files", "*.txt"), ("All Files", "*.*")], title="Save Logs As")
         if not filepath: return
         try:
-            if filepath.endswith('.xlsx'): pd.DataFrame(self.log_data).to_excel(filepath, index=False, engine='openpyxl')
+            if filepath.endswith('.xlsx'):
+                # pandas and openpyxl take longer to import than the whole GUI, so they load on first export.
+                try: import pandas as pd
+                except ImportError: messagebox.showerror("Export Error", "Excel export needs pandas and openpyxl. Run: pip install pandas openpyxl"); return
+                pd.DataFrame(self.log_data).to_excel(filepath, index=False, engine='openpyxl')
             else:
                 with open(filepath, 'w', encoding='utf-8') as f:
                     f.write('\t'.join(self.log_data[0].keys()) + '\n')
@@ -404,14 +433,12 @@ class ServerGUI(tk.Tk):
             messagebox.showinfo("Success", f"Logs successfully exported to\n{filepath}")
         except Exception as e: messagebox.showerror("Export Error", f"Failed to export logs: {e}")
 
-    def add_client_to_tree(self, ip):
+    def add_client_to_tree(self, client_id, ip):
         if ip not in self.chat_histories: self.chat_histories[ip] = []
-        return self.clients_tree.insert("", tk.END, values=(ip, "Authenticating", "-", "0%"))
+        if not self.clients_tree.exists(client_id): self.clients_tree.insert("", tk.END, iid=client_id, values=(ip, "Authenticating", "-", "0%", "-", "-"))
 
-    def remove_client_from_tree(self, ip):
-        if ip in self.server.clients_info and (tree_id := self.server.clients_info[ip].get('tree_id')):
-            try: self.clients_tree.delete(tree_id)
-            except tk.TclError: pass
+    def remove_client_from_tree(self, client_id):
+        if self.clients_tree.exists(client_id): self.clients_tree.delete(client_id)
     
     def add_client_to_chat_list(self, ip): self.chat_listbox.insert(tk.END, ip)
 
@@ -421,237 +448,16 @@ class ServerGUI(tk.Tk):
             if ip in items: self.chat_listbox.delete(items.index(ip))
         except tk.TclError: pass
 
-    def _update_client_tree(self, ip, column_name, value):
-        if ip in self.server.clients_info and (tree_id := self.server.clients_info[ip].get('tree_id')):
-            try: self.clients_tree.set(tree_id, column_name, value)
-            except tk.TclError: pass
-
-    def update_client_status(self, ip, status): self.after(0, self._update_client_tree, ip, 'Status', status)
-    def update_client_file(self, ip, filename): self.after(0, self._update_client_tree, ip, 'Current File', filename)
-    def update_client_progress(self, ip, progress): self.after(0, self._update_client_tree, ip, 'Progress', progress)
-
-class FileServer:
-    def __init__(self, gui):
-        self.gui = gui
-        self.host = '0.0.0.0'
-        self.port, self.chat_port, self.web_port = 0, 0, 0
-        self.server_socket, self.chat_socket, self.web_server = None, None, None
-        self.running, self.is_paused = False, False
-        self.share_mode, self.shared_path = 'directory', ""
-        self.clients_info, self.chat_clients, self.password, self.max_clients = {}, {}, None, 10
-        self.ssl_context = None
-
-    def _generate_certs(self):
-        key_file, cert_file = "server.key", "server.crt"
-        if os.path.exists(key_file) and os.path.exists(cert_file): return True, ""
-        try:
-            from OpenSSL import crypto
-            pkey = crypto.PKey(); pkey.generate_key(crypto.TYPE_RSA, 2048)
-            cert = crypto.X509(); cert.get_subject().CN = self.get_local_ip()
-            cert.set_serial_number(1000); cert.gmtime_adj_notBefore(0); cert.gmtime_adj_notAfter(10*365*24*60*60)
-            cert.set_issuer(cert.get_subject()); cert.set_pubkey(pkey); cert.sign(pkey, 'sha256')
-            with open(cert_file, "wt") as f: f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert).decode('utf-8'))
-            with open(key_file, "wt") as f: f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey).decode('utf-8'))
-            return True, ""
-        except ImportError: return False, "PyOpenSSL is required. Run: pip install pyopenssl"
-        except Exception as e: return False, f"Could not generate SSL certs: {e}"
-
-    def start(self, port, path, mode, password, max_clients):
-        if not path or not os.path.exists(path): return False, "Selected path does not exist."
-        certs_ok, msg = self._generate_certs();
-        if not certs_ok: return False, msg
-        
-        self.port, self.chat_port, self.web_port = int(port), int(port) + 1, int(port) + 2
-        self.shared_path, self.share_mode, self.password, self.max_clients = os.path.abspath(path), mode, password, int(max_clients)
-        
-        try:
-            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            self.ssl_context.load_cert_chain(certfile="server.crt", keyfile="server.key")
-            self.server_socket = self._create_listening_socket(self.port)
-            self.chat_socket = self._create_listening_socket(self.chat_port)
-            def handler_factory(directory, server_instance):
-                class CustomHandler(http.server.SimpleHTTPRequestHandler):
-                    def __init__(self, *args, **kwargs): super().__init__(*args, directory=directory, **kwargs)
-                    def do_GET(self):
-                        if server_instance.password:
-                            self.send_response(403); self.send_header("Content-type", "text/html; charset=utf-8"); self.end_headers()
-                            self.wfile.write(b"<h1>403 Forbidden</h1><p>Web access is disabled when server is password-protected.</p>")
-                            return
-                        super().do_GET()
-                return CustomHandler
-            handler = handler_factory(self.shared_path, self)
-            self.web_server = SecureHTTPServer((self.host, self.web_port), handler, self.ssl_context)
-            self.running = True
-            threading.Thread(target=self.accept_connections, args=(self.server_socket, self.handle_file_client), daemon=True).start()
-            threading.Thread(target=self.accept_connections, args=(self.chat_socket, self.handle_chat_client), daemon=True).start()
-            threading.Thread(target=self.web_server.serve_forever, daemon=True).start()
-            time.sleep(0.2)
-            return True, ""
-        except Exception as e: return False, str(e)
-
-    def _create_listening_socket(self, port):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.host, port)); sock.listen(5)
-        return self.ssl_context.wrap_socket(sock, server_side=True)
-
-    def stop(self):
-        self.running = False
-        if self.web_server: self.web_server.shutdown(); self.web_server.server_close()
-        for sock in [self.server_socket, self.chat_socket]:
-            if sock: sock.close()
-        for ip in list(self.clients_info.keys()):
-            if self.clients_info[ip].get('socket'): self.clients_info[ip]['socket'].close()
-        for ip in list(self.chat_clients.keys()):
-            if self.chat_clients[ip]: self.chat_clients[ip].close()
-        self.clients_info.clear(); self.chat_clients.clear()
-
-    def accept_connections(self, listening_socket, handler_func):
-        while self.running:
-            try:
-                client_socket, addr = listening_socket.accept()
-                if self.is_paused or len(self.clients_info) >= self.max_clients and handler_func == self.handle_file_client:
-                    client_socket.close()
-                    continue
-                threading.Thread(target=handler_func, args=(client_socket, addr[0]), daemon=True).start()
-            except (socket.error, ssl.SSLError): break
-
-    def handle_chat_client(self, chat_socket, ip):
-        self.chat_clients[ip] = chat_socket
-        self.gui.log_event("Chat", ip, "Chat connection established.")
-        self.gui.after(0, self.gui.add_client_to_chat_list, ip)
-        while self.running:
-            try:
-                data = chat_socket.recv(1024)
-                if not data: break
-                message = data.decode('utf-8')
-                if message.startswith(PREFIX_MSG_C2S):
-                    payload = message.split(":", 1)[1]
-                    self.gui.log_event("Chat", ip, f"Received: '{payload}'")
-                    self.gui.update_chat_display(ip, new_message={'sender':'Client', 'msg':payload})
-                    if not (ip in self.gui.open_chat_windows and self.gui.open_chat_windows[ip]['window'].winfo_exists()):
-                        self.gui.show_chat_notification(ip)
-            except (ConnectionResetError, ssl.SSLError): break
-        self.gui.log_event("Chat", ip, "Chat connection lost.")
-        if ip in self.chat_clients: self.chat_clients[ip].close(); del self.chat_clients[ip]
-        self.gui.after(0, self.gui.remove_client_from_chat_list, ip)
-
-    def send_chat_message(self, ip, comm_type, payload):
-        if ip in self.chat_clients:
-            try:
-                prefix = PREFIX_MSG_S2C if comm_type == "MSG" else PREFIX_WARN_S2C
-                self.chat_clients[ip].sendall(f"{prefix}{payload}".encode('utf-8'))
-                return True
-            except (ConnectionResetError, BrokenPipeError): return False
-        return False
-        
-    def handle_file_client(self, client_socket, client_ip):
-        tree_id = self.gui.add_client_to_tree(client_ip)
-        self.clients_info[client_ip] = {'socket': client_socket, 'tree_id': tree_id}
-        try:
-            self.gui.log_event("Connection", client_ip, "Authenticating...")
-            if self.password:
-                client_socket.sendall(b'NEEDS_PASS')
-                client_socket.settimeout(10.0)
-                password = client_socket.recv(1024).decode()
-                if password != self.password:
-                    client_socket.sendall(b"AUTH_FAILED"); self.gui.log_event("Authentication", client_ip, "Failed (Incorrect password)."); return
-                client_socket.sendall(b"AUTH_SUCCESS"); self.gui.log_event("Authentication", client_ip, "Successful.")
-            else:
-                client_socket.sendall(b'NO_PASS'); self.gui.log_event("Authentication", client_ip, "Successful (No password).")
-            self.gui.update_client_status(client_ip, "Connected")
-            client_socket.settimeout(None)
-            while self.running:
-                command_bytes = client_socket.recv(1024)
-                if not command_bytes: break
-                command = command_bytes.decode()
-                if command == CMD_LIST_FILES:
-                    self.gui.update_client_status(client_ip, "Listing files")
-                    files = []
-                    if self.share_mode == 'directory':
-                        for root, _, fnames in os.walk(self.shared_path):
-                            for fname in fnames:
-                                relative_path = os.path.relpath(os.path.join(root, fname), self.shared_path)
-                                files.append(relative_path.replace("\\", "/")) # Ensure forward slashes for cross-platform
-                    else: # share_mode == 'file'
-                        files = [os.path.basename(self.shared_path)]
-                    
-                    client_socket.sendall(json.dumps(files).encode('utf-8'))
-                    self.gui.update_client_status(client_ip, "Idle")
-                elif command == CMD_DOWNLOAD_FILES:
-                    requested_files = json.loads(client_socket.recv(4096).decode('utf-8'))
-                    self.gui.log_event("File Transfer", client_ip, f"Requested {len(requested_files)} file(s).")
-                    for filename in requested_files:
-                        
-                        # --- IMPORTANT SECURITY CONSIDERATION ---
-                        # This section is modified to allow downloading files from subdirectories
-                        # based on the relative path provided by the client.
-                        # It is CRUCIAL that 'filename' coming from the client is a CLEAN, RELATIVE path
-                        # without any '..' (path traversal) components.
-                        # The os.path.normpath and startswith check below help mitigate this,
-                        # but careful client-side behavior is also needed.
-
-                        file_full_path = os.path.abspath(os.path.join(self.shared_path, filename))
-                        
-                        # If sharing a single file, only that specific file can be downloaded
-                        if self.share_mode == 'file':
-                            if file_full_path != os.path.abspath(self.shared_path):
-                                self.gui.log_event("Security Alert", client_ip, f"Attempted to download file outside shared single file: {filename}")
-                                continue
-                            filename = os.path.basename(self.shared_path) # Ensure client gets the correct name
-                        else: # directory mode
-                            # Prevent path traversal: ensure the requested file is actually within the shared_path directory
-                            # This is the crucial part for cross-drive/subdirectory access IF they are children of shared_path
-                            
-                            # Normalize path to resolve '..' and other redundant components
-                            normalized_shared_path = os.path.normpath(self.shared_path)
-                            normalized_file_full_path = os.path.normpath(file_full_path)
-
-                            # Check if the requested file path starts with the shared directory path
-                            # This should allow subdirectories within the shared folder, even if on another drive.
-                            if not normalized_file_full_path.startswith(normalized_shared_path):
-                                self.gui.log_event("Security Alert", client_ip, f"Attempted path traversal: {filename}")
-                                continue
-                            
-                            # Ensure it's a file and accessible
-                            if not os.path.isfile(file_full_path):
-                                self.gui.log_event("File Transfer", client_ip, f"Requested non-existent or directory: {filename}")
-                                continue
-                        # --- END SECURITY CONSIDERATION ---
-
-                        req_path = file_full_path # Use the validated full path
-                        
-                        self.gui.update_client_status(client_ip, "Downloading"); self.gui.update_client_file(client_ip, filename)
-                        filesize = os.path.getsize(req_path)
-                        client_socket.sendall(f"{filename}:{filesize}\n".encode('utf-8'))
-                        with open(req_path, 'rb') as f:
-                            sent_bytes = 0
-                            while (chunk := f.read(4096)):
-                                if self.is_paused: time.sleep(1)
-                                client_socket.sendall(chunk)
-                                sent_bytes += len(chunk)
-                                self.gui.update_client_progress(client_ip, f"{int((sent_bytes/filesize)*100)}%")
-                        client_socket.recv(1024)
-                        self.gui.log_event("File Transfer", client_ip, f"Successfully sent '{filename}'.")
-                    client_socket.sendall(b'END_OF_TRANSMISSION\n')
-                    self.gui.update_client_status(client_ip, "Completed"); self.gui.update_client_file(client_ip, "-")
-        except (socket.timeout, ConnectionResetError, ssl.SSLEOFError): self.gui.log_event("Error", client_ip, "Connection lost.")
-        except Exception as e: self.gui.log_event("Error", client_ip, f"An unexpected error occurred: {e}")
-        finally:
-            self.gui.log_event("Connection", client_ip, "Client disconnected.")
-            self.gui.update_client_status(client_ip, "Disconnected")
-            self.gui.remove_client_from_tree(client_ip)
-            if client_ip in self.clients_info: del self.clients_info[client_ip]
-            client_socket.close()
-
-    @staticmethod
-    def get_local_ip():
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); s.settimeout(0.1); s.connect(('8.8.8.8', 1)); IP = s.getsockname()[0]
-        except Exception: IP = '127.0.0.1'
-        finally: s.close()
-        return IP
+    def _update_client_tree(self, client_id, column_name, value):
+        if self.clients_tree.exists(client_id): self.clients_tree.set(client_id, column_name, value)
+
+    def update_client_status(self, client_id, status): self.after(0, self._update_client_tree, client_id, 'Status', status)
+    def publish_telemetry(self, reports): self.after(0, self._apply_telemetry, reports)
+
+    def _apply_telemetry(self, reports):
+        for report in reports:
+            for column, value in (('Current File', report['file'] or "-"), ('Progress', f"{report['file_percent']}%"), ('Speed', format_rate(report['rate'])), ('ETA', format_eta(report['eta']))):
+                self._update_client_tree(report['key'], column, value)
 
 if __name__ == "__main__":
-    app = ServerGUI()
-    app.mainloop()
\ No newline at end of file
+    run_apps(app=ServerGUI())
\ No newline at end of file
@@ -0,0 +1,342 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import math
+import ssl
+import threading
+import time
+from protocol import (CMD_HELLO, CAP_PIPELINE, CAP_FRAMES, CMD_LIST_FILES, CMD_DOWNLOAD_FILES, CMD_STAT_FILES, CMD_SYNC_FILE, CMD_ARCHIVE,
+                      MSG_COMMAND, MSG_LISTING, MSG_FILE_HEADER, MSG_DATA, MSG_ACK, MSG_ERROR, MSG_END, MSG_DIGEST, FRAME_HEADER, decode_message, pack_header, unpack_header)
+from transfer import SEND_WINDOW
+from tls import HANDSHAKE_TIMEOUT
+
+FILE_IO_WORKERS = 4
+WRITE_BUFFER_LIMIT = 4 * SEND_WINDOW
+AUTH_TIMEOUT = 10.0
+START_TIMEOUT = 5.0
+TIMED_HANDSHAKE = hasattr(asyncio.StreamWriter, 'start_tls') # Python 3.11+
+
+class AsyncFrameStream:
+    # FrameSocket for asyncio streams; every send waits on drain() so a slow reader applies backpressure.
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    async def read_frame(self, eof_ok=False):
+        try: header = await self.reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if eof_ok and not e.partial: return None, None
+            raise ConnectionResetError("Socket connection broken") from None
+        msg_type, length = unpack_header(header)
+        try: return msg_type, memoryview(await self.reader.readexactly(length))
+        except asyncio.IncompleteReadError: raise ConnectionResetError("Socket connection broken") from None
+
+    async def read_message(self, *expected, eof_ok=False):
+        msg_type, payload = await self.read_frame(eof_ok)
+        if msg_type is None: return None, None
+        return msg_type, decode_message(msg_type, payload, expected)
+
+    async def send_frame(self, msg_type, payload=b""):
+        self.writer.write(pack_header(msg_type, len(payload)) + payload)
+        await self.writer.drain()
+
+    async def send_message(self, msg_type, obj):
+        await self.send_frame(msg_type, json.dumps(obj).encode('utf-8'))
+
+class AsyncConnection:
+    # Thread-safe stand-in for a client socket, so the GUI can close connections and send chat
+    # messages from the Tk thread without caring which engine owns them.
+    def __init__(self, loop, writer):
+        self.loop, self.writer = loop, writer
+
+    def _call(self, func, *args):
+        if self.loop.is_closed(): raise BrokenPipeError("Connection is closed")
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def sendall(self, data): self._call(self.writer.write, bytes(data))
+    def close(self):
+        try: self._call(self.writer.transport.abort)
+        except BrokenPipeError: pass
+
+class AsyncFileEngine:
+    # Serves the file and chat ports from one event loop thread instead of a thread per connection.
+    # Protocol handling mirrors FileServer.handle_file_client and reuses its helpers; blocking file
+    # reads and directory walks run on a small bounded executor.
+    def __init__(self, server, io_workers=FILE_IO_WORKERS):
+        self.server, self.observer = server, server.observer
+        self.loop, self.thread, self.listeners = None, None, []
+        self.limits_changed = asyncio.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="file-io")
+
+    def start(self, host, port, chat_port, ssl_context, backlog):
+        self.loop = asyncio.new_event_loop()
+        ready = concurrent.futures.Future()
+        self.thread = threading.Thread(target=self._run, args=(ready, host, port, chat_port, ssl_context, backlog), daemon=True)
+        self.thread.start()
+        ready.result(timeout=START_TIMEOUT)
+        self.server.scheduler.subscribe(self._limits_changed)
+
+    def _run(self, ready, host, port, chat_port, ssl_context, backlog):
+        asyncio.set_event_loop(self.loop)
+        try:
+            # With start_tls the handshake runs inside _serve, where it can be timed like the threaded engine's.
+            tls = None if TIMED_HANDSHAKE else ssl_context
+            self.listeners = [self.loop.run_until_complete(asyncio.start_server(lambda r, w, h=handler: self._serve(h, r, w, ssl_context), host, listen_port, ssl=tls,
+                                                                               ssl_handshake_timeout=HANDSHAKE_TIMEOUT if tls else None, backlog=backlog, reuse_address=True))
+                              for handler, listen_port in ((self.handle_file_client, port), (self.handle_chat_client, chat_port))]
+        except Exception as e:
+            for listener in self.listeners: listener.close()
+            self.loop.close(); ready.set_exception(e); return
+        ready.set_result(True)
+        try: self.loop.run_forever()
+        finally:
+            for listener in self.listeners: listener.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks: task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def stop(self):
+        self.server.scheduler.unsubscribe(self._limits_changed)
+        if self.loop and not self.loop.is_closed(): self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread: self.thread.join(timeout=START_TIMEOUT)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _serve(self, handler, reader, writer, ssl_context):
+        # Swallowing the shutdown cancellation keeps asyncio.streams from logging every open connection on stop().
+        try:
+            if TIMED_HANDSHAKE and not await self._handshake(writer, ssl_context): return
+            await handler(reader, writer)
+        except asyncio.CancelledError: pass
+
+    async def _handshake(self, writer, ssl_context):
+        ip, started = writer.get_extra_info('peername')[0], time.perf_counter()
+        try: await writer.start_tls(ssl_context, ssl_handshake_timeout=HANDSHAKE_TIMEOUT)
+        except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+            writer.close(); self.server.handshakes.failed()
+            self.observer.log_event("Connection", ip, f"TLS handshake failed: {e or type(e).__name__}")
+            return False
+        self.server._handshake_done(ip, writer.get_extra_info('ssl_object'), time.perf_counter() - started)
+        return True
+
+    def task_count(self):
+        # all_tasks() may only be called on the loop's thread; None once the loop is gone or too busy to answer.
+        async def count(): return len(asyncio.all_tasks()) - 1 # Not counting this one.
+        try: return asyncio.run_coroutine_threadsafe(count(), self.loop).result(timeout=1.0)
+        except (RuntimeError, concurrent.futures.TimeoutError): return None
+
+    def _io(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def _send(self, writer, data):
+        writer.write(data)
+        await writer.drain()
+
+    async def handle_chat_client(self, reader, writer):
+        ip = writer.get_extra_info('peername')[0]
+        if self.server.is_paused: self.server.metrics.rejected("paused"); writer.close(); return
+        connection = AsyncConnection(self.loop, writer)
+        self.server._chat_connected(ip, connection)
+        try:
+            while self.server.running:
+                data = await reader.read(1024)
+                if not data: break
+                self.server._chat_received(ip, data)
+        except (ConnectionResetError, ssl.SSLError): pass
+        finally: self.server._chat_disconnected(ip, connection)
+
+    async def handle_file_client(self, reader, writer):
+        server, observer = self.server, self.observer
+        client_ip, peer_port = writer.get_extra_info('peername')[:2]
+        if server.is_paused: server.metrics.rejected("paused"); writer.close(); return # max_clients is applied by server._admit.
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        client_id = server._register_client(client_ip, peer_port, AsyncConnection(self.loop, writer))
+        try:
+            observer.log_event("Connection", client_ip, "Authenticating...")
+            if server.password:
+                await self._send(writer, b'NEEDS_PASS')
+                password = (await asyncio.wait_for(reader.read(1024), AUTH_TIMEOUT)).decode()
+                if password != server.password:
+                    await self._send(writer, b"AUTH_FAILED"); server.metrics.auth_failed(); observer.log_event("Authentication", client_ip, "Failed (Incorrect password)."); return
+                await self._send(writer, b"AUTH_SUCCESS"); observer.log_event("Authentication", client_ip, "Successful.")
+            else:
+                await self._send(writer, b'NO_PASS'); observer.log_event("Authentication", client_ip, "Successful (No password).")
+            observer.client_status(client_id, "Connected")
+            session = {'id': client_id, 'caps': set(), 'window': 1, 'frames': None, 'codec': None, 'progress': server.clients_info[client_id]['progress']}
+            admitted = False
+            while server.running:
+                frames = session['frames']
+                if frames:
+                    _, request = await frames.read_message(MSG_COMMAND, eof_ok=True)
+                    if request is None: break
+                    command = request.get('cmd', "")
+                else:
+                    command_bytes = await reader.read(1024)
+                    if not command_bytes: break
+                    command, request = command_bytes.decode('utf-8', 'replace'), {}
+                if not admitted:
+                    if (refusal := server._admit(client_id, client_ip, command)) is not None:
+                        if refusal: await self._send(writer, refusal)
+                        break
+                    admitted = True
+                if command.startswith(CMD_HELLO) and not frames:
+                    await self._send(writer, server._negotiation_reply(client_ip, command, session))
+                    session['frames'] = AsyncFrameStream(reader, writer) if CAP_FRAMES in session['caps'] else None
+                elif command == CMD_LIST_FILES:
+                    observer.client_status(client_id, "Listing files")
+                    started = time.perf_counter()
+                    if frames and 'page_size' in request:
+                        for page in await self._io(server._listing_pages, request): await frames.send_frame(MSG_LISTING, page)
+                    elif frames: await frames.send_frame(MSG_LISTING, await self._io(server._listing_payload))
+                    else: await self._send(writer, await self._io(server._listing_payload))
+                    server.metrics.list_latency.observe(time.perf_counter() - started)
+                    observer.client_status(client_id, "Idle")
+                elif command == CMD_STAT_FILES and frames:
+                    await frames.send_message(MSG_LISTING, await self._io(server._stat_files, client_ip, request.get('files', [])))
+                elif command.startswith(CMD_DOWNLOAD_FILES):
+                    requested_files = request.get('files', []) if frames else await self._read_json(reader, command_bytes[len(CMD_DOWNLOAD_FILES):])
+                    await self._send_files(reader, writer, client_ip, requested_files, session, request.get('offsets', {}), request.get('ranges', {}))
+                elif command == CMD_SYNC_FILE and frames:
+                    await self._sync_file(client_ip, request, session)
+                elif command == CMD_ARCHIVE and frames:
+                    await self._send_archive(client_ip, request, session)
+                elif frames:
+                    await frames.send_message(MSG_ERROR, {'message': f"Unknown command: {command}"})
+        except (asyncio.TimeoutError, ConnectionResetError, ssl.SSLError): observer.log_event("Error", client_ip, "Connection lost.")
+        except Exception as e: observer.log_event("Error", client_ip, f"An unexpected error occurred: {e}")
+        finally:
+            server._release_client(client_id, client_ip)
+            writer.close()
+
+    async def _read_json(self, reader, data=b""):
+        while True:
+            if data:
+                try: return json.loads(data.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError): pass
+            chunk = await reader.read(65536)
+            if not chunk: raise ConnectionResetError("Socket connection broken")
+            data += chunk
+
+    async def _recv_ack(self, reader, frames=None):
+        if frames:
+            ack = (await frames.read_message(MSG_ACK))[1]
+            return ack['count'], ack.get('final', False)
+        line = await reader.readline()
+        if not line.endswith(b'\n'): raise ConnectionResetError("Socket connection broken")
+        return self.server._parse_ack(line)
+
+    def _limits_changed(self):
+        try: self.loop.call_soon_threadsafe(self.limits_changed.set)
+        except RuntimeError: pass # The loop has already been closed.
+
+    async def _throttle(self, key, nbytes):
+        # Waits on the shared scheduler without blocking the loop; a limit change or resume wakes every waiter.
+        while delay := self.server.scheduler.try_acquire(key, nbytes):
+            self.limits_changed.clear()
+            try: await asyncio.wait_for(self.limits_changed.wait(), None if delay == math.inf else delay)
+            except asyncio.TimeoutError: pass
+
+    async def _send_files(self, reader, writer, client_ip, requested_files, session, offsets=None, ranges=None):
+        server, observer, frames = self.server, self.observer, session['frames']
+        observer.log_event("File Transfer", client_ip, f"Requested {len(requested_files)} file(s).")
+        window, pipelined, progress = session['window'], CAP_PIPELINE in session['caps'], session['progress']
+        sent_count, acked, batch = 0, 0, server._batch_for(session)
+        progress.reset(); observer.client_status(session['id'], "Downloading")
+        for filename in requested_files:
+            plan = await self._io(server._plan_file, client_ip, filename, frames is not None, offsets, ranges, batch)
+            if not plan:
+                if frames: await frames.send_message(MSG_ERROR, {'name': filename, 'message': "File is not available."})
+                continue
+            filename, req_path, filesize, offset, length, batched = plan
+            if server._batchable(batch, filesize, offset, length):
+                if not batched:
+                    sent_count, acked = await self._send_batch(reader, writer, client_ip, batch, session, sent_count, acked)
+                    await self._io(batch.add, req_path, filename, length)
+                progress.begin_file(filename, filesize); progress.update(length)
+                continue
+            sent_count, acked = await self._send_batch(reader, writer, client_ip, batch, session, sent_count, acked)
+            while pipelined and sent_count - acked >= window: acked, _ = await self._recv_ack(reader, frames)
+            compressor = await self._io(server._compressor_for, session, req_path, length)
+            progress.begin_file(filename, filesize, offset)
+            key = None
+            if frames:
+                digest, key = await self._io(server._file_digest, session, req_path, filesize, offset, length)
+                await frames.send_message(MSG_FILE_HEADER, {'name': filename, 'size': filesize, 'offset': offset, 'length': length, 'codec': compressor and compressor.codec, 'sha256': digest, 'trailer': key is not None})
+            else: await self._send(writer, f"{filename}:{filesize}\n".encode('utf-8'))
+            if offset and not ranges: observer.log_event("File Transfer", client_ip, f"Resuming '{filename}' at byte {offset}.")
+            hasher = hashlib.sha256() if key else None
+            f = await self._io(open, req_path, 'rb')
+            try:
+                await self._io(f.seek, offset)
+                sent = 0
+                while sent < length:
+                    await self._throttle(client_ip, min(SEND_WINDOW, length - sent))
+                    data = await self._io(self._read_window, f, min(SEND_WINDOW, length - sent), hasher)
+                    if not data: raise OSError(f"File shrank during transfer ({sent} of {length} bytes sent)")
+                    payload = await self._io(compressor.compress, data) if compressor else data
+                    if frames: writer.write(pack_header(MSG_DATA, len(payload)))
+                    await self._send(writer, payload)
+                    sent += len(data)
+                    progress.update(offset + sent)
+            finally: await self._io(f.close)
+            if hasher: await frames.send_message(MSG_DIGEST, await self._io(server._digest_trailer, req_path, key, hasher))
+            sent_count += 1
+            if not pipelined: await reader.read(1024)
+            server.metrics.served()
+            observer.log_event("File Transfer", client_ip, server._sent_message(filename, compressor))
+        sent_count, acked = await self._send_batch(reader, writer, client_ip, batch, session, sent_count, acked)
+        if frames: await frames.send_message(MSG_END, {'count': sent_count})
+        else: await self._send(writer, b'END_OF_TRANSMISSION\n')
+        final = not pipelined
+        while not final: acked, final = await self._recv_ack(reader, frames)
+        progress.finish(); observer.client_status(session['id'], "Completed")
+
+    @staticmethod
+    def _read_window(f, size, hasher):
+        # Read and hash in one trip to the pool; hashlib releases the GIL on large buffers.
+        data = f.read(size)
+        if hasher: hasher.update(data)
+        return data
+
+    async def _send_batch(self, reader, writer, client_ip, batch, session, sent_count, acked):
+        if not batch or not batch.index: return sent_count, acked
+        while sent_count - acked >= session['window']: acked, _ = await self._recv_ack(reader, session['frames'])
+        frame, count = await self._io(batch.take) # Compressing a batch stays off the loop thread.
+        await self._throttle(client_ip, len(frame))
+        await self._send(writer, frame)
+        self.server.metrics.served(count)
+        self.observer.log_event("File Transfer", client_ip, self.server._batch_message(count, len(frame)))
+        return sent_count + 1, acked
+
+    async def _sync_file(self, client_ip, request, session):
+        server, frames, progress = self.server, session['frames'], session['progress']
+        plan, header = await self._io(server._plan_delta, client_ip, request, session)
+        if not plan: await frames.send_message(MSG_ERROR, header); return
+        filename, filesize, encoder, compressor = plan
+        progress.reset(); progress.begin_file(filename, filesize); self.observer.client_status(session['id'], "Syncing")
+        await frames.send_message(MSG_FILE_HEADER, header)
+        delta_frames = server._delta_frames(encoder, compressor)
+        while frame := await self._io(next, delta_frames, None): # Matching and compression stay off the loop thread.
+            await self._throttle(client_ip, len(frame[1]))
+            await frames.send_frame(*frame)
+            progress.update(encoder.position)
+        await frames.send_message(MSG_END, {'count': 1, 'sha256': encoder.sha256})
+        server.metrics.served()
+        self.observer.log_event("File Transfer", client_ip, server._synced_message(filename, encoder, compressor))
+        progress.finish(); self.observer.client_status(session['id'], "Completed")
+
+    async def _send_archive(self, client_ip, request, session):
+        server, frames, progress = self.server, session['frames'], session['progress']
+        stream, header = await self._io(server._plan_archive, client_ip, request)
+        if not stream: await frames.send_message(MSG_ERROR, header); return
+        progress.reset(); progress.begin_file(header['name'], header['bytes']); self.observer.client_status(session['id'], "Archiving")
+        await frames.send_message(MSG_FILE_HEADER, header)
+        chunks = stream.chunks()
+        while chunk := await self._io(next, chunks, None): # File reads and compression stay off the loop thread.
+            await self._throttle(client_ip, len(chunk))
+            await frames.send_frame(MSG_DATA, chunk)
+            progress.update(stream.input_bytes)
+        await frames.send_message(MSG_END, server._archive_end(stream))
+        server.metrics.served(stream.files)
+        self.observer.log_event("File Transfer", client_ip, server._archived_message(header['name'], stream))
+        progress.finish(); self.observer.client_status(session['id'], "Completed")
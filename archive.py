@@ -0,0 +1,111 @@
+import os
+import tarfile
+import zlib
+from compression import ZLIB_LEVEL
+from transfer import SEND_WINDOW
+
+ARCHIVE_COMPRESSIONS = ("", "gz", "bz2", "xz")
+ARCHIVE_CHUNK = SEND_WINDOW
+TAR_BLOCK = tarfile.BLOCKSIZE
+TAR_RECORD = tarfile.RECORDSIZE
+
+def archive_name(base, compression=""):
+    return f"{base}.tar{f'.{compression}' if compression else ''}"
+
+def tree_members(root, path):
+    # (path, arcname, is_dir) for `path` and, if it is a folder, everything below it in a stable order.
+    # Arcnames are relative to `root` with forward slashes, so unpacking rebuilds the same layout.
+    # Like FileIndex, symlinked folders are neither listed nor followed.
+    def arcname(p): return os.path.relpath(p, root).replace(os.sep, "/")
+    if not os.path.isdir(path): yield path, arcname(path), False; return
+    if path != root: yield path, arcname(path), True
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if not os.path.islink(os.path.join(dirpath, d)))
+        for name in dirnames: yield os.path.join(dirpath, name), arcname(os.path.join(dirpath, name)), True
+        for name in sorted(filenames): yield os.path.join(dirpath, name), arcname(os.path.join(dirpath, name)), False
+
+def _compressor(compression):
+    if compression == "gz": return zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, 31) # wbits 31: gzip container.
+    if compression == "bz2":
+        import bz2
+        return bz2.BZ2Compressor()
+    if compression == "xz":
+        import lzma
+        return lzma.LZMACompressor()
+    return None
+
+class TarStream:
+    # A tar archive of `members` generated while it is sent: chunks() reads each file once and yields the
+    # archive in pieces of about ARCHIVE_CHUNK bytes, so thousands of small files leave as a few large
+    # frames with no temp file and no per-file round trip. Members that cannot be opened any more are
+    # left out and named in `skipped`; a file that shrinks while it is read aborts the stream.
+    def __init__(self, members, compression="", chunk_size=ARCHIVE_CHUNK):
+        if compression not in ARCHIVE_COMPRESSIONS: raise ValueError(f"Unsupported archive compression: {compression}")
+        self.members, self.compression, self.chunk_size = members, compression, chunk_size
+        self.files, self.input_bytes, self.output_bytes, self.skipped = 0, 0, 0, []
+        self._compressor, self._buffer, self._offset = _compressor(compression), bytearray(), 0
+
+    def _write(self, data):
+        self._offset += len(data)
+        self._buffer += self._compressor.compress(data) if self._compressor else data
+        if len(self._buffer) < self.chunk_size: return None
+        return self._take()
+
+    def _take(self):
+        chunk, self._buffer = bytes(self._buffer), bytearray()
+        self.output_bytes += len(chunk)
+        return chunk
+
+    def _header(self, arcname, stat, is_dir, size):
+        info = tarfile.TarInfo(arcname + "/" if is_dir else arcname)
+        info.type, info.size = (tarfile.DIRTYPE, 0) if is_dir else (tarfile.REGTYPE, size)
+        info.mode, info.mtime = stat.st_mode & 0o7777, int(stat.st_mtime)
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    def chunks(self):
+        for path, arcname, is_dir in self.members:
+            if is_dir:
+                try: stat = os.stat(path)
+                except OSError: self.skipped.append(arcname); continue
+                if chunk := self._write(self._header(arcname, stat, True, 0)): yield chunk
+                continue
+            try: f = open(path, 'rb')
+            except OSError: self.skipped.append(arcname); continue
+            with f:
+                stat = os.fstat(f.fileno())
+                if chunk := self._write(self._header(arcname, stat, False, stat.st_size)): yield chunk
+                remaining = stat.st_size
+                while remaining:
+                    data = f.read(min(self.chunk_size, remaining))
+                    if not data: raise OSError(f"File shrank during transfer: {arcname}")
+                    remaining -= len(data); self.input_bytes += len(data)
+                    if chunk := self._write(data): yield chunk
+                if padding := -stat.st_size % TAR_BLOCK:
+                    if chunk := self._write(bytes(padding)): yield chunk
+            self.files += 1
+        # Two zero blocks end the archive, padded to a whole record like tarfile writes it.
+        if chunk := self._write(bytes(2 * TAR_BLOCK + (-(self._offset + 2 * TAR_BLOCK) % TAR_RECORD))): yield chunk
+        if self._compressor: self._buffer += self._compressor.flush()
+        if self._buffer: yield self._take()
+
+class ArchiveReader:
+    # Read-only file object over the chunks of an incoming archive, for tarfile's streaming ("r|*") mode.
+    # next_chunk() returns the next piece of the archive, or None once the sender has finished.
+    def __init__(self, next_chunk):
+        self.next_chunk = next_chunk
+        self.chunk, self.offset, self.received, self.done = b"", 0, 0, False
+
+    def read(self, size=-1):
+        while self.offset >= len(self.chunk):
+            if self.done: return b""
+            chunk = self.next_chunk()
+            if chunk is None: self.done = True; return b""
+            self.chunk, self.offset = chunk, 0; self.received += len(chunk)
+        end = len(self.chunk) if size < 0 else self.offset + size
+        data = self.chunk[self.offset:end]
+        self.offset += len(data)
+        return bytes(data)
+
+    def drain(self):
+        # tarfile stops at the end-of-archive blocks; the rest of the stream still has to be consumed.
+        while self.read(ARCHIVE_CHUNK): pass
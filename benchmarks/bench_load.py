@@ -0,0 +1,187 @@
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_transfer import ROOT, HeadlessStatus, ensure_certs, git_revision
+from Client import FileClient
+from file_server import PREFIX_MSG_C2S
+from telemetry import TransferCounter
+from tls import TLSConnector
+
+# Many concurrent sessions against one server: each virtual client connects, logs in, lists, downloads a random
+# subset, sometimes chats, disconnects and starts over until the run ends. Reports p50/p95/p99 per step and
+# errors by step and exception. Without --host a local headless server is started on a generated share.
+# Usage: python benchmarks/bench_load.py --clients 200 --duration 60 --rate 50 --password secret --max-clients 100
+
+PHASES = ("connect", "auth", "hello", "list", "first_byte", "download", "chat", "session")
+PERCENTILES = (50, 95, 99)
+
+class FirstByteCounter(TransferCounter):
+    # Notes when the first file header of a download arrives; the rest of the counter works as usual.
+    def __init__(self):
+        super().__init__("download")
+        self.first = None
+
+    def begin_file(self, name, size, offset=0):
+        if self.first is None: self.first = time.perf_counter()
+        super().begin_file(name, size, offset)
+
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.deadline = time.monotonic() + args.duration
+        self.latencies = {phase: [] for phase in PHASES}
+        self.errors, self.error_samples, self.lock = collections.Counter(), {}, threading.Lock()
+        self.sessions, self.completed, self.active, self.peak_active = 0, 0, 0, 0
+        self.bytes, self.files = 0, 0
+        self.next_start = time.monotonic()
+
+    def record(self, phase, started):
+        self.latencies[phase].append(time.perf_counter() - started) # list.append is atomic; no lock on the hot path.
+
+    def error(self, phase, reason, detail=""):
+        with self.lock:
+            self.errors[f"{phase}: {reason}"] += 1
+            if detail: self.error_samples.setdefault(f"{phase}: {reason}", detail) # The first message of each kind, for diagnosis.
+
+    def wait_turn(self):
+        # --rate spaces session starts evenly across all clients (an open loop); 0 lets each client go again at once.
+        if not self.args.rate: return time.monotonic() < self.deadline
+        with self.lock:
+            start = self.next_start = max(self.next_start, time.monotonic())
+            self.next_start += 1 / self.args.rate
+        if start >= self.deadline: return False
+        time.sleep(max(0.0, start - time.monotonic()))
+        return True
+
+    def client(self, index, save_path):
+        rng, tls = random.Random(index), TLSConnector() # One connector per virtual client, so reconnects resume like a real one.
+        time.sleep(self.args.ramp * index / self.args.clients)
+        while self.wait_turn():
+            with self.lock: self.sessions += 1; self.active += 1; self.peak_active = max(self.peak_active, self.active)
+            try: self.session(rng, tls, save_path)
+            finally:
+                with self.lock: self.active -= 1
+            if self.args.think: time.sleep(rng.expovariate(1 / self.args.think))
+
+    def session(self, rng, tls, save_path):
+        args, phase = self.args, "connect"
+        client = FileClient(HeadlessStatus(), tls); client.multiplex = args.mux; client.progress = FirstByteCounter()
+        session_started = started = time.perf_counter()
+        try:
+            # Connections refused during a pause are closed before the TLS handshake and count as connect errors;
+            # sessions over max_clients are refused on HELLO and count as hello errors.
+            auth_req = client.connect(args.host, args.port); self.record(phase, started)
+            if auth_req == 'NEEDS_PASS':
+                phase, started = "auth", time.perf_counter()
+                if not client.login(args.password or ""): self.error(phase, "rejected"); return
+                self.record(phase, started)
+            phase, started = "hello", time.perf_counter(); client.negotiate(); self.record(phase, started)
+            phase, started = "list", time.perf_counter(); files = client.list_files(); self.record(phase, started)
+            if files and args.download:
+                phase, started = "download", time.perf_counter()
+                failed = client.download(rng.sample(files, min(args.download, len(files))), save_path) or []
+                if client.progress.first: self.latencies["first_byte"].append(client.progress.first - started)
+                self.record(phase, started)
+                with self.lock:
+                    self.bytes += client.progress.total_done(); self.files += min(args.download, len(files)) - len(failed)
+                    if failed: self.errors[f"{phase}: skipped"] += len(failed)
+            if rng.random() < args.chat:
+                phase, started = "chat", time.perf_counter()
+                chat = tls.connect(args.host, args.port + 1)
+                try: chat.sendall(f"{PREFIX_MSG_C2S}load test message".encode('utf-8'))
+                finally: chat.close()
+                self.record(phase, started)
+            self.record("session", session_started)
+            with self.lock: self.completed += 1
+        except Exception as e: self.error(phase, type(e).__name__, str(e)[:200])
+        finally: client.close()
+
+    def summary(self):
+        phases = {}
+        for phase, values in self.latencies.items():
+            if not values: continue
+            values = sorted(values)
+            phases[phase] = {'count': len(values), 'mean_ms': round(sum(values) / len(values) * 1000, 2), 'max_ms': round(values[-1] * 1000, 2),
+                             **{f"p{p}_ms": round(values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000, 2) for p in PERCENTILES}}
+        return {'sessions': self.sessions, 'completed': self.completed, 'failed': sum(self.errors.values()), 'peak_active': self.peak_active,
+                'files': self.files, 'bytes': self.bytes, 'latency': phases, 'errors': dict(self.errors.most_common()), 'error_samples': self.error_samples}
+
+def make_share(path, files, size):
+    for i in range(files):
+        folder = os.path.join(path, f"dir{i % 16:02d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file{i:05d}.bin"), 'wb') as f: f.write(os.urandom(size))
+
+def start_server(args, tmp):
+    share = os.path.join(tmp, "share"); make_share(share, args.share_files, args.file_kb * 1024)
+    ensure_certs(tmp)
+    command = [sys.executable, os.path.join(ROOT, "file_server.py"), "--path", share, "--port", str(args.port),
+               "--max-clients", str(args.max_clients), "--engine", args.engine, "--log-level", "ERROR"]
+    if args.password:
+        with open(os.path.join(tmp, "password.txt"), 'w', encoding='utf-8') as f: f.write(args.password + "\n")
+        command += ["--password-file", os.path.join(tmp, "password.txt")]
+    server = subprocess.Popen(command, cwd=tmp)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline: # Until the web port (started last) accepts, so no probe takes a file session slot.
+        if server.poll() is not None: raise RuntimeError(f"server exited with status {server.returncode}")
+        try: socket.create_connection(("127.0.0.1", args.port + 2), timeout=1).close(); return server
+        except OSError: time.sleep(0.1)
+    server.kill(); raise RuntimeError("server did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test with connect, auth, listing and first-byte percentiles.")
+    parser.add_argument("--host", help="server to test (default: start a local headless server)")
+    parser.add_argument("--port", type=int, default=5800)
+    parser.add_argument("--clients", type=int, default=100, help="concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to keep starting sessions")
+    parser.add_argument("--rate", type=float, default=0.0, help="new sessions per second across all clients (0 = as fast as they finish)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the clients make their first connection")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a client's sessions, in seconds")
+    parser.add_argument("--download", type=int, default=3, help="random files downloaded per session (0 = list only)")
+    parser.add_argument("--chat", type=float, default=0.2, help="share of sessions that also send a chat message")
+    parser.add_argument("--mux", action="store_true", help="offer the single connection mode")
+    parser.add_argument("--password")
+    parser.add_argument("--max-clients", type=int, default=100, help="local server only")
+    parser.add_argument("--engine", choices=("threaded", "asyncio"), default="threaded", help="local server only")
+    parser.add_argument("--share-files", type=int, default=500, help="local server only: files in the generated share")
+    parser.add_argument("--file-kb", type=int, default=64, help="local server only: size of each shared file")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if not args.host: args.host, server = "127.0.0.1", start_server(args, tmp)
+        run = LoadRun(args)
+        try:
+            threads = [threading.Thread(target=run.client, args=(i, os.path.join(tmp, "downloads", str(i))), daemon=True) for i in range(args.clients)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+        finally:
+            if server: server.terminate(); server.wait(30)
+        shutil.rmtree(os.path.join(tmp, "downloads"), ignore_errors=True)
+    result = run.summary()
+    print(f"{result['sessions']} sessions, {result['completed']} completed, peak {result['peak_active']} active, "
+          f"{result['files']} files / {result['bytes'] / 1e6:.1f} MB downloaded in {args.duration:.0f}s", file=sys.stderr)
+    for phase, stats in result['latency'].items():
+        print(f"{phase:<11} n={stats['count']:<7} " + "  ".join(f"p{p} {stats[f'p{p}_ms']:8.1f} ms" for p in PERCENTILES) + f"  max {stats['max_ms']:8.1f} ms", file=sys.stderr)
+    for reason, count in result['errors'].items(): print(f"error  {reason}: {count}  ({result['error_samples'].get(reason, '')})", file=sys.stderr)
+    meta = {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': args.host, 'local_server': server is not None,
+            **{key: getattr(args, key) for key in ("clients", "duration", "rate", "ramp", "think", "download", "chat", "mux", "max_clients", "engine")}}
+    document = json.dumps({'meta': meta, **result}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(document + "\n")
+    else: print(document)
+    return 1 if result['failed'] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,86 @@
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transfer import FileSender, enable_ktls
+
+# Loopback send-path benchmark: the old 4 KB read()+sendall() loop versus FileSender.
+# Usage: python benchmarks/bench_send.py --size-mb 512
+
+def ensure_certs(directory):
+    cert_file, key_file = os.path.join(directory, "server.crt"), os.path.join(directory, "server.key")
+    if not (os.path.exists(cert_file) and os.path.exists(key_file)):
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_file, "-out", cert_file,
+                        "-days", "1", "-subj", "/CN=localhost"], check=True, capture_output=True)
+    return cert_file, key_file
+
+def make_payload(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block)): f.write(block)
+        f.write(block[:size % len(block)])
+
+def drain(conn, expected):
+    buffer = bytearray(1024 * 1024)
+    received = 0
+    while received < expected:
+        n = conn.recv_into(buffer)
+        if not n: break
+        received += n
+    return received
+
+def legacy_send(sock, path, size):
+    with open(path, 'rb') as f:
+        while (chunk := f.read(4096)): sock.sendall(chunk)
+
+def engine_send(sock, path, size):
+    with open(path, 'rb') as f: FileSender(sock).send_range(f, 0, size)
+
+def run_case(name, send_func, path, size, server_ctx, client_ctx):
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    result = {}
+    def serve():
+        conn, _ = listener.accept()
+        if server_ctx: conn = server_ctx.wrap_socket(conn, server_side=True)
+        start = time.perf_counter()
+        send_func(conn, path, size)
+        result['send_time'] = time.perf_counter() - start
+        result['mode'] = FileSender(conn).mode
+        conn.close()
+    thread = threading.Thread(target=serve, daemon=True); thread.start()
+    sock = socket.create_connection(("127.0.0.1", port))
+    if client_ctx: sock = client_ctx.wrap_socket(sock, server_hostname="localhost")
+    start = time.perf_counter()
+    received = drain(sock, size)
+    elapsed = time.perf_counter() - start
+    thread.join(); sock.close(); listener.close()
+    if received != size: raise RuntimeError(f"{name}: received {received} of {size} bytes")
+    print(f"{name:<34} {size / elapsed / 1e6:10.1f} MB/s   ({result['mode'] if send_func is engine_send else '4 KB read loop'})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback MB/s for the file send path.")
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_file, key_file = ensure_certs(tmp)
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(certfile=cert_file, keyfile=key_file)
+        ktls = enable_ktls(server_ctx)
+        client_ctx = ssl.create_default_context(); client_ctx.check_hostname = False; client_ctx.verify_mode = ssl.CERT_NONE
+        path, size = os.path.join(tmp, "payload.bin"), args.size_mb * 1024 * 1024
+        make_payload(path, size)
+        print(f"payload {args.size_mb} MB, kTLS option {'available' if ktls else 'not available'}")
+        run_case("TLS  before (read 4 KB + sendall)", legacy_send, path, size, server_ctx, client_ctx)
+        run_case("TLS  after  (FileSender)", engine_send, path, size, server_ctx, client_ctx)
+        run_case("TCP  after  (FileSender, no TLS)", engine_send, path, size, None, None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start cost of each entry point, measured in fresh interpreters: wall clock for the import (and, with
+# --gui and a display, for building the first window) plus the slowest modules from `python -X importtime`.
+# Exits with status 1 when a median goes over --budget-ms or a module that should load on demand is imported.
+# Usage: python benchmarks/bench_startup.py --runs 10 --budget-ms 150
+
+TARGETS = {"launcher": "AppLauncher", "Server": "ServerGUI", "Client": "ClientGUI", "file_server": None}
+DEFERRED_MODULES = ["pandas", "openpyxl", "OpenSSL", "asyncio", "http.server", "tarfile"]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def run_python(code, extra_args=()):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *extra_args, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode: raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}")
+    return elapsed, result
+
+def baseline():
+    return statistics.median(run_python("pass")[0] for _ in range(5))
+
+def import_profile(module):
+    # Slowest imports by self time, and everything `module` pulled in.
+    _, result = run_python(f"import sys, {module}; print('\\n'.join(sys.modules))", ["-X", "importtime"])
+    rows = [(int(self_us), int(cumulative_us), name) for self_us, cumulative_us, _, name in IMPORT_LINE.findall(result.stderr)]
+    total = next((cumulative for _, cumulative, name in rows if name == module), 0)
+    return total, sorted(rows, reverse=True), set(result.stdout.split())
+
+def measure(module, cls, runs, gui):
+    code = f"import {module}"
+    if gui and cls: code += f"; app = {module}.{cls}(); app.update(); app.destroy()"
+    return [run_python(code)[0] for _ in range(runs)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of the launcher, GUIs and headless server.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="median budget per entry point, interpreter start excluded")
+    parser.add_argument("--gui", action="store_true", help="also build and draw the first window (needs a display)")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list per entry point")
+    args = parser.parse_args()
+    if args.gui and not (os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin")):
+        parser.error("--gui needs a display")
+    interpreter = baseline()
+    print(f"python {sys.version.split()[0]}, bare interpreter {interpreter * 1000:.0f} ms, budget {args.budget_ms:.0f} ms{' incl. first window' if args.gui else ''}")
+    failed = False
+    for module, cls in TARGETS.items():
+        total_us, rows, loaded = import_profile(module)
+        times = [t - interpreter for t in measure(module, cls, args.runs, args.gui)]
+        median = statistics.median(times) * 1000
+        deferred = [name for name in DEFERRED_MODULES if name in loaded]
+        over = median > args.budget_ms
+        failed |= over or bool(deferred)
+        print(f"\n{module:<12} median {median:6.0f} ms  best {min(times) * 1000:6.0f} ms  import {total_us / 1000:6.0f} ms  {'OVER BUDGET' if over else 'ok'}")
+        if deferred: print(f"  loaded at startup but should be deferred: {', '.join(deferred)}")
+        for self_us, cumulative_us, name in rows[:args.top]: print(f"  {self_us / 1000:6.1f} ms self  {cumulative_us / 1000:6.1f} ms cumulative  {name}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+try: import resource
+except ImportError: resource = None # No peak RSS on Windows.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# End-to-end loopback throughput: a headless FileServer on localhost shares generated datasets and a FileClient
+# lists and downloads each one through the real protocol code. Server and client run in their own processes so
+# CPU time and peak RSS are reported per side. Results go out as JSON; --compare prints MB/s against an older run.
+# Usage: python benchmarks/bench_transfer.py --scale 0.1 --output after.json --compare before.json
+
+KB, MB, GB = 1024, 1024 * 1024, 1024 * 1024 * 1024
+# name: (files, bytes per file, folder depth). Deep trees spread their files over a chain of nested folders.
+DATASETS = {"large": (1, 10 * GB, 0), "medium": (1000, 10 * MB, 0), "small": (100_000, 4 * KB, 0), "deep": (10_000, 16 * KB, 48)}
+RESULT_PREFIX = "BENCH "
+
+def ensure_certs(directory):
+    cert_file, key_file = os.path.join(directory, "server.crt"), os.path.join(directory, "server.key")
+    if not (os.path.exists(cert_file) and os.path.exists(key_file)):
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_file, "-out", cert_file,
+                        "-days", "1", "-subj", "/CN=localhost"], check=True, capture_output=True)
+    return cert_file, key_file
+
+def peak_rss_mb():
+    if resource is None: return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (MB if sys.platform == "darwin" else KB), 1)
+
+def report(**fields):
+    print(RESULT_PREFIX + json.dumps(fields), flush=True)
+
+def read_report(pipe):
+    for line in pipe:
+        if line.startswith(RESULT_PREFIX): return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("benchmark process exited without a result")
+
+def scaled(name, scale):
+    # A single file shrinks in size; multi-file sets keep their file size and shrink in count.
+    files, size, depth = DATASETS[name]
+    if files == 1: return 1, max(1, int(size * scale)), depth
+    return max(1, int(files * scale)), size, depth
+
+def make_dataset(data_dir, name, files, size, depth):
+    path = os.path.join(data_dir, f"{name}-{files}x{size}-d{depth}")
+    marker = path + ".done"
+    if os.path.exists(marker): return path
+    shutil.rmtree(path, ignore_errors=True)
+    for i in range(files):
+        folder = os.path.join(path, *(f"level{j}" for j in range(i % depth + 1))) if depth else path
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file{i:06d}.bin"), 'wb') as f:
+            # Fresh random bytes throughout: a repeated block would pass the compression sample and then cost CPU for nothing.
+            for offset in range(0, size, MB): f.write(os.urandom(min(MB, size - offset)))
+    open(marker, 'w').close()
+    return path
+
+def serve(args):
+    from file_server import FileServer
+    server = FileServer()
+    ok, msg = server.start(args.port, args.serve, 'directory', args.password, 10, args.engine)
+    if not ok: report(error=msg); return 1
+    started = time.perf_counter(); server.file_index.files()
+    report(index_s=round(time.perf_counter() - started, 3))
+    cpu = time.process_time()
+    sys.stdin.readline() # The parent writes a line once the client is done.
+    report(cpu_s=round(time.process_time() - cpu, 3), peak_rss_mb=peak_rss_mb())
+    server.stop()
+    return 0
+
+class HeadlessStatus:
+    def update_status(self, message, color): pass
+
+def fetch(args):
+    from Client import FileClient
+    client = FileClient(HeadlessStatus()); client.multiplex = args.mux
+    started = time.perf_counter()
+    if client.connect("127.0.0.1", args.port) == 'NEEDS_PASS' and not client.login(args.password or ""): report(error="authentication failed"); return 1
+    client.negotiate()
+    connect_s, cpu = time.perf_counter() - started, time.process_time()
+    started = time.perf_counter(); files = client.list_files(); list_s = time.perf_counter() - started
+    started = time.perf_counter(); failed = client.download(files, args.fetch, streams=args.streams) or []; download_s = time.perf_counter() - started
+    cpu_s = time.process_time() - cpu
+    client.close()
+    received = sum(os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(args.fetch) for name in names)
+    report(files=len(files), failed=len(failed), bytes=received, connect_ms=round(connect_s * 1000, 1), list_ms=round(list_s * 1000, 1),
+           download_s=round(download_s, 3), cpu_s=round(cpu_s, 3), peak_rss_mb=peak_rss_mb(), caps=sorted(client.caps))
+    return 0
+
+def run_case(args, cert_dir, path, port):
+    child = [sys.executable, os.path.abspath(__file__), "--port", str(port), "--engine", args.engine, "--streams", str(args.streams)]
+    if args.password: child += ["--password", args.password]
+    if args.mux: child.append("--mux")
+    server = subprocess.Popen(child + ["--serve", path], cwd=cert_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    out_dir = tempfile.mkdtemp(prefix="bench-out-", dir=args.out_dir)
+    try:
+        ready = read_report(server.stdout)
+        if 'error' in ready: raise RuntimeError(f"server: {ready['error']}")
+        result = subprocess.run(child + ["--fetch", out_dir], stdout=subprocess.PIPE, text=True)
+        client = read_report(result.stdout.splitlines())
+        server.stdin.write("done\n"); server.stdin.flush()
+        server_stats = read_report(server.stdout)
+    finally:
+        if server.stdin: server.stdin.close()
+        try: server.wait(30)
+        except subprocess.TimeoutExpired: server.kill()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    if 'error' in client: raise RuntimeError(f"client: {client['error']}")
+    seconds = max(client['download_s'], 1e-9)
+    return {'files': client['files'], 'bytes': client['bytes'], 'failed': client['failed'], 'index_s': ready['index_s'],
+            'connect_ms': client['connect_ms'], 'list_ms': client['list_ms'], 'download_s': client['download_s'],
+            'mb_per_s': round(client['bytes'] / seconds / 1e6, 1), 'files_per_s': round(client['files'] / seconds, 1), 'caps': client['caps'],
+            'client': {'cpu_s': client['cpu_s'], 'peak_rss_mb': client['peak_rss_mb']}, 'server': server_stats}
+
+def git_revision():
+    try: return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f: baseline = json.load(f)
+    best = lambda runs: max(run['mb_per_s'] for run in runs)
+    print(f"\nversus {baseline_file} ({baseline['meta'].get('revision')})", file=sys.stderr)
+    for name, runs in results.items():
+        if name not in baseline['datasets']: continue
+        old, new = best(baseline['datasets'][name]['runs']), best(runs['runs'])
+        print(f"{name:<8} {old:10.1f} -> {new:10.1f} MB/s  {new / old if old else float('inf'):6.2f}x", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback LIST_FILES + DOWNLOAD_FILES throughput through the real server and client.")
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument("--scale", type=float, default=1.0, help="shrink or grow every dataset (0.01 turns 10 GB into about 100 MB)")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--engine", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--streams", type=int, default=1, help="parallel download streams")
+    parser.add_argument("--mux", action="store_true", help="multiplex everything over one connection")
+    parser.add_argument("--password", help="require this password, so the auth step is part of the connect time")
+    parser.add_argument("--port", type=int, default=5700, help="first file port; each case moves up by three")
+    parser.add_argument("--data-dir", help="keep generated datasets here and reuse them on the next run (default: a temp dir)")
+    parser.add_argument("--out-dir", help="where downloads land before being deleted (default: the system temp dir)")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", metavar="JSON", help="an earlier --output to compare MB/s against")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--fetch", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve: return serve(args)
+    if args.fetch: return fetch(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        ensure_certs(tmp)
+        results, port = {}, args.port
+        for name in args.datasets:
+            files, size, depth = scaled(name, args.scale)
+            print(f"{name}: generating {files} x {size} bytes{f', depth {depth}' if depth else ''}", file=sys.stderr)
+            path = make_dataset(data_dir, name, files, size, depth)
+            runs = []
+            for _ in range(args.runs):
+                run = run_case(args, tmp, path, port); port += 3
+                runs.append(run)
+                print(f"{name:<8} {run['mb_per_s']:10.1f} MB/s {run['files_per_s']:10.1f} files/s  list {run['list_ms']:8.1f} ms  "
+                      f"cpu client {run['client']['cpu_s']:.2f}s server {run['server']['cpu_s']:.2f}s  "
+                      f"rss client {run['client']['peak_rss_mb']} MB server {run['server']['peak_rss_mb']} MB"
+                      + (f"  FAILED {run['failed']}" if run['failed'] else ""), file=sys.stderr)
+            results[name] = {'files': files, 'file_size': size, 'depth': depth,
+                             'median_mb_per_s': statistics.median(run['mb_per_s'] for run in runs), 'runs': runs}
+    meta = {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'engine': args.engine, 'streams': args.streams, 'mux': args.mux, 'scale': args.scale}
+    document = json.dumps({'meta': meta, 'datasets': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(document + "\n")
+    else: print(document)
+    if args.compare: compare(results, args.compare)
+    return 1 if any(run['failed'] or run['files'] != results[name]['files'] for name in results for run in results[name]['runs']) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+import os
+import time
+import zlib
+from protocol import ProtocolError
+
+try:
+    import zstandard
+except ImportError: zstandard = None # zlib is always available; zstd is used only when both ends have it.
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+ZLIB_LEVEL = 3
+ZSTD_LEVEL = 3
+MIN_COMPRESS_SIZE = 4096
+SAMPLE_SIZE = 16 * 1024
+MAX_SAMPLE_RATIO = 0.9
+
+# Formats that are already compressed; sampling them would only confirm it.
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.cab', '.deb', '.docx', '.epub', '.flac', '.gif', '.gz', '.heic',
+    '.jar', '.jpeg', '.jpg', '.lz', '.lz4', '.lzma', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4', '.odp', '.ods',
+    '.odt', '.ogg', '.opus', '.png', '.pptx', '.rar', '.rpm', '.tgz', '.txz', '.webm', '.webp', '.whl', '.xlsx', '.xz',
+    '.zip', '.zst',
+}
+
+def available_codecs():
+    return [CODEC_ZSTD, CODEC_ZLIB] if zstandard else [CODEC_ZLIB]
+
+def choose_codec(offered):
+    return next((codec for codec in available_codecs() if codec in (offered or [])), None)
+
+def worth_compressing(path, size):
+    # Cheap guess: skip small files and known compressed formats, then trial-compress up to three
+    # samples (start, middle, end) and give up if they barely shrink, which catches high-entropy data.
+    if size < MIN_COMPRESS_SIZE or os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS: return False
+    sample = b""
+    with open(path, 'rb') as f:
+        for position in sorted({0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)}):
+            f.seek(position); sample += f.read(SAMPLE_SIZE)
+    return compressible(sample)
+
+def compressible(sample):
+    return len(zlib.compress(sample, 1)) < len(sample) * MAX_SAMPLE_RATIO
+
+class Compressor:
+    # Compresses one file window by window so each frame can be decoded on arrival: zlib as one stream
+    # flushed after every window, zstd as one frame per window with its size in the frame header, which
+    # lets the receiver refuse an oversized frame before decoding it. Output size and the CPU time of the
+    # calling threads are kept for the transfer log.
+    def __init__(self, codec):
+        self.codec = codec
+        self.input_bytes, self.output_bytes, self.cpu_time = 0, 0, 0.0
+        self._stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if codec == CODEC_ZSTD else zlib.compressobj(ZLIB_LEVEL)
+
+    def compress(self, data):
+        started = time.thread_time()
+        output = self._stream.compress(data) if self.codec == CODEC_ZSTD else self._stream.compress(data) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu_time += time.thread_time() - started
+        self.input_bytes += len(data); self.output_bytes += len(output)
+        return output
+
+    def summary(self):
+        ratio = self.output_bytes * 100 / max(self.input_bytes, 1)
+        return f"{self.codec} {self.input_bytes} -> {self.output_bytes} bytes ({ratio:.0f}%), {self.cpu_time * 1000:.0f} ms CPU"
+
+class Decompressor:
+    # Decodes what a Compressor sent, never producing more than `limit` bytes for one frame: past it
+    # decompress() raises ProtocolError, so a small frame cannot expand beyond what the sender announced.
+    # zlib output is capped with max_length; a zstd frame is checked by the size in its header first.
+    def __init__(self, codec):
+        self.codec = codec
+        self._stream = zstandard.ZstdDecompressor() if codec == CODEC_ZSTD else zlib.decompressobj()
+
+    def decompress(self, data, limit):
+        if self.codec == CODEC_ZSTD:
+            if not 0 <= zstandard.frame_content_size(data) <= limit: raise ProtocolError("Compressed data expands past the announced size.")
+            return self._stream.decompress(data)
+        output = self._stream.decompress(data, limit + 1)
+        if len(output) > limit: raise ProtocolError("Compressed data expands past the announced size.")
+        return output
+
+def decompressor(codec):
+    if codec is None: return None
+    if codec == CODEC_ZSTD and zstandard or codec == CODEC_ZLIB: return Decompressor(codec)
+    raise ValueError(f"Unsupported codec: {codec}")
@@ -0,0 +1,143 @@
+import hashlib
+import math
+import os
+import zlib
+from protocol import ProtocolError
+from transfer import SEND_WINDOW
+
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+ADLER_MOD = 65521
+READ_SIZE = SEND_WINDOW
+LITERAL_CHUNK = SEND_WINDOW
+ROLL_LIMIT_BLOCKS = 8
+ROLL_REFILL_RATIO = 16
+
+def block_size_for(size):
+    # Roughly sqrt(size) like rsync, rounded to a power of two, so the signature grows with sqrt(size) too.
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, 1 << math.isqrt(size).bit_length()))
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def file_signature(path, block_size=None):
+    # Weak (adler32, which can be rolled one byte at a time) and strong checksum of every block of a local copy.
+    size = os.path.getsize(path)
+    block_size = block_size or block_size_for(size)
+    blocks = []
+    with open(path, 'rb') as f:
+        while block := f.read(block_size): blocks.append([zlib.adler32(block), strong_hash(block)])
+    return {'size': size, 'block_size': block_size, 'blocks': blocks}
+
+class DeltaEncoder:
+    # Matches a file against the signature of the client's copy and yields what rebuilds it there:
+    # bytes (literal data, about LITERAL_CHUNK at most) or (index, count) runs of the client's own blocks.
+    # After a miss the weak checksum is rolled byte by byte to find shifted blocks. Rolling runs in Python,
+    # so after ROLL_LIMIT_BLOCKS blocks without a match the encoder steps whole blocks instead and only
+    # rolls again on a small budget, which keeps completely rewritten files near read speed.
+    def __init__(self, path, signature):
+        self.path = path
+        self.block_size, basis_size, blocks = int(signature['block_size']), int(signature['size']), signature['blocks']
+        if not MIN_BLOCK_SIZE <= self.block_size <= MAX_BLOCK_SIZE or len(blocks) != -(-basis_size // self.block_size):
+            raise ValueError("Invalid block signature.")
+        self.blocks = [(int(weak), str(strong)) for weak, strong in blocks]
+        self.tail_size = basis_size - (len(blocks) - 1) * self.block_size if blocks else 0
+        self.full_blocks = len(blocks) if self.tail_size == self.block_size else max(0, len(blocks) - 1)
+        self.table = {}
+        for index, (weak, strong) in enumerate(self.blocks[:self.full_blocks]): self.table.setdefault(weak, {}).setdefault(strong, index)
+        self.literal_bytes, self.matched_bytes, self.position, self.sha256 = 0, 0, 0, None
+
+    def _find(self, weak, window, run):
+        if len(window) < self.block_size:
+            if self.full_blocks < len(self.blocks) and len(window) == self.tail_size and self.blocks[-1] == (zlib.adler32(window), strong_hash(window)): return len(self.blocks) - 1
+            return None
+        candidates = self.table.get(weak)
+        if not candidates: return None
+        strong = strong_hash(window)
+        following = run[0] + run[1] if run else -1 # Prefer the block after the current run, so duplicates keep runs long.
+        if 0 <= following < self.full_blocks and self.blocks[following] == (weak, strong): return following
+        return candidates.get(strong)
+
+    def ops(self):
+        B, M, table = self.block_size, ADLER_MOD, self.table
+        digest = hashlib.sha256()
+        buf, base, lit, i, weak, run, eof = b"", 0, 0, 0, None, None, False
+        budget = ROLL_LIMIT_BLOCKS * B
+        with open(self.path, 'rb') as f:
+            while True:
+                if not eof and len(buf) - i <= B:
+                    chunk = f.read(READ_SIZE)
+                    if chunk:
+                        digest.update(chunk)
+                        buf, base, i = buf[lit:] + chunk, base + lit, i - lit
+                        lit = 0
+                        continue
+                    eof = True
+                window = buf[i:i + B]
+                if not window: break
+                if weak is None and len(window) == B: weak = zlib.adler32(window)
+                index = self._find(weak, window, run)
+                if index is not None:
+                    if i > lit:
+                        if run: yield tuple(run); run = None
+                        yield buf[lit:i]; self.literal_bytes += i - lit
+                    if run and run[0] + run[1] == index: run[1] += 1
+                    else:
+                        if run: yield tuple(run)
+                        run = [index, 1]
+                    i += len(window); lit, weak, budget = i, None, ROLL_LIMIT_BLOCKS * B
+                    self.matched_bytes += len(window); self.position = base + i
+                    continue
+                if len(window) < B: break
+                if i - lit >= LITERAL_CHUNK:
+                    if run: yield tuple(run); run = None
+                    yield buf[lit:i]; self.literal_bytes += i - lit
+                    lit = i; self.position = base + i
+                end = min(len(buf) - B, i + budget)
+                if end <= i:
+                    # Out of rolling budget (or data): take the whole block as literal and earn a little budget back.
+                    i, weak, budget = i + B, None, budget + B // ROLL_REFILL_RATIO
+                    continue
+                a, b, j = weak & 0xffff, weak >> 16, i
+                while j < end:
+                    out = buf[j]
+                    a = (a - out + buf[j + B]) % M
+                    b = (b - B * out + a - 1) % M
+                    j += 1
+                    if (b << 16 | a) in table: break
+                budget -= j - i
+                i, weak = j, b << 16 | a
+            if run: yield tuple(run)
+            if len(buf) > lit: yield buf[lit:]; self.literal_bytes += len(buf) - lit
+            self.position, self.sha256 = base + len(buf), digest.hexdigest()
+
+class DeltaPatcher:
+    # Rebuilds a file on the client from DeltaEncoder output: copy() reads runs of blocks from the local
+    # basis file, write() takes literal data. Everything written is hashed for the final check.
+    def __init__(self, basis_path, block_size, sink):
+        self.basis, self.block_size, self.sink = open(basis_path, 'rb'), block_size, sink
+        self.basis_size = os.fstat(self.basis.fileno()).st_size
+        self.digest = hashlib.sha256()
+
+    def copy(self, index, count):
+        start = index * self.block_size
+        if index < 0 or count < 1 or start >= self.basis_size: raise ProtocolError(f"Block run {index}+{count} is outside the local copy.")
+        self.basis.seek(start)
+        remaining = min(count * self.block_size, self.basis_size - start)
+        while remaining:
+            data = self.basis.read(min(READ_SIZE, remaining))
+            if not data: raise OSError("Local copy shrank during delta sync.")
+            self.write(data); remaining -= len(data)
+
+    def write(self, data):
+        self.sink.write(data)
+        self.digest.update(data)
+
+    def close(self):
+        self.basis.close()
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
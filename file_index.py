@@ -0,0 +1,176 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+try:
+    from watchdog.observers import Observer
+except ImportError: Observer = None # Without watchdog the index falls back to polling directory mtimes.
+from protocol import ENTRY_DIR, ENTRY_FILE
+
+class FileIndex:
+    # In-memory listing of a shared directory tree. It is built once in the background and then kept
+    # current from file system events (watchdog: inotify, ReadDirectoryChangesW, FSEvents) or, as a
+    # fallback, by polling directory mtimes. Only directories whose entries changed are re-read.
+    # Polling only notices added, removed or renamed entries; sizes of files rewritten in place are
+    # picked up the next time their directory changes.
+    POLL_INTERVAL = 2.0
+    SETTLE_DELAY = 0.2
+
+    def __init__(self, root, on_ready=None):
+        self.root = root
+        self.on_ready = on_ready
+        self.dirs = {} # reldir -> {'mtime', 'files': {name: (size, mtime)}, 'subdirs'}; only touched by the index thread.
+        self.mode = "polling"
+        self._snapshot = (0, [], []) # version, sorted paths, matching [name, size, mtime, type] entries
+        self._payload, self._files, self._pages = None, None, None
+        self._dirty, self._dirty_lock, self._payload_lock = set(), threading.Lock(), threading.Lock()
+        self._ready, self._stop, self._wake = threading.Event(), threading.Event(), threading.Event()
+        self._observer = None
+
+    @property
+    def version(self): return self._snapshot[0]
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+        if self._observer: self._observer.stop()
+
+    def files(self): return self._file_list()[1]
+
+    def _file_list(self):
+        self._ready.wait()
+        with self._payload_lock:
+            version, _, entries = self._snapshot
+            if self._files is None or self._files[0] != version: self._files = (version, [entry[0] for entry in entries if entry[3] == ENTRY_FILE])
+            return self._files
+
+    def listing_payload(self):
+        # The serialized listing is shared by every client until the tree changes.
+        version, files = self._file_list()
+        with self._payload_lock:
+            if self._payload is None or self._payload[0] != version: self._payload = (version, json.dumps(files).encode('utf-8'))
+            return self._payload[1]
+
+    def page_payloads(self, page_size, cursor=None, limit=None):
+        # Serialized {'entries', 'cursor', 'more', 'last', 'total'} pages from one snapshot. The cursor is the last
+        # path sent, so a continuation stays correct after the tree changes. Full listings are cached.
+        self._ready.wait()
+        version, paths, entries = self._snapshot
+        start = bisect.bisect_right(paths, cursor) if cursor else 0
+        end = len(paths) if limit is None else min(len(paths), start + max(0, limit))
+        cacheable = cursor is None and limit is None
+        with self._payload_lock:
+            if cacheable and self._pages and self._pages[:2] == (version, page_size): return self._pages[2]
+        pages = [json.dumps({'entries': entries[i:min(i + page_size, end)], 'cursor': paths[min(i + page_size, end) - 1],
+                             'more': min(i + page_size, end) < len(paths), 'last': i + page_size >= end, 'total': len(paths)}).encode('utf-8')
+                 for i in range(start, end, page_size)]
+        if not pages: pages = [json.dumps({'entries': [], 'cursor': cursor, 'more': False, 'last': True, 'total': len(paths)}).encode('utf-8')]
+        if cacheable:
+            with self._payload_lock: self._pages = (version, page_size, pages)
+        return pages
+
+    def _run(self):
+        started = time.monotonic()
+        self._observer = self._watch() # Watch before scanning so changes made during the scan are not lost.
+        self._scan_tree('')
+        self._publish()
+        self._ready.set()
+        if self.on_ready: self.on_ready(self, time.monotonic() - started)
+        while not self._stop.is_set():
+            self._wake.wait(None if self._observer else self.POLL_INTERVAL)
+            if self._stop.is_set(): break
+            if self._observer: time.sleep(self.SETTLE_DELAY) # Let bursts of events collapse into one rescan.
+            self._wake.clear()
+            with self._dirty_lock: dirty, self._dirty = self._dirty, set()
+            changed = any([self._rescan(reldir) for reldir in sorted(dirty)]) if self._observer else self._poll()
+            if changed: self._publish()
+
+    def _watch(self):
+        if Observer is None: return None
+        try:
+            observer = Observer()
+            observer.schedule(_ChangeHandler(self), self.root, recursive=True)
+            observer.start()
+        except Exception: return None # e.g. the inotify watch limit is too low for this tree
+        self.mode = "watchdog"
+        return observer
+
+    def _on_event(self, event):
+        if event.event_type in ('opened', 'closed', 'closed_no_write'): return
+        with self._dirty_lock:
+            for path in (event.src_path, getattr(event, 'dest_path', '')):
+                if not path: continue
+                reldir = self._relative(path)
+                self._dirty.add(os.path.dirname(reldir))
+                if event.is_directory: self._dirty.add(reldir)
+        self._wake.set()
+
+    def _relative(self, path):
+        relative_path = os.path.relpath(path, self.root).replace("\\", "/")
+        return "" if relative_path == "." else relative_path
+
+    def _path(self, reldir): return os.path.join(self.root, reldir) if reldir else self.root
+
+    @staticmethod
+    def _join(reldir, name): return f"{reldir}/{name}" if reldir else name
+
+    def _read_dir(self, reldir):
+        # Same rules as os.walk: symlinked directories are neither listed nor followed.
+        path = self._path(reldir)
+        mtime, files, subdirs = os.stat(path).st_mtime_ns, {}, set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try: is_dir = entry.is_dir()
+                except OSError: is_dir = False
+                if is_dir:
+                    if not entry.is_symlink(): subdirs.add(entry.name)
+                    continue
+                try: stat = entry.stat(); files[entry.name] = (stat.st_size, int(stat.st_mtime))
+                except OSError: files[entry.name] = (0, 0)
+        return {'mtime': mtime, 'files': files, 'subdirs': subdirs}
+
+    def _scan_tree(self, reldir):
+        stack = [reldir]
+        while stack and not self._stop.is_set():
+            current = stack.pop()
+            try: self.dirs[current] = entry = self._read_dir(current)
+            except OSError: continue
+            stack.extend(self._join(current, name) for name in entry['subdirs'])
+
+    def _rescan(self, reldir):
+        old = self.dirs.get(reldir)
+        if old is None: return False
+        try: new = self._read_dir(reldir)
+        except OSError: self._drop(reldir); return True
+        self.dirs[reldir] = new
+        for name in old['subdirs'] - new['subdirs']: self._drop(self._join(reldir, name))
+        for name in new['subdirs'] - old['subdirs']: self._scan_tree(self._join(reldir, name))
+        return new['files'] != old['files'] or new['subdirs'] != old['subdirs']
+
+    def _drop(self, reldir):
+        prefix = reldir + "/"
+        for key in [key for key in self.dirs if key == reldir or not reldir or key.startswith(prefix)]: del self.dirs[key]
+
+    def _poll(self):
+        changed = False
+        for reldir, entry in list(self.dirs.items()):
+            if self._stop.is_set(): break
+            try: mtime = os.stat(self._path(reldir)).st_mtime_ns
+            except OSError: mtime = None
+            if mtime != entry['mtime'] and reldir in self.dirs: changed |= self._rescan(reldir)
+        return changed
+
+    def _publish(self):
+        entries = [[reldir, 0, entry['mtime'] // 1_000_000_000, ENTRY_DIR] for reldir, entry in self.dirs.items() if reldir]
+        entries += [[self._join(reldir, name), size, mtime, ENTRY_FILE] for reldir, entry in self.dirs.items() for name, (size, mtime) in entry['files'].items()]
+        entries.sort(key=lambda entry: entry[0])
+        self._snapshot = (self._snapshot[0] + 1, [entry[0] for entry in entries], entries)
+
+class _ChangeHandler:
+    # watchdog only needs an object with dispatch(); subclassing its handler base is not required.
+    def __init__(self, index): self.index = index
+    def dispatch(self, event): self.index._on_event(event)
@@ -0,0 +1,767 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import secrets
+import signal
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+from protocol import (FrameSocket, CMD_HELLO, REPLY_HELLO_OK, REPLY_SERVER_FULL, CAP_PIPELINE, CAP_FRAMES, CAP_PARALLEL, CAP_COMPRESS, CAP_DELTA, CAP_MUX, CAP_ARCHIVE, CAP_BATCH, CAP_DIGEST,
+                      CMD_LIST_FILES, CMD_DOWNLOAD_FILES, CMD_STAT_FILES, CMD_SYNC_FILE, CMD_ARCHIVE, PREFIX_ACK, PREFIX_ACK_FINAL, ENTRY_FILE,
+                      MSG_COMMAND, MSG_LISTING, MSG_FILE_HEADER, MSG_ACK, MSG_ERROR, MSG_END, MSG_DATA, MSG_COPY, MSG_DIGEST, MAX_FRAME_SIZE)
+from transfer import BATCH_FILE_LIMIT, BATCH_SIZE, FileBatch, FileSender, enable_ktls, hash_file_prefix
+from file_index import FileIndex
+from metrics import ServerMetrics
+from telemetry import Telemetry, format_rate
+from compression import Compressor, choose_codec, worth_compressing
+from delta import DeltaEncoder
+from hash_cache import HashCache
+from scheduler import BandwidthScheduler
+from mux import KIND_CHAT, KIND_STREAM, MuxConnection
+from tls import HANDSHAKE_TIMEOUT, HandshakeStats, describe, enable_session_tickets
+
+ENGINE_THREADED = "threaded"
+ENGINE_ASYNCIO = "asyncio"
+LISTEN_BACKLOG = 128
+SUPPORTED_CAPS = {CAP_PIPELINE, CAP_FRAMES, CAP_PARALLEL, CAP_COMPRESS, CAP_DELTA, CAP_MUX, CAP_ARCHIVE, CAP_BATCH, CAP_DIGEST}
+MAX_PARALLEL_STREAMS = 8
+MAX_PIPELINE_WINDOW = 256
+MAX_LISTING_PAGE = 5000
+PREFIX_MSG_C2S = "MSG_C2S:"
+PREFIX_MSG_S2C = "MSG_S2C:"
+PREFIX_WARN_S2C = "WARN_S2C:"
+
+class ServerObserver:
+    # Everything FileServer reports goes through these calls. They arrive on server threads, so a GUI
+    # adapter has to hand them over to its own thread. The base class ignores them all.
+    def log_event(self, category, ip="-", details=""): pass
+    def client_connected(self, client_id, ip): pass
+    def client_status(self, client_id, status): pass
+    def client_disconnected(self, client_id, ip): pass
+    def chat_connected(self, ip): pass
+    def chat_received(self, ip, message): pass
+    def chat_disconnected(self, ip): pass
+    def publish_telemetry(self, reports): pass
+
+class LogObserver(ServerObserver):
+    # Headless adapter: one JSON object per line on the "file_server" logger. Transfer progress is
+    # summarised every `progress_interval` seconds instead of at the telemetry rate.
+    def __init__(self, logger=None, progress_interval=10.0):
+        self.logger = logger or logging.getLogger("file_server")
+        self.progress_interval, self._last_progress = progress_interval, 0.0
+
+    def _emit(self, level, event, **fields):
+        self.logger.log(level, json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'event': event, **fields}))
+
+    def log_event(self, category, ip="-", details=""):
+        self._emit(logging.WARNING if category in ("Error", "Security Alert") else logging.INFO, "log", category=category, ip=ip, details=details)
+
+    def client_connected(self, client_id, ip): self._emit(logging.DEBUG, "client_connected", client=client_id, ip=ip)
+    def client_status(self, client_id, status): self._emit(logging.DEBUG, "client_status", client=client_id, status=status)
+    def client_disconnected(self, client_id, ip): self._emit(logging.DEBUG, "client_disconnected", client=client_id, ip=ip)
+
+    def publish_telemetry(self, reports):
+        now = time.monotonic()
+        if now - self._last_progress < self.progress_interval: return
+        self._last_progress = now
+        for report in reports:
+            if report['file']: self._emit(logging.INFO, "progress", client=report['key'], file=report['file'], percent=report['file_percent'], rate=format_rate(report['rate']))
+
+class FileServer:
+    def __init__(self, observer=None):
+        self.observer = observer or ServerObserver()
+        self.host = '0.0.0.0'
+        self.port, self.chat_port, self.web_port = 0, 0, 0
+        self.server_socket, self.chat_socket, self.web_server = None, None, None
+        self.scheduler = BandwidthScheduler()
+        self.running = False
+        self.share_mode, self.shared_path = 'directory', ""
+        self.clients_info, self.chat_clients, self.password, self.max_clients = {}, {}, None, 10
+        self.sessions, self.admit_lock, self.max_streams = {}, threading.Lock(), MAX_PARALLEL_STREAMS
+        self.ssl_context, self.ktls_enabled = None, False
+        self.engine, self.async_engine = ENGINE_THREADED, None
+        self.file_index, self.hash_cache, self.hash_cache_path = None, None, None
+        self.telemetry = Telemetry(self.observer.publish_telemetry)
+        self.handshakes = HandshakeStats()
+        self.batch_size = BATCH_SIZE
+        self.metrics = ServerMetrics()
+        self.metrics_host, self.metrics_port, self.metrics_server = '127.0.0.1', 0, None
+
+    @property
+    def is_paused(self): return self.scheduler.paused
+
+    @is_paused.setter
+    def is_paused(self, paused):
+        if paused: self.scheduler.pause()
+        else: self.scheduler.resume()
+
+    def _generate_certs(self):
+        key_file, cert_file = "server.key", "server.crt"
+        if os.path.exists(key_file) and os.path.exists(cert_file): return True, ""
+        try:
+            from OpenSSL import crypto
+            pkey = crypto.PKey(); pkey.generate_key(crypto.TYPE_RSA, 2048)
+            cert = crypto.X509(); cert.get_subject().CN = self.get_local_ip()
+            cert.set_serial_number(1000); cert.gmtime_adj_notBefore(0); cert.gmtime_adj_notAfter(10*365*24*60*60)
+            cert.set_issuer(cert.get_subject()); cert.set_pubkey(pkey); cert.sign(pkey, 'sha256')
+            with open(cert_file, "wt") as f: f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert).decode('utf-8'))
+            with open(key_file, "wt") as f: f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey).decode('utf-8'))
+            return True, ""
+        except ImportError: return False, "PyOpenSSL is required. Run: pip install pyopenssl"
+        except Exception as e: return False, f"Could not generate SSL certs: {e}"
+
+    def start(self, port, path, mode, password, max_clients, engine=ENGINE_THREADED):
+        if not path or not os.path.exists(path): return False, "Selected path does not exist."
+        certs_ok, msg = self._generate_certs();
+        if not certs_ok: return False, msg
+        
+        self.port, self.chat_port, self.web_port = int(port), int(port) + 1, int(port) + 2
+        self.shared_path, self.share_mode, self.password, self.max_clients = os.path.abspath(path), mode, password, int(max_clients)
+        self.engine = engine
+        if self.share_mode == 'directory':
+            self.file_index = FileIndex(self.shared_path, on_ready=lambda index, seconds: self.observer.log_event("Server Status", details=f"Indexed {len(index.files())} files in {seconds:.1f}s ({index.mode})."))
+            self.file_index.start()
+        
+        try:
+            # The asyncio engine and http.server are loaded here rather than at import so the GUI opens quickly.
+            from web_server import MetricsHTTPServer, SecureHTTPServer, handler_factory, metrics_handler_factory
+            self.scheduler.open()
+            self.hash_cache = self._open_hash_cache()
+            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(certfile="server.crt", keyfile="server.key")
+            self.ktls_enabled = enable_ktls(self.ssl_context)
+            enable_session_tickets(self.ssl_context)
+            self.handshakes = HandshakeStats()
+            if self.engine == ENGINE_ASYNCIO:
+                from aio_server import AsyncFileEngine
+                self.running = True
+                self.async_engine = AsyncFileEngine(self)
+                self.async_engine.start(self.host, self.port, self.chat_port, self.ssl_context, LISTEN_BACKLOG)
+            else:
+                self.server_socket = self._create_listening_socket(self.port)
+                self.chat_socket = self._create_listening_socket(self.chat_port)
+            if self.metrics_port: self.metrics_server = MetricsHTTPServer((self.metrics_host, self.metrics_port), metrics_handler_factory(self))
+            self.web_server = SecureHTTPServer((self.host, self.web_port), handler_factory(self.shared_path, self), self.ssl_context)
+            self.running = True
+            self.telemetry.start()
+            if self.engine != ENGINE_ASYNCIO:
+                threading.Thread(target=self.accept_connections, args=(self.server_socket, self.handle_file_client), daemon=True).start()
+                threading.Thread(target=self.accept_connections, args=(self.chat_socket, self.handle_chat_client), daemon=True).start()
+            threading.Thread(target=self.web_server.serve_forever, daemon=True).start()
+            if self.metrics_server: threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+            time.sleep(0.2)
+            return True, ""
+        except Exception as e:
+            self.running = False
+            if self.async_engine: self.async_engine.stop(); self.async_engine = None
+            if self.file_index: self.file_index.stop(); self.file_index = None
+            if self.hash_cache: self.hash_cache.close(); self.hash_cache = None
+            if self.metrics_server: self.metrics_server.server_close(); self.metrics_server = None
+            return False, str(e)
+
+    def _open_hash_cache(self):
+        # Digests are an optimisation, so a cache that cannot be opened is logged and the server runs without it.
+        try: return HashCache(self.hash_cache_path)
+        except (OSError, sqlite3.Error) as e:
+            self.observer.log_event("Server Status", details=f"Hash cache disabled, file headers go out without SHA-256: {e}")
+            return None
+
+    def _create_listening_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, port)); sock.listen(LISTEN_BACKLOG)
+        return sock
+
+    def stop(self):
+        if self.running: self.observer.log_event("Server Status", details=f"TLS handshakes: {self.handshakes.summary()}")
+        self.running = False
+        self.scheduler.close()
+        if self.async_engine: self.async_engine.stop(); self.async_engine = None
+        if self.file_index: self.file_index.stop(); self.file_index = None
+        if self.hash_cache: self.hash_cache.close(); self.hash_cache = None
+        self.telemetry.stop(); self.telemetry.counters.clear()
+        if self.web_server: self.web_server.shutdown(); self.web_server.server_close()
+        if self.metrics_server: self.metrics_server.shutdown(); self.metrics_server.server_close(); self.metrics_server = None
+        for sock in [self.server_socket, self.chat_socket]:
+            if not sock: continue
+            try: sock.shutdown(socket.SHUT_RDWR) # Wakes the accept() thread; close() alone leaves the port bound.
+            except OSError: pass
+            sock.close()
+        for client_id in list(self.clients_info.keys()):
+            if self.clients_info[client_id].get('socket'): self.clients_info[client_id]['socket'].close()
+        for ip in list(self.chat_clients.keys()):
+            if self.chat_clients[ip]: self.chat_clients[ip].close()
+        self.clients_info.clear(); self.chat_clients.clear(); self.sessions.clear()
+
+    def accept_connections(self, listening_socket, handler_func):
+        while self.running:
+            try:
+                client_socket, addr = listening_socket.accept()
+                if self.is_paused: # max_clients is checked later, once the connection says whether it joins a session.
+                    self.metrics.rejected("paused"); client_socket.close()
+                    continue
+                threading.Thread(target=self._handshake, args=(client_socket, addr[0], handler_func), daemon=True).start()
+            except socket.error: break
+
+    def _handshake(self, raw_socket, ip, handler_func):
+        # Done on the connection's own thread so a slow or failing client never holds up accept().
+        started = time.perf_counter()
+        try:
+            raw_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Otherwise the ticket write plus a short reply waits on a delayed ACK.
+            raw_socket.settimeout(HANDSHAKE_TIMEOUT)
+            client_socket = self.ssl_context.wrap_socket(raw_socket, server_side=True)
+            client_socket.settimeout(None)
+        except (OSError, ssl.SSLError) as e:
+            raw_socket.close(); self.handshakes.failed()
+            self.observer.log_event("Connection", ip, f"TLS handshake failed: {e}")
+            return
+        self._handshake_done(ip, client_socket, time.perf_counter() - started)
+        handler_func(client_socket, ip)
+
+    def _handshake_done(self, ip, tls_sock, seconds):
+        self.handshakes.record(seconds, tls_sock.session_reused)
+        self.observer.log_event("Connection", ip, f"TLS handshake {seconds * 1000:.1f} ms ({describe(tls_sock)}).")
+
+    def handle_chat_client(self, chat_socket, ip):
+        self._chat_connected(ip, chat_socket)
+        while self.running:
+            try:
+                data = chat_socket.recv(1024)
+                if not data: break
+                self._chat_received(ip, data)
+            except (ConnectionResetError, ssl.SSLError): break
+        self._chat_disconnected(ip, chat_socket)
+
+    def _chat_connected(self, ip, chat_socket):
+        self.chat_clients[ip] = chat_socket
+        self.observer.log_event("Chat", ip, "Chat connection established.")
+        self.observer.chat_connected(ip)
+
+    def _chat_received(self, ip, data):
+        message = data.decode('utf-8')
+        if message.startswith(PREFIX_MSG_C2S):
+            payload = message.split(":", 1)[1]
+            self.observer.log_event("Chat", ip, f"Received: '{payload}'")
+            self.observer.chat_received(ip, payload)
+
+    def _chat_disconnected(self, ip, chat_socket):
+        # Chat is keyed by IP, so a newer connection from the same host may have replaced this one; only the
+        # current one is unregistered, and only this connection's own socket is closed.
+        self.observer.log_event("Chat", ip, "Chat connection lost.")
+        chat_socket.close()
+        if self.chat_clients.get(ip) is not chat_socket: return
+        del self.chat_clients[ip]
+        self.observer.chat_disconnected(ip)
+
+    def send_chat_message(self, ip, comm_type, payload):
+        if ip in self.chat_clients:
+            try:
+                prefix = PREFIX_MSG_S2C if comm_type == "MSG" else PREFIX_WARN_S2C
+                self.chat_clients[ip].sendall(f"{prefix}{payload}".encode('utf-8'))
+                return True
+            except (ConnectionResetError, BrokenPipeError): return False
+        return False
+        
+    def _session_count(self):
+        # Admitted sessions; parallel data connections share their control connection's session and count once.
+        return len({info.get('session') or client_id for client_id, info in list(self.clients_info.items()) if info.get('admitted')})
+
+    def _admit(self, client_id, client_ip, command):
+        # max_clients applies once a connection says what it is: on HELLO, or on a legacy client's first command.
+        # A stream presenting a live session token joins that session (up to max_streams data connections besides
+        # the control connection) instead of counting as a new client. Returns None once admitted, otherwise
+        # the reply to send before closing (empty for legacy clients, which have no way to read it).
+        join, hello = None, command.startswith(CMD_HELLO)
+        if hello:
+            try: join = json.loads(command[len(CMD_HELLO):]).get('join')
+            except (ValueError, AttributeError): pass
+        with self.admit_lock:
+            info = self.clients_info[client_id]
+            if join in self.sessions:
+                # Claimed here rather than in _negotiation_reply, so streams joining at once are all counted.
+                if sum(1 for other in list(self.clients_info.values()) if other.get('session') == join) <= self.max_streams:
+                    info.update(admitted=True, session=join); return None
+                reason = "max_streams"
+            elif self._session_count() < self.max_clients: info['admitted'] = True; return None
+            else: reason = "max_clients"
+        self.metrics.rejected(reason)
+        self.observer.log_event("Connection", client_ip, f"Refused: {reason} reached.")
+        return f"{REPLY_SERVER_FULL}{json.dumps({'reason': reason})}\n".encode('utf-8') if hello else b""
+
+    def handle_file_client(self, client_socket, client_ip, authenticated=False):
+        # Channels of a multiplexed connection arrive already authenticated.
+        client_id = self._register_client(client_ip, client_socket.getpeername()[1], client_socket)
+        try:
+            if not authenticated and not self._authenticate(client_socket, client_ip): return
+            self.observer.client_status(client_id, "Connected")
+            client_socket.settimeout(None)
+            session = {'id': client_id, 'caps': set(), 'window': 1, 'frames': None, 'codec': None, 'sender': None, 'progress': self.clients_info[client_id]['progress']}
+            admitted = False
+            while self.running:
+                frames = session['frames']
+                if frames:
+                    _, request = frames.read_message(MSG_COMMAND, eof_ok=True)
+                    if request is None: break
+                    command = request.get('cmd', "")
+                else:
+                    command_bytes = client_socket.recv(1024)
+                    if not command_bytes: break
+                    command, request = command_bytes.decode('utf-8', 'replace'), {}
+                if not admitted:
+                    if (refusal := self._admit(client_id, client_ip, command)) is not None:
+                        if refusal: client_socket.sendall(refusal)
+                        break
+                    admitted = True
+                if command.startswith(CMD_HELLO) and not frames:
+                    client_socket = self._negotiate(client_socket, client_ip, command, session)
+                elif command == CMD_LIST_FILES:
+                    self.observer.client_status(client_id, "Listing files")
+                    started = time.perf_counter()
+                    if frames and 'page_size' in request:
+                        for page in self._listing_pages(request): frames.send_frame(MSG_LISTING, page)
+                    elif frames: frames.send_frame(MSG_LISTING, self._listing_payload())
+                    else: client_socket.sendall(self._listing_payload())
+                    self.metrics.list_latency.observe(time.perf_counter() - started)
+                    self.observer.client_status(client_id, "Idle")
+                elif command == CMD_STAT_FILES and frames:
+                    frames.send_message(MSG_LISTING, self._stat_files(client_ip, request.get('files', [])))
+                elif command.startswith(CMD_DOWNLOAD_FILES):
+                    requested_files = request.get('files', []) if frames else self._recv_json(client_socket, command_bytes[len(CMD_DOWNLOAD_FILES):])
+                    self._send_files(client_socket, client_ip, requested_files, session, request.get('offsets', {}), request.get('ranges', {}))
+                elif command == CMD_SYNC_FILE and frames:
+                    self._sync_file(client_ip, request, session)
+                elif command == CMD_ARCHIVE and frames:
+                    self._send_archive(client_ip, request, session)
+                elif frames:
+                    frames.send_message(MSG_ERROR, {'message': f"Unknown command: {command}"})
+        except (socket.timeout, ConnectionResetError, ssl.SSLEOFError): self.observer.log_event("Error", client_ip, "Connection lost.")
+        except Exception as e: self.observer.log_event("Error", client_ip, f"An unexpected error occurred: {e}")
+        finally:
+            self._release_client(client_id, client_ip)
+            client_socket.close()
+
+    def _authenticate(self, client_socket, client_ip):
+        self.observer.log_event("Connection", client_ip, "Authenticating...")
+        if self.password:
+            client_socket.sendall(b'NEEDS_PASS')
+            client_socket.settimeout(10.0)
+            password = client_socket.recv(1024).decode()
+            if password != self.password:
+                client_socket.sendall(b"AUTH_FAILED"); self.metrics.auth_failed(); self.observer.log_event("Authentication", client_ip, "Failed (Incorrect password)."); return False
+            client_socket.sendall(b"AUTH_SUCCESS"); self.observer.log_event("Authentication", client_ip, "Successful.")
+        else:
+            client_socket.sendall(b'NO_PASS'); self.observer.log_event("Authentication", client_ip, "Successful (No password).")
+        return True
+
+    def _channel_opened(self, channel, kind, client_ip):
+        if kind == KIND_STREAM: self.handle_file_client(channel, client_ip, authenticated=True)
+        elif kind == KIND_CHAT: self.handle_chat_client(channel, client_ip)
+        else: channel.close()
+
+    def _register_client(self, client_ip, peer_port, connection):
+        client_id = f"{client_ip}:{peer_port}"
+        self.clients_info[client_id] = {'socket': connection, 'progress': self.telemetry.counter(client_id)}
+        self.observer.client_connected(client_id, client_ip)
+        return client_id
+
+    def _release_client(self, client_id, client_ip):
+        self.observer.log_event("Connection", client_ip, "Client disconnected.")
+        info = self.clients_info.pop(client_id, {})
+        self.observer.client_disconnected(client_id, client_ip)
+        self.telemetry.remove(client_id)
+        if self.sessions.get(info.get('session')) == client_id: del self.sessions[info['session']]
+
+    def _negotiate(self, client_socket, client_ip, command, session):
+        # Returns the socket the session continues on: the control channel once the connection is multiplexed.
+        client_socket.sendall(self._negotiation_reply(client_ip, command, session))
+        if CAP_MUX in session['caps']: client_socket = MuxConnection(client_socket, lambda channel, kind: self._channel_opened(channel, kind, client_ip)).control
+        session['frames'] = FrameSocket(client_socket) if CAP_FRAMES in session['caps'] else None
+        return client_socket
+
+    def _negotiation_reply(self, client_ip, command, session):
+        hello = json.loads(command[len(CMD_HELLO):])
+        caps = SUPPORTED_CAPS & set(hello.get('caps', []))
+        if CAP_FRAMES in caps: caps.add(CAP_PIPELINE) # Framed transfers always use cumulative ACKs.
+        window = max(1, min(int(hello.get('window', 1)), MAX_PIPELINE_WINDOW)) if CAP_PIPELINE in caps else 1
+        codec = choose_codec(hello.get('codecs')) if CAP_COMPRESS in caps and CAP_FRAMES in caps else None
+        if codec is None: caps.discard(CAP_COMPRESS) # Compressed windows need frames to carry their length.
+        # Only the threaded engine multiplexes, and only a control connection, never a stream joining a session.
+        if CAP_FRAMES not in caps or hello.get('join') or self.engine != ENGINE_THREADED: caps.discard(CAP_MUX)
+        if CAP_FRAMES not in caps or not self.batch_size: caps.discard(CAP_BATCH)
+        if CAP_FRAMES not in caps: caps.discard(CAP_DIGEST)
+        reply, joined = {'caps': sorted(caps), 'window': window, 'codec': codec}, False
+        if CAP_PARALLEL in caps:
+            # Data connections join the session token handed out to their control connection.
+            token = hello.get('join')
+            joined = token in self.sessions
+            if not joined:
+                token = secrets.token_hex(16)
+                self.sessions[token] = session['id']
+            self.clients_info[session['id']]['session'] = token
+            reply.update(session=token, max_streams=self.max_streams)
+        session.update(caps=caps, window=window, codec=codec)
+        self.observer.log_event("Connection", client_ip, f"Negotiated{' as a parallel stream' if joined else ''}: {', '.join(sorted(caps)) or 'legacy'} (window {window}{f', {codec}' if codec else ''}).")
+        return f"{REPLY_HELLO_OK}{json.dumps(reply)}\n".encode('utf-8')
+
+    def _recv_json(self, client_socket, data=b""):
+        # Unframed clients send the file list right after the command; it may span several reads.
+        while True:
+            if data:
+                try: return json.loads(data.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError): pass
+            chunk = client_socket.recv(65536)
+            if not chunk: raise ConnectionResetError("Socket connection broken")
+            data += chunk
+
+    def _list_shared_files(self):
+        if self.share_mode == 'file': return [os.path.basename(self.shared_path)]
+        return self.file_index.files() # Relative paths with forward slashes, kept current by the index.
+
+    def _listing_payload(self):
+        if self.share_mode == 'file': return json.dumps(self._list_shared_files()).encode('utf-8')
+        return self.file_index.listing_payload()
+
+    def _listing_pages(self, request):
+        page_size = max(1, min(int(request.get('page_size') or MAX_LISTING_PAGE), MAX_LISTING_PAGE))
+        cursor, limit = request.get('cursor'), request.get('limit')
+        if self.share_mode == 'file':
+            name, stat = os.path.basename(self.shared_path), os.stat(self.shared_path)
+            entries = [] if cursor else [[name, stat.st_size, int(stat.st_mtime), ENTRY_FILE]]
+            return [json.dumps({'entries': entries, 'cursor': name, 'more': False, 'last': True, 'total': 1}).encode('utf-8')]
+        return self.file_index.page_payloads(page_size, cursor, None if limit is None else int(limit))
+
+    def _resolve_requested_file(self, client_ip, filename):
+        # --- IMPORTANT SECURITY CONSIDERATION ---
+        # 'filename' comes from the client and must be a CLEAN, RELATIVE path inside the share.
+        # Both sides are resolved with realpath ('..' and symlinks) and compared by whole path components,
+        # so neither "../x" nor a sibling folder that merely starts with the share's name gets through.
+        file_full_path = os.path.abspath(os.path.join(self.shared_path, filename))
+        if self.share_mode == 'file':
+            # If sharing a single file, only that specific file can be downloaded
+            if file_full_path != os.path.abspath(self.shared_path):
+                self.observer.log_event("Security Alert", client_ip, f"Attempted to download file outside shared single file: {filename}")
+                return None
+            return file_full_path, os.path.basename(self.shared_path) # Ensure client gets the correct name
+        root = os.path.realpath(self.shared_path)
+        if os.path.commonpath([os.path.realpath(file_full_path), root]) != root:
+            self.observer.log_event("Security Alert", client_ip, f"Attempted path traversal: {filename}")
+            return None
+        if not os.path.isfile(file_full_path):
+            self.observer.log_event("File Transfer", client_ip, f"Requested non-existent or directory: {filename}")
+            return None
+        # --- END SECURITY CONSIDERATION ---
+        return file_full_path, filename
+
+    def _stat_files(self, client_ip, requested_files):
+        stats = []
+        for filename in requested_files:
+            if resolved := self._resolve_requested_file(client_ip, filename): stats.append({'name': filename, 'size': os.path.getsize(resolved[0])})
+        return stats
+
+    def _resume_offset(self, client_ip, req_path, filesize, resume):
+        # A resume request is honoured only if the client's partial bytes still match the file here.
+        offset = int(resume.get('offset', 0)) if resume else 0
+        if not 0 < offset <= filesize: return 0
+        if hash_file_prefix(req_path, offset) != resume.get('sha256'):
+            self.observer.log_event("File Transfer", client_ip, f"Partial data for '{os.path.basename(req_path)}' no longer matches; restarting.")
+            return 0
+        return offset
+
+    def _plan_send(self, client_ip, req_path, requested_name, framed, offsets=None, ranges=None):
+        filesize = os.path.getsize(req_path)
+        offset, length = 0, filesize
+        if framed and (byte_range := (ranges or {}).get(requested_name)):
+            offset = min(max(0, int(byte_range[0])), filesize)
+            length = min(max(0, int(byte_range[1])), filesize - offset)
+        elif framed:
+            offset = self._resume_offset(client_ip, req_path, filesize, (offsets or {}).get(requested_name))
+            length = filesize - offset
+        return filesize, offset, length
+
+    def _plan_file(self, client_ip, filename, framed, offsets=None, ranges=None, batch=None):
+        # Resolve and plan in one call, so the asyncio engine pays one executor hop per file: returns (name, req_path,
+        # filesize, offset, length, batched) or None if unavailable. A small whole file that fits goes into `batch` at once.
+        resolved = self._resolve_requested_file(client_ip, filename)
+        if not resolved: return None
+        req_path, name = resolved
+        filesize, offset, length = self._plan_send(client_ip, req_path, filename, framed, offsets, ranges)
+        batched = self._batchable(batch, filesize, offset, length) and batch.fits(length)
+        if batched: batch.add(req_path, name, length)
+        return name, req_path, filesize, offset, length, batched
+
+    def _file_digest(self, session, req_path, filesize, offset, length):
+        # (SHA-256 for the file header, cache key to hash the send under). On a cache miss a whole file sent
+        # to a client that takes trailers is hashed as it goes out; anything else waits for the pool to warm the cache.
+        cache = self.hash_cache
+        if not cache: return None, None
+        trailer = CAP_DIGEST in session['caps'] and offset == 0 and length == filesize
+        if (digest := cache.lookup(req_path, warm=not trailer)) or not trailer: return digest, None
+        try: return None, cache.key(req_path)
+        except OSError: return None, None
+
+    def _digest_trailer(self, req_path, key, digest):
+        # The digest of the bytes just sent goes to the client and into the cache, so no one reads the file again to hash it.
+        if self.hash_cache: self.hash_cache.store(req_path, key, digest.hexdigest())
+        return {'sha256': digest.hexdigest()}
+
+    def _compressor_for(self, session, req_path, length):
+        # Decided per file, so archives and media in a compressed session still go out untouched.
+        return Compressor(session['codec']) if session.get('codec') and worth_compressing(req_path, length) else None
+
+    def _sent_message(self, filename, compressor):
+        return f"Successfully sent '{filename}'" + (f" ({compressor.summary()})." if compressor else ".")
+
+    def _batch_for(self, session):
+        return FileBatch(min(self.batch_size, MAX_FRAME_SIZE // 2), session.get('codec')) if CAP_BATCH in session['caps'] and self.batch_size else None
+
+    @staticmethod
+    def _batchable(batch, filesize, offset, length):
+        # Whole small files only; ranges, resumed files and anything larger keep their own header and data frames.
+        return batch is not None and offset == 0 and length == filesize and length <= min(BATCH_FILE_LIMIT, batch.limit)
+
+    def _batch_message(self, count, nbytes):
+        return f"Successfully sent {count} small file(s) in one batch ({nbytes} bytes)."
+
+    def _send_batch(self, client_socket, client_ip, batch, session, sent_count, acked):
+        # A batch takes one slot of the pipeline window and is acknowledged like a single file.
+        if not batch or not batch.index: return sent_count, acked
+        while sent_count - acked >= session['window']: acked, _ = self._recv_ack(client_socket, session['frames'])
+        frame, count = batch.take()
+        self.scheduler.acquire(client_ip, len(frame))
+        client_socket.sendall(frame)
+        self.metrics.served(count)
+        self.observer.log_event("File Transfer", client_ip, self._batch_message(count, len(frame)))
+        return sent_count + 1, acked
+
+    def _send_files(self, client_socket, client_ip, requested_files, session, offsets=None, ranges=None):
+        frames = session['frames']
+        self.observer.log_event("File Transfer", client_ip, f"Requested {len(requested_files)} file(s).")
+        if session['sender'] is None:
+            session['sender'] = FileSender(client_socket, framed=frames is not None)
+            self.observer.log_event("File Transfer", client_ip, f"Send engine: {session['sender'].mode}.")
+        sender, window, pipelined, progress = session['sender'], session['window'], CAP_PIPELINE in session['caps'], session['progress']
+        sent_count, acked, batch = 0, 0, self._batch_for(session)
+        progress.reset(); self.observer.client_status(session['id'], "Downloading")
+        for filename in requested_files:
+            resolved = self._resolve_requested_file(client_ip, filename)
+            if not resolved:
+                if frames: frames.send_message(MSG_ERROR, {'name': filename, 'message': "File is not available."})
+                continue
+            requested_name = filename
+            req_path, filename = resolved
+            filesize, offset, length = self._plan_send(client_ip, req_path, requested_name, frames is not None, offsets, ranges)
+            if self._batchable(batch, filesize, offset, length):
+                if not batch.fits(length): sent_count, acked = self._send_batch(client_socket, client_ip, batch, session, sent_count, acked)
+                batch.add(req_path, filename, length)
+                progress.begin_file(filename, filesize); progress.update(length)
+                continue
+            sent_count, acked = self._send_batch(client_socket, client_ip, batch, session, sent_count, acked)
+            while pipelined and sent_count - acked >= window: acked, _ = self._recv_ack(client_socket, frames)
+            compressor = self._compressor_for(session, req_path, length)
+            progress.begin_file(filename, filesize, offset)
+            digest, key = self._file_digest(session, req_path, filesize, offset, length) if frames else (None, None)
+            if frames: frames.send_message(MSG_FILE_HEADER, {'name': filename, 'size': filesize, 'offset': offset, 'length': length, 'codec': compressor and compressor.codec, 'sha256': digest, 'trailer': key is not None})
+            else: client_socket.sendall(f"{filename}:{filesize}\n".encode('utf-8'))
+            if offset and not ranges: self.observer.log_event("File Transfer", client_ip, f"Resuming '{filename}' at byte {offset}.")
+            hasher = hashlib.sha256() if key else None
+            with open(req_path, 'rb') as f:
+                sender.send_range(f, offset, length, on_progress=lambda sent: progress.update(offset + sent), before_window=lambda size: self.scheduler.acquire(client_ip, size), compressor=compressor, digest=hasher)
+            if hasher: frames.send_message(MSG_DIGEST, self._digest_trailer(req_path, key, hasher))
+            sent_count += 1
+            if not pipelined: client_socket.recv(1024)
+            self.metrics.served()
+            self.observer.log_event("File Transfer", client_ip, self._sent_message(filename, compressor))
+        sent_count, acked = self._send_batch(client_socket, client_ip, batch, session, sent_count, acked)
+        if frames: frames.send_message(MSG_END, {'count': sent_count})
+        else: client_socket.sendall(b'END_OF_TRANSMISSION\n')
+        final = not pipelined
+        while not final: acked, final = self._recv_ack(client_socket, frames) # The client confirms END with a final ACK.
+        progress.finish(); self.observer.client_status(session['id'], "Completed")
+
+    def _sync_file(self, client_ip, request, session):
+        frames, progress = session['frames'], session['progress']
+        plan, header = self._plan_delta(client_ip, request, session)
+        if not plan: frames.send_message(MSG_ERROR, header); return
+        filename, filesize, encoder, compressor = plan
+        progress.reset(); progress.begin_file(filename, filesize); self.observer.client_status(session['id'], "Syncing")
+        frames.send_message(MSG_FILE_HEADER, header)
+        for msg_type, payload in self._delta_frames(encoder, compressor):
+            self.scheduler.acquire(client_ip, len(payload))
+            frames.send_frame(msg_type, payload)
+            progress.update(encoder.position)
+        frames.send_message(MSG_END, {'count': 1, 'sha256': encoder.sha256})
+        self.metrics.served()
+        self.observer.log_event("File Transfer", client_ip, self._synced_message(filename, encoder, compressor))
+        progress.finish(); self.observer.client_status(session['id'], "Completed")
+
+    def _plan_delta(self, client_ip, request, session):
+        # Returns (plan, header) for SYNC_FILE, or (None, error message) when it cannot be served.
+        name = request.get('name', "")
+        resolved = self._resolve_requested_file(client_ip, name)
+        if not resolved: return None, {'name': name, 'message': "File is not available."}
+        req_path, filename = resolved
+        try: encoder = DeltaEncoder(req_path, request)
+        except (KeyError, TypeError, ValueError): return None, {'name': name, 'message': "Invalid block signature."}
+        filesize = os.path.getsize(req_path)
+        compressor = self._compressor_for(session, req_path, filesize)
+        header = {'name': filename, 'size': filesize, 'offset': 0, 'length': filesize, 'codec': compressor and compressor.codec, 'block_size': encoder.block_size}
+        return (filename, filesize, encoder, compressor), header
+
+    @staticmethod
+    def _delta_frames(encoder, compressor):
+        # Literal data goes out as DATA frames (compressed like a download), block runs as COPY frames.
+        for op in encoder.ops():
+            if isinstance(op, tuple): yield MSG_COPY, json.dumps({'index': op[0], 'count': op[1]}).encode('utf-8')
+            else: yield MSG_DATA, compressor.compress(op) if compressor else op
+
+    def _synced_message(self, filename, encoder, compressor):
+        return (f"Synced '{filename}' by delta: {encoder.literal_bytes} literal and {encoder.matched_bytes} matched bytes"
+                + (f" ({compressor.summary()})." if compressor else "."))
+
+    def _send_archive(self, client_ip, request, session):
+        frames, progress = session['frames'], session['progress']
+        stream, header = self._plan_archive(client_ip, request)
+        if not stream: frames.send_message(MSG_ERROR, header); return
+        progress.reset(); progress.begin_file(header['name'], header['bytes']); self.observer.client_status(session['id'], "Archiving")
+        frames.send_message(MSG_FILE_HEADER, header)
+        for chunk in stream.chunks():
+            self.scheduler.acquire(client_ip, len(chunk))
+            frames.send_frame(MSG_DATA, chunk)
+            progress.update(stream.input_bytes)
+        frames.send_message(MSG_END, self._archive_end(stream))
+        self.metrics.served(stream.files)
+        self.observer.log_event("File Transfer", client_ip, self._archived_message(header['name'], stream))
+        progress.finish(); self.observer.client_status(session['id'], "Completed")
+
+    def _plan_archive(self, client_ip, request):
+        # Returns (TarStream, header) for ARCHIVE, or (None, error message). Paths may name files or folders
+        # of the share; "" (or no paths) is the whole share. Overlapping selections are archived once.
+        from archive import ARCHIVE_COMPRESSIONS, TarStream, archive_name, tree_members
+        compression, paths = request.get('compression') or "", request.get('paths') or [""]
+        if compression not in ARCHIVE_COMPRESSIONS: return None, {'message': f"Unsupported archive compression: {compression}"}
+        root = os.path.normpath(self.shared_path)
+        if self.share_mode == 'file': root, paths = os.path.dirname(root), [os.path.basename(root)]
+        members, seen, skipped, total = [], set(), [], 0
+        for name in paths:
+            path = os.path.normpath(os.path.join(root, name))
+            if os.path.commonpath([path, root]) != root:
+                self.observer.log_event("Security Alert", client_ip, f"Attempted path traversal: {name}"); skipped.append(name); continue
+            if not os.path.exists(path): skipped.append(name); continue
+            for member in tree_members(root, path):
+                if member[1] in seen: continue
+                seen.add(member[1]); members.append(member)
+                if not member[2]:
+                    try: total += os.path.getsize(member[0])
+                    except OSError: pass
+        if not members: return None, {'message': "Nothing to archive."}
+        base = os.path.basename(os.path.normpath(os.path.join(root, paths[0]))) if len(paths) == 1 else os.path.basename(root)
+        stream = TarStream(members, compression)
+        header = {'name': archive_name(base or "share", compression), 'compression': compression, 'files': sum(1 for m in members if not m[2]), 'bytes': total, 'skipped': skipped}
+        self.observer.log_event("File Transfer", client_ip, f"Archiving {header['files']} file(s) as '{header['name']}'.")
+        return stream, header
+
+    @staticmethod
+    def _archive_end(stream):
+        return {'count': stream.files, 'bytes': stream.output_bytes, 'skipped': stream.skipped}
+
+    def _archived_message(self, name, stream):
+        return f"Successfully sent '{name}': {stream.files} file(s), {stream.input_bytes} -> {stream.output_bytes} bytes."
+
+    def _recv_ack(self, client_socket, frames=None):
+        if frames:
+            ack = frames.read_message(MSG_ACK)[1]
+            return ack['count'], ack.get('final', False)
+        line = b""
+        while not line.endswith(b'\n'):
+            chunk = client_socket.recv(1)
+            if not chunk: raise ConnectionResetError("Socket connection broken")
+            line += chunk
+        return self._parse_ack(line)
+
+    @staticmethod
+    def _parse_ack(line):
+        ack = line.decode('utf-8').strip()
+        if ack.startswith(PREFIX_ACK_FINAL): return int(ack[len(PREFIX_ACK_FINAL):]), True
+        if not ack.startswith(PREFIX_ACK): raise ConnectionError(f"Expected ACK, got: {ack}")
+        return int(ack[len(PREFIX_ACK):]), False
+
+    @staticmethod
+    def get_local_ip():
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); s.settimeout(0.1); s.connect(('8.8.8.8', 1)); IP = s.getsockname()[0]
+        except Exception: IP = '127.0.0.1'
+        finally: s.close()
+        return IP
+
+DEFAULT_CONFIG = {'port': 5000, 'path': None, 'mode': 'directory', 'password_file': None, 'max_clients': 10, 'engine': ENGINE_THREADED,
+                  'rate': 0, 'client_limits': {}, 'batch_kb': BATCH_SIZE // 1024, 'metrics_port': 0, 'metrics_host': '127.0.0.1',
+                  'hash_cache': None, 'log_level': "INFO", 'log_file': None}
+
+def load_config(path):
+    # JSON object with DEFAULT_CONFIG's keys; rates are in MB/s and client_limits maps an IP to {"limit", "weight"}.
+    if not path: return {}
+    with open(path, 'r', encoding='utf-8') as f: config = json.load(f)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown: raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+    return config
+
+def parse_client_limit(value):
+    # "IP=MBPS" or "IP=MBPS:WEIGHT"
+    ip, _, limit = value.partition("=")
+    limit, _, weight = limit.partition(":")
+    if not ip or not limit: raise argparse.ArgumentTypeError(f"Expected IP=MBPS[:WEIGHT], got {value!r}")
+    return ip, {'limit': float(limit), 'weight': float(weight or 1)}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the file server without a GUI. Command line options override the config file.")
+    parser.add_argument("--config", help="JSON config file")
+    parser.add_argument("--port", type=int, help="file port; chat and web use the next two (default 5000)")
+    parser.add_argument("--path", help="directory or file to share")
+    parser.add_argument("--mode", choices=("directory", "file"), help="share a directory or a single file")
+    parser.add_argument("--password-file", help="file whose first line is the client password")
+    parser.add_argument("--max-clients", type=int)
+    parser.add_argument("--engine", choices=(ENGINE_THREADED, ENGINE_ASYNCIO))
+    parser.add_argument("--rate", type=float, help="total bandwidth limit in MB/s (0 = unlimited)")
+    parser.add_argument("--client-limit", type=parse_client_limit, action="append", metavar="IP=MBPS[:WEIGHT]", help="per-client limit and weight; repeatable")
+    parser.add_argument("--batch-kb", type=int, help="pack small files into frames of up to this many KB (0 = one frame per file)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics at http://HOST:PORT/metrics (0 = off)")
+    parser.add_argument("--metrics-host", help="address for the metrics port (default 127.0.0.1)")
+    parser.add_argument("--hash-cache", help="SQLite file for cached SHA-256 digests (default: the per-user cache directory)")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    parser.add_argument("--log-file", help="append logs here instead of stderr")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {**DEFAULT_CONFIG, **load_config(args.config)}
+    config.update((key, value) for key, value in vars(args).items() if value is not None and key in DEFAULT_CONFIG)
+    config['client_limits'] = {**config['client_limits'], **dict(args.client_limit or [])}
+    logging.basicConfig(level=config['log_level'], format="%(message)s", filename=config['log_file'])
+    observer = LogObserver()
+    if not config['path']: observer.log_event("Error", details="No share path given (--path or \"path\" in the config file)."); return 2
+    password = None
+    if config['password_file']:
+        with open(config['password_file'], 'r', encoding='utf-8') as f: password = f.readline().rstrip("\r\n") or None
+    server = FileServer(observer)
+    server.scheduler.set_rate(int(config['rate'] * 1e6))
+    server.batch_size = max(0, int(config['batch_kb'])) * 1024
+    server.metrics_host, server.metrics_port = config['metrics_host'], int(config['metrics_port'])
+    server.hash_cache_path = config['hash_cache']
+    for ip, limit in config['client_limits'].items(): server.scheduler.set_client(ip, int(limit.get('limit', 0) * 1e6), limit.get('weight', 1.0))
+    ok, msg = server.start(config['port'], config['path'], config['mode'], password, config['max_clients'], config['engine'])
+    if not ok: observer.log_event("Error", details=msg); return 1
+    observer.log_event("Server Status", details=f"Serving {server.shared_path} on port {server.port} ({'Secure' if password else 'Open'} Mode, {server.engine} engine).")
+    if server.metrics_server: observer.log_event("Server Status", details=f"Metrics at http://{server.metrics_host}:{server.metrics_port}/metrics.")
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM): signal.signal(signum, lambda *_: stopping.set())
+    while not stopping.wait(1.0): pass # A timed wait keeps signal handlers running on every platform.
+    server.stop()
+    observer.log_event("Server Status", details="Server stopped")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import threading
+from transfer import hash_file_prefix
+
+APP_DIR_NAME = "pro-secure-suite"
+HASH_CACHE_FILE = "hash_cache.sqlite3"
+HASH_WORKERS = 2
+
+def default_cache_path():
+    # The per-user cache directory, never the working directory: that may be read-only, or the share itself.
+    if os.name == 'nt': base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    elif sys.platform == 'darwin': base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else: base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, APP_DIR_NAME, HASH_CACHE_FILE)
+
+class HashCache:
+    # SHA-256 of served files, kept in SQLite across restarts and keyed by path, size, mtime and inode,
+    # so an edited or replaced file is never announced with a stale digest. A file sent whole is hashed
+    # by its sender as the bytes go out and store()d from there; other misses are queued on a small
+    # thread pool that warms the cache, and go out without a digest until it is ready.
+    def __init__(self, db_path=None, workers=HASH_WORKERS):
+        db_path = db_path or default_cache_path()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, sha256 TEXT)")
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+        self.pending = set()
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def key(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def lookup(self, path, warm=True):
+        # A miss is queued for the pool unless warm=False, when the caller hashes the file itself.
+        path = os.path.abspath(path)
+        try:
+            key = self.key(path)
+            with self.lock: row = self.db.execute("SELECT size, mtime_ns, inode, sha256 FROM hashes WHERE path = ?", (path,)).fetchone()
+            if row and tuple(row[:3]) == key: self.hits += 1; return row[3]
+            self.misses += 1
+        except (OSError, sqlite3.Error): return None
+        if not warm: return None
+        with self.lock:
+            if path in self.pending: return None
+            self.pending.add(path)
+        self.pool.submit(self._hash_later, path, key)
+        return None
+
+    def store(self, path, key, digest):
+        # `key` is the file's key from before it was read; a file that changed meanwhile is not recorded.
+        path = os.path.abspath(path)
+        try:
+            if digest is None or self.key(path) != key: return
+            with self.lock, self.db: self.db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", (path, *key, digest))
+        except (OSError, sqlite3.Error): pass
+
+    def _hash_later(self, path, key):
+        try: self.store(path, key, hash_file_prefix(path, key[0]))
+        except OSError: pass
+        finally:
+            with self.lock: self.pending.discard(path)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock: self.db.close()
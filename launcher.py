@@ -1,8 +1,6 @@
+import importlib
 import tkinter as tk
 from tkinter import ttk
-import os
-import subprocess
-import sys
 
 FONT_FAMILY = "Berlin Sans FB Demi"
 FONT_TITLE = (FONT_FAMILY, 22, "bold")
@@ -19,6 +17,8 @@ COLOR_HOVER_BG = "#FFFFFF"
 COLOR_HOVER_TEXT = "#000000"
 COLOR_CREDIT_TEXT = "#AAAAAA"
 
+APPS = {"server": ("Server", "ServerGUI"), "client": ("Client", "ClientGUI")}
+
 
 class AppLauncher(tk.Tk):
     def __init__(self):
@@ -27,6 +27,7 @@ class AppLauncher(tk.Tk):
         self.geometry("500x400")
         self.minsize(450, 350)
         self.configure(bg=COLOR_BACKGROUND)
+        self.next_app = None
 
         self.setup_styles()
         self.create_widgets()
@@ -82,25 +83,37 @@ class AppLauncher(tk.Tk):
         client_btn = ttk.Button(main_frame, text="💻  Launch Client", style='Launcher.TButton', command=self.run_client)
         client_btn.pack(pady=10)
         
-    def run_app(self, script_name):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        script_path = os.path.join(current_dir, script_name)
-
+    def run_app(self, name):
+        self.next_app = name
         self.destroy()
-        try:
-            subprocess.run([sys.executable, script_path], check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(f"Failed to launch {script_path}: {e}")
-            app = AppLauncher()
-            app.mainloop()
-
 
     def run_server(self):
-        self.run_app("server.py")
+        self.run_app("server")
 
     def run_client(self):
-        self.run_app("client.py")
+        self.run_app("client")
+
+def load_app(name):
+    # Apps are imported only when chosen, so the launcher never pays for the other one.
+    if name == "launcher": return AppLauncher()
+    module_name, class_name = APPS[name]
+    return getattr(importlib.import_module(module_name), class_name)()
+
+def run_apps(name="launcher", app=None):
+    # Every window runs in this interpreter; one that sets next_app before closing hands over to it,
+    # which replaces starting a new Python process (and re-importing everything) for each switch.
+    while app is not None or name:
+        if app is None:
+            try: app = load_app(name)
+            except (ImportError, tk.TclError) as e:
+                print(f"Failed to launch {name}: {e}")
+                if name == "launcher": raise
+                name = "launcher"; continue
+        app.mainloop()
+        name = getattr(app, 'next_app', None)
+        try: app.destroy()
+        except tk.TclError: pass
+        app = None
 
 if __name__ == "__main__":
-    app = AppLauncher()
-    app.mainloop()
\ No newline at end of file
+    run_apps()
\ No newline at end of file
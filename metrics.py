@@ -0,0 +1,87 @@
+import bisect
+import threading
+
+METRICS_PREFIX = "file_server"
+LIST_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REJECT_REASONS = ("max_clients", "max_streams", "paused")
+
+def _labels(**labels):
+    if not labels: return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+def _value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    # Prometheus-style histogram: observe() is a bisect and two additions under a lock; buckets are made
+    # cumulative only when scraped.
+    def __init__(self, buckets):
+        self.buckets, self.lock = buckets, threading.Lock()
+        self.counts, self.sum = [0] * (len(buckets) + 1), 0.0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock: self.counts[index] += 1; self.sum += seconds
+
+    def samples(self, name):
+        with self.lock: counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(le=bound)} {cumulative}"
+        yield f"{name}_sum {_value(total)}"
+        yield f"{name}_count {cumulative}"
+
+class ServerMetrics:
+    # Event counters the file engines bump as they serve (one lock per file, listing or refused connection,
+    # never per chunk). Everything else is read from the server when scraped: bytes from the bandwidth
+    # scheduler, per-connection throughput from the telemetry counters, sessions, handshakes and threads.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files, self.auth_failures = 0, 0
+        self.rejections = dict.fromkeys(REJECT_REASONS, 0)
+        self.list_latency = Histogram(LIST_LATENCY_BUCKETS)
+
+    def served(self, count=1):
+        with self.lock: self.files += count
+
+    def rejected(self, reason):
+        with self.lock: self.rejections[reason] += 1
+
+    def auth_failed(self):
+        with self.lock: self.auth_failures += 1
+
+    def render(self, server):
+        # Prometheus text exposition format, version 0.0.4.
+        lines = []
+        def metric(name, kind, help_text, samples):
+            name = f"{METRICS_PREFIX}_{name}"
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"))
+            if kind == "histogram": lines.extend(samples.samples(name)); return
+            lines.extend(f"{name}{_labels(**labels)} {_value(value)}" for labels, value in samples)
+        with self.lock: files, auth_failures, rejections = self.files, self.auth_failures, dict(self.rejections)
+        clients = list(server.clients_info.items())
+        sent = server.scheduler.sent_bytes()
+        metric("up", "gauge", "1 while the server is running.", [({}, int(server.running))])
+        metric("paused", "gauge", "1 while transfers are paused.", [({}, int(server.is_paused))])
+        metric("sent_bytes_total", "counter", "Bytes granted by the bandwidth scheduler, per client IP (file sessions and the web share).",
+               [({'client': key}, value) for key, value in sorted(sent.items())])
+        metric("files_served_total", "counter", "Files sent to app clients, counting each file in a batch or archive.", [({}, files)])
+        metric("client_throughput_bytes_per_second", "gauge", "Smoothed send rate of each connection.",
+               [({'client': client_id}, round(info['progress'].rate, 1)) for client_id, info in clients if info.get('progress')])
+        metric("active_sessions", "gauge", "Client sessions; parallel streams count once.", [({}, server._session_count())])
+        metric("connections", "gauge", "Open file connections and channels.", [({}, len(clients))])
+        metric("chat_connections", "gauge", "Open chat connections.", [({}, len(server.chat_clients))])
+        metric("rejected_connections_total", "counter", "Connections turned away: at accept while paused, or on HELLO for max_clients or a session's max_streams.",
+               [({'reason': reason}, count) for reason, count in rejections.items()])
+        metric("auth_failures_total", "counter", "Logins with a wrong password.", [({}, auth_failures)])
+        metric("list_files_duration_seconds", "histogram", "Time to answer LIST_FILES, until the last page is sent.", self.list_latency)
+        with server.handshakes.lock: handshakes = dict(server.handshakes.counts)
+        metric("tls_handshakes_total", "counter", "TLS handshakes on the file and chat ports.", [({'kind': kind}, count) for kind, count in handshakes.items()])
+        if server.hash_cache: metric("hash_cache_lookups_total", "counter", "SHA-256 cache lookups.",
+                                     [({'result': "hit"}, server.hash_cache.hits), ({'result': "miss"}, server.hash_cache.misses)])
+        metric("threads", "gauge", "Python threads in the server process.", [({}, threading.active_count())])
+        if server.async_engine and (tasks := server.async_engine.task_count()) is not None:
+            metric("async_tasks", "gauge", "Tasks on the asyncio engine's event loop.", [({}, tasks)])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,166 @@
+import collections
+import json
+import socket
+import threading
+from protocol import FRAME_HEADER, MSG_DATA, MSG_OPEN, MSG_CLOSE, MSG_WINDOW, ProtocolError, pack_header, unpack_channel_header
+
+CONTROL_CHANNEL = 0
+KIND_STREAM = "stream"
+KIND_CHAT = "chat"
+MUX_CHUNK = 64 * 1024
+MUX_WINDOW = 8 * 1024 * 1024
+MAX_CHANNELS = 16
+
+class MuxChannel:
+    # One logical byte stream of a MuxConnection. It offers the socket calls FrameSocket, FileSender's
+    # buffered path and the chat loops use, so they run on a channel unchanged. The sender may have at
+    # most MUX_WINDOW bytes unread by this end; reading them hands the credit back. 'unacked' counts what
+    # arrived and was not credited back yet, and a peer that sends past it breaks the connection.
+    def __init__(self, mux, channel_id, urgent):
+        self.mux, self.id, self.urgent = mux, channel_id, urgent
+        self.cond = threading.Condition()
+        self.chunks, self.offset, self.consumed, self.unacked = collections.deque(), 0, 0, 0
+        self.credit, self.timeout = MUX_WINDOW, None
+        self.eof, self.closed = False, False
+
+    def getpeername(self):
+        host, port = self.mux.sock.getpeername()[:2]
+        return host, f"{port}/{self.id}"
+
+    def settimeout(self, timeout): self.timeout = timeout
+
+    def sendall(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.credit > 0 or self.closed, self.timeout): raise socket.timeout("timed out")
+                if self.closed: raise BrokenPipeError("Channel is closed")
+                n = min(len(view), MUX_CHUNK, self.credit)
+                self.credit -= n
+            self.mux.send_frame(MSG_DATA, self.id, view[:n], self.urgent)
+            view = view[n:]
+
+    def recv_into(self, buffer, nbytes=0):
+        view = memoryview(buffer).cast('B')
+        nbytes, n = nbytes or len(view), 0
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.chunks or self.eof, self.timeout): raise socket.timeout("timed out")
+            while self.chunks and n < nbytes:
+                chunk = self.chunks[0]
+                take = min(len(chunk) - self.offset, nbytes - n)
+                view[n:n + take] = chunk[self.offset:self.offset + take]
+                n += take; self.offset += take
+                if self.offset == len(chunk): self.chunks.popleft(); self.offset = 0
+            self.consumed += n
+            grant = self.consumed if self.consumed >= MUX_WINDOW // 2 and not self.eof else 0
+            if grant: self.consumed = 0; self.unacked -= grant
+        if grant: self.mux.send_frame(MSG_WINDOW, self.id, json.dumps({'bytes': grant}).encode('utf-8'), True)
+        return n
+
+    def recv(self, bufsize):
+        buffer = bytearray(bufsize)
+        return bytes(buffer[:self.recv_into(buffer)])
+
+    def close(self):
+        self.mux.close_channel(self)
+
+    def _feed(self, data):
+        with self.cond:
+            self.unacked += len(data)
+            if self.unacked > MUX_WINDOW: raise ProtocolError(f"Channel {self.id} has {self.unacked} unacknowledged bytes, more than its {MUX_WINDOW}-byte window")
+            self.chunks.append(data); self.cond.notify_all()
+
+    def _grant(self, nbytes):
+        with self.cond: self.credit += nbytes; self.cond.notify_all()
+
+    def _end(self):
+        with self.cond: self.eof, self.closed = True, True; self.cond.notify_all()
+
+class MuxConnection:
+    # Several channels over one TLS connection, tagged with the frame header's channel field. Channel 0 is
+    # the control channel and exists from the start; the client opens the rest (parallel streams, chat)
+    # with MSG_OPEN and the server passes each to on_open on its own thread. Writers take the socket one
+    # MUX_CHUNK at a time, control and chat channels ahead of streams and each class in arrival order,
+    # so a chat line or a listing waits for at most one chunk of a running bulk transfer.
+    def __init__(self, sock, on_open=None):
+        self.sock, self.on_open = sock, on_open
+        self.channels, self.lock, self.next_id, self.closed = {}, threading.Lock(), 1, False
+        self.write_cond, self.writing = threading.Condition(), False
+        self.waiting = {True: collections.deque(), False: collections.deque()}
+        self.control = self._add(CONTROL_CHANNEL, True)
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _add(self, channel_id, urgent):
+        channel = MuxChannel(self, channel_id, urgent)
+        with self.lock: self.channels[channel_id] = channel
+        return channel
+
+    def open_channel(self, kind):
+        with self.lock: channel_id, self.next_id = self.next_id, self.next_id + 1
+        channel = self._add(channel_id, kind != KIND_STREAM)
+        self.send_frame(MSG_OPEN, channel_id, json.dumps({'kind': kind}).encode('utf-8'), True)
+        return channel
+
+    def close_channel(self, channel):
+        with self.lock: known = self.channels.pop(channel.id, None) is not None
+        channel._end()
+        if channel.id == CONTROL_CHANNEL: self.close(); return
+        if known and not self.closed:
+            try: self.send_frame(MSG_CLOSE, channel.id, b"", True)
+            except OSError: pass
+
+    def send_frame(self, msg_type, channel_id, payload, urgent):
+        turn, queue = object(), self.waiting[urgent]
+        with self.write_cond:
+            queue.append(turn)
+            self.write_cond.wait_for(lambda: not self.writing and queue[0] is turn and (urgent or not self.waiting[True]))
+            queue.popleft(); self.writing = True
+        try:
+            if self.closed: raise BrokenPipeError("Connection is closed")
+            self.sock.sendall(pack_header(msg_type, len(payload), channel_id) + payload)
+        finally:
+            with self.write_cond: self.writing = False; self.write_cond.notify_all()
+
+    def _recv_exact(self, view):
+        while view:
+            n = self.sock.recv_into(view)
+            if not n: return False
+            view = view[n:]
+        return True
+
+    def _read_loop(self):
+        header = bytearray(FRAME_HEADER.size)
+        try:
+            while self._recv_exact(memoryview(header)):
+                msg_type, channel_id, length = unpack_channel_header(header)
+                payload = bytearray(length)
+                if not self._recv_exact(memoryview(payload)): break
+                with self.lock: channel = self.channels.get(channel_id)
+                if msg_type == MSG_DATA and channel: channel._feed(payload)
+                elif msg_type == MSG_WINDOW and channel: channel._grant(int(json.loads(payload)['bytes']))
+                elif msg_type == MSG_CLOSE and channel:
+                    with self.lock: self.channels.pop(channel_id, None)
+                    channel._end()
+                elif msg_type == MSG_OPEN: self._accept(channel_id, json.loads(payload).get('kind'))
+        except (OSError, ValueError): pass
+        finally:
+            # Only this thread closes the socket, once no writer is inside sendall: closing it under a blocked
+            # read would free the descriptor while OpenSSL still reads from it, and a new connection could reuse it.
+            self.close()
+            with self.write_cond: self.write_cond.wait_for(lambda: not self.writing)
+            self.sock.close()
+
+    def _accept(self, channel_id, kind):
+        with self.lock: refused = self.on_open is None or channel_id in self.channels or len(self.channels) >= MAX_CHANNELS
+        if refused: self.send_frame(MSG_CLOSE, channel_id, b"", True); return
+        channel = self._add(channel_id, kind != KIND_STREAM)
+        threading.Thread(target=self.on_open, args=(channel, kind), daemon=True).start()
+
+    def close(self):
+        with self.lock:
+            if self.closed: return
+            self.closed, channels = True, list(self.channels.values())
+            self.channels.clear()
+        for channel in channels: channel._end()
+        try: self.sock.shutdown(socket.SHUT_RDWR) # Wakes the reader, which closes the socket.
+        except OSError: pass
@@ -0,0 +1,131 @@
+import json
+import struct
+
+# Every frame: version (u8), message type (u8), channel (u16), payload length (u32), then the payload.
+PROTOCOL_VERSION = 1
+FRAME_HEADER = struct.Struct('!BBHI')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_BUFFER_SIZE = 1024 * 1024
+
+MSG_COMMAND = 1
+MSG_LISTING = 2
+MSG_FILE_HEADER = 3
+MSG_DATA = 4
+MSG_ACK = 5
+MSG_ERROR = 6
+MSG_END = 7
+MSG_COPY = 8
+# Multiplexed connections only: open, close and flow-control credit for the channel in the header.
+MSG_OPEN = 9
+MSG_CLOSE = 10
+MSG_WINDOW = 11
+# Several small files in one frame: their bytes back to back (compressed as one block if the index names a codec),
+# a JSON index {'codec', 'files': [[name, size, sha256], ...]}, and the index length.
+MSG_BATCH = 12
+BATCH_TRAILER = struct.Struct('!I')
+# Follows the last DATA frame of a file whose header announced 'trailer': {'sha256'} of the bytes as they were sent.
+MSG_DIGEST = 13
+
+MESSAGE_NAMES = {MSG_COMMAND: "command", MSG_LISTING: "listing", MSG_FILE_HEADER: "file header", MSG_DATA: "data",
+                 MSG_ACK: "ack", MSG_ERROR: "error", MSG_END: "end", MSG_COPY: "copy",
+                 MSG_OPEN: "open", MSG_CLOSE: "close", MSG_WINDOW: "window", MSG_BATCH: "batch", MSG_DIGEST: "digest"}
+
+# Capabilities exchanged in the plain-text HELLO/HELLO_OK handshake that follows authentication.
+CMD_HELLO = "HELLO:"
+REPLY_HELLO_OK = "HELLO_OK:"
+REPLY_SERVER_FULL = "SERVER_FULL:"
+CAP_PIPELINE = "pipeline"
+CAP_FRAMES = "frames"
+CAP_PARALLEL = "parallel"
+CAP_COMPRESS = "compress"
+CAP_DELTA = "delta"
+CAP_MUX = "mux"
+CAP_ARCHIVE = "archive"
+CAP_BATCH = "batch"
+CAP_DIGEST = "digest"
+
+# Plain-text commands and acknowledgements of the unframed protocol.
+CMD_LIST_FILES = "LIST_FILES"
+CMD_DOWNLOAD_FILES = "DOWNLOAD_FILES"
+CMD_STAT_FILES = "STAT_FILES"
+CMD_SYNC_FILE = "SYNC_FILE"
+CMD_ARCHIVE = "ARCHIVE"
+PREFIX_ACK = "ACK:"
+PREFIX_ACK_FINAL = "ACK_FINAL:"
+
+# Paged listings (framed LIST_FILES with 'page_size') send each entry as a list in this field order.
+LISTING_FIELDS = ("name", "size", "mtime", "type")
+ENTRY_FILE = "file"
+ENTRY_DIR = "dir"
+
+class ProtocolError(ConnectionError):
+    pass
+
+def pack_header(msg_type, length, channel=0):
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, msg_type, channel, length)
+
+def unpack_header(header):
+    msg_type, _, length = unpack_channel_header(header)
+    return msg_type, length
+
+def unpack_channel_header(header):
+    version, msg_type, channel, length = FRAME_HEADER.unpack(header)
+    if version != PROTOCOL_VERSION: raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_FRAME_SIZE: raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+    return msg_type, channel, length
+
+def decode_message(msg_type, payload, expected=()):
+    if msg_type == MSG_ERROR and MSG_ERROR not in expected: raise ProtocolError(json.loads(bytes(payload)).get('message', "Remote error"))
+    if expected and msg_type not in expected:
+        raise ProtocolError(f"Expected {'/'.join(MESSAGE_NAMES.get(t, str(t)) for t in expected)}, got {MESSAGE_NAMES.get(msg_type, msg_type)}")
+    if msg_type in (MSG_DATA, MSG_BATCH): return payload
+    return json.loads(bytes(payload)) if payload else {}
+
+def pack_batch_index(files, codec=None):
+    data = json.dumps({'codec': codec, 'files': files}).encode('utf-8')
+    return data + BATCH_TRAILER.pack(len(data))
+
+def split_batch(payload):
+    # Returns the index of a MSG_BATCH payload and a view of the (possibly compressed) file bytes it describes.
+    if len(payload) < BATCH_TRAILER.size: raise ProtocolError("Truncated batch frame")
+    (length,) = BATCH_TRAILER.unpack_from(payload, len(payload) - BATCH_TRAILER.size)
+    end = len(payload) - BATCH_TRAILER.size - length
+    if end < 0: raise ProtocolError("Truncated batch frame")
+    return json.loads(bytes(payload[end:end + length])), memoryview(payload)[:end]
+
+class FrameSocket:
+    def __init__(self, sock, buffer_size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self._header = bytearray(FRAME_HEADER.size)
+        self._buffer = bytearray(buffer_size)
+
+    def _recv_exact(self, view):
+        while view:
+            n = self.sock.recv_into(view)
+            if not n: raise ConnectionResetError("Socket connection broken")
+            view = view[n:]
+
+    def read_frame(self, eof_ok=False):
+        # The returned payload is a view into a reused buffer and is only valid until the next read.
+        header = memoryview(self._header)
+        n = self.sock.recv_into(header)
+        if not n:
+            if eof_ok: return None, None
+            raise ConnectionResetError("Socket connection broken")
+        self._recv_exact(header[n:])
+        msg_type, length = unpack_header(self._header)
+        if length > len(self._buffer): self._buffer = bytearray(length)
+        payload = memoryview(self._buffer)[:length]
+        self._recv_exact(payload)
+        return msg_type, payload
+
+    def read_message(self, *expected, eof_ok=False):
+        msg_type, payload = self.read_frame(eof_ok)
+        if msg_type is None: return None, None
+        return msg_type, decode_message(msg_type, payload, expected)
+
+    def send_frame(self, msg_type, payload=b""):
+        self.sock.sendall(pack_header(msg_type, len(payload)) + payload)
+
+    def send_message(self, msg_type, obj):
+        self.send_frame(msg_type, json.dumps(obj).encode('utf-8'))
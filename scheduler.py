@@ -0,0 +1,92 @@
+import math
+import threading
+import time
+
+ACTIVE_WINDOW = 1.0
+BURST_SECONDS = 0.25
+
+class BandwidthScheduler:
+    # Token buckets shared by every file session, keyed by client IP so parallel streams share one budget.
+    # The global rate is split between clients that sent in the last ACTIVE_WINDOW seconds in proportion
+    # to their weights; a client capped below its share hands the rest to the others. A sender may spend
+    # one window into debt and then waits until its bucket has refilled. Rates are bytes per second and
+    # 0 means unlimited. Pausing blocks every sender until resume() instead of polling a flag.
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.limits, self.weights = {}, {}
+        self.paused, self.closed = False, False
+        self._buckets = {} # key -> [tokens, last refill, last active]
+        self._sent = {} # key -> bytes granted since the server process started
+        self._cond = threading.Condition()
+        self._listeners = []
+
+    def subscribe(self, callback): self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners: self._listeners.remove(callback)
+
+    def _changed(self):
+        self._cond.notify_all()
+        for callback in list(self._listeners): callback()
+
+    def set_rate(self, rate):
+        with self._cond: self.rate = max(0, rate or 0); self._changed()
+
+    def set_client(self, key, limit=0, weight=1.0):
+        if weight <= 0: raise ValueError("Weight must be positive.")
+        with self._cond:
+            self.limits[key], self.weights[key] = max(0, limit or 0), weight
+            self._changed()
+
+    def pause(self):
+        with self._cond: self.paused = True; self._changed()
+
+    def resume(self):
+        with self._cond: self.paused = False; self._changed()
+
+    def open(self):
+        with self._cond: self.paused, self.closed = False, False; self._buckets.clear()
+
+    def close(self):
+        # Releases every waiting sender; used when the server stops.
+        with self._cond: self.closed = True; self._changed()
+
+    def sent_bytes(self):
+        with self._cond: return dict(self._sent)
+
+    def rates(self, now=None):
+        now = time.monotonic() if now is None else now
+        active = [key for key, bucket in self._buckets.items() if now - bucket[2] < ACTIVE_WINDOW]
+        if not self.rate: return {key: self.limits.get(key) or math.inf for key in active}
+        rates, pool = {}, self.rate
+        while active:
+            total = sum(self.weights.get(key, 1.0) for key in active)
+            capped = [key for key in active if self.limits.get(key) and self.limits[key] < pool * self.weights.get(key, 1.0) / total]
+            if not capped:
+                rates.update((key, pool * self.weights.get(key, 1.0) / total) for key in active)
+                break
+            for key in capped: rates[key] = self.limits[key]; pool -= self.limits[key]
+            active = [key for key in active if key not in capped]
+        return rates
+
+    def try_acquire(self, key, nbytes):
+        # 0 when nbytes may be sent now, otherwise the seconds to wait (math.inf while paused) before asking again.
+        with self._cond:
+            if self.closed: return 0.0
+            if self.paused: return math.inf
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(key, [0.0, now, now])
+            bucket[2] = now
+            rate = self.rates(now).get(key, math.inf)
+            if rate == math.inf: bucket[0], bucket[1] = 0.0, now
+            else:
+                bucket[0], bucket[1] = min(bucket[0] + (now - bucket[1]) * rate, rate * BURST_SECONDS), now
+                if bucket[0] < 0: return -bucket[0] / rate
+                bucket[0] -= nbytes
+            self._sent[key] = self._sent.get(key, 0) + nbytes # Counted here since every sender passes through, already under the lock.
+            return 0.0
+
+    def acquire(self, key, nbytes):
+        # Blocking form for threaded senders; limit changes and resume() wake it early.
+        with self._cond:
+            while delay := self.try_acquire(key, nbytes): self._cond.wait(None if delay == math.inf else delay)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+PUBLISH_INTERVAL = 0.1
+RATE_SMOOTHING = 0.3
+
+def format_rate(bytes_per_second):
+    if not bytes_per_second: return "-"
+    return f"{bytes_per_second / 1e6:.1f} MB/s" if bytes_per_second >= 1e5 else f"{bytes_per_second / 1e3:.0f} KB/s"
+
+def format_eta(seconds):
+    if seconds is None: return "-"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes}:{seconds:02d}"
+
+class TransferCounter:
+    # Progress of one transfer. Only the thread moving the bytes writes it and the publisher only reads
+    # it, so the hot path is a couple of attribute updates with no lock and no GUI call. Counters of
+    # parallel streams are attached as parts and summed into their parent when reported.
+    def __init__(self, key, label=""):
+        self.key, self.label = key, label
+        self.parts = []
+        self.reset()
+
+    def reset(self, total=None):
+        self.done, self.total = 0, total
+        self.file, self.file_size, self.file_done = None, 0, 0
+        self.rate, self._last_done, self._last_time, self._last_file = 0.0, 0, time.monotonic(), None
+
+    def begin_file(self, name, size, offset=0):
+        self.file, self.file_size, self.file_done = name, size, offset
+
+    def update(self, file_done):
+        # Takes the running byte count of the current file, as FileSender.send_range reports it.
+        self.done += file_done - self.file_done
+        self.file_done = file_done
+
+    def add(self, nbytes):
+        self.done += nbytes
+
+    def finish(self):
+        self.file = None
+
+    def total_done(self):
+        return self.done + sum(part.done for part in list(self.parts))
+
+class Telemetry:
+    # Publishes every tracked counter at a fixed rate (10 Hz by default) through publish(reports), so
+    # a transfer costs one GUI update per tick however many chunks it moves. Counters that stayed idle
+    # since the last tick are left out. Headless callers can pass any callable, or poll report().
+    def __init__(self, publish=None, interval=PUBLISH_INTERVAL):
+        self.publish, self.interval = publish, interval
+        self.counters = {}
+        self._stop, self._thread = threading.Event(), None
+
+    def counter(self, key, label=""):
+        return self.track(TransferCounter(key, label))
+
+    def track(self, counter):
+        self.counters[counter.key] = counter
+        return counter
+
+    def remove(self, key):
+        self.counters.pop(key, None)
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            reports = self.report()
+            if reports and self.publish: self.publish(reports)
+
+    def report(self):
+        reports, now = [], time.monotonic()
+        for counter in list(self.counters.values()):
+            done, file = counter.total_done(), counter.file
+            delta, elapsed = max(0, done - counter._last_done), max(now - counter._last_time, 1e-6)
+            if not delta and not counter.rate and file == counter._last_file: continue
+            counter.rate += RATE_SMOOTHING * (delta / elapsed - counter.rate)
+            if counter.rate < 1.0 or not delta and file is None: counter.rate = 0.0
+            counter._last_done, counter._last_time, counter._last_file = done, now, file
+            total, file_percent = counter.total, int(counter.file_done * 100 / counter.file_size) if counter.file_size else 100
+            remaining = total - done if total else counter.file_size - counter.file_done if file else 0
+            reports.append({'key': counter.key, 'label': counter.label, 'file': file, 'done': done, 'total': total,
+                            'percent': int(done * 100 / total) if total else file_percent, 'file_percent': file_percent,
+                            'rate': counter.rate, 'eta': remaining / counter.rate if counter.rate and remaining > 0 else None})
+        return reports
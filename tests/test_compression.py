@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import compression
+from compression import CODEC_ZLIB, CODEC_ZSTD, Compressor, Decompressor, decompressor
+from protocol import ProtocolError
+
+class CompressionTest(unittest.TestCase):
+    def round_trip(self, codec):
+        # Each window is decoded on its own, the way the client decodes frames as they arrive.
+        windows = [b"abc" * 50_000, os.urandom(10_000), b"", bytes(200_000)]
+        compressor, decoder = Compressor(codec), Decompressor(codec)
+        for window in windows: self.assertEqual(decoder.decompress(compressor.compress(window), len(window)), window)
+        self.assertEqual(compressor.input_bytes, sum(map(len, windows)))
+
+    def bomb(self, codec):
+        compressor, decoder = Compressor(codec), Decompressor(codec)
+        frame = compressor.compress(bytes(10_000_000))
+        self.assertLess(len(frame), 100_000)
+        with self.assertRaises(ProtocolError): decoder.decompress(frame, 1_000_000)
+
+    def test_zlib(self):
+        self.round_trip(CODEC_ZLIB)
+
+    def test_zlib_limit(self):
+        self.bomb(CODEC_ZLIB)
+        compressor, decoder = Compressor(CODEC_ZLIB), Decompressor(CODEC_ZLIB)
+        self.assertEqual(decoder.decompress(compressor.compress(b"x" * 1000), 1000), b"x" * 1000) # Exactly the limit is fine.
+        with self.assertRaises(ProtocolError): Decompressor(CODEC_ZLIB).decompress(Compressor(CODEC_ZLIB).compress(b"x" * 1000), 999)
+
+    @unittest.skipUnless(compression.zstandard, "zstandard is not installed")
+    def test_zstd(self):
+        self.round_trip(CODEC_ZSTD)
+        self.bomb(CODEC_ZSTD)
+
+    def test_decompressor(self):
+        self.assertIsNone(decompressor(None))
+        self.assertIsInstance(decompressor(CODEC_ZLIB), Decompressor)
+        with self.assertRaises(ValueError): decompressor("lzma")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from delta import MIN_BLOCK_SIZE, DeltaEncoder, DeltaPatcher, block_size_for, file_signature
+from protocol import ProtocolError
+
+class Sink:
+    def __init__(self): self.data = bytearray()
+    def write(self, data): self.data += data
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(); self.addCleanup(self.folder.cleanup)
+        self.random = random.Random(7)
+        self.base = self.random.randbytes(300_000)
+
+    def sync(self, basis, new):
+        # Runs the encoder against the basis signature and rebuilds 'new' from the basis with its output.
+        basis_path, new_path = os.path.join(self.folder.name, "basis"), os.path.join(self.folder.name, "new")
+        with open(basis_path, 'wb') as f: f.write(basis)
+        with open(new_path, 'wb') as f: f.write(new)
+        signature = file_signature(basis_path)
+        encoder, sink = DeltaEncoder(new_path, signature), Sink()
+        with DeltaPatcher(basis_path, signature['block_size'], sink) as patcher:
+            for op in encoder.ops():
+                if isinstance(op, tuple): patcher.copy(*op)
+                else: patcher.write(op)
+        self.assertEqual(bytes(sink.data), new)
+        self.assertEqual(patcher.digest.hexdigest(), hashlib.sha256(new).hexdigest())
+        self.assertEqual(encoder.sha256, hashlib.sha256(new).hexdigest())
+        self.assertEqual(encoder.literal_bytes + encoder.matched_bytes, len(new))
+        return encoder
+
+    def test_identical(self):
+        self.assertEqual(self.sync(self.base, self.base).literal_bytes, 0)
+
+    def test_edits(self):
+        changed = bytearray(self.base); changed[100_000:100_010] = b"0123456789"
+        block = block_size_for(len(self.base))
+        self.assertLessEqual(self.sync(self.base, bytes(changed)).literal_bytes, 2 * block)
+        self.assertLessEqual(self.sync(self.base, self.base[:50_001] + b"xyz" + self.base[50_001:]).literal_bytes, 2 * block + 3) # Shifted blocks are found by rolling.
+        self.assertLessEqual(self.sync(self.base, self.base[:50_001] + self.base[50_017:]).literal_bytes, 2 * block)
+        self.assertLessEqual(self.sync(self.base, self.base + b"tail").literal_bytes, block + 4)
+        self.assertEqual(self.sync(self.base, self.base[:200_000]).literal_bytes, 200_000 % block)
+
+    def test_edge_cases(self):
+        self.sync(self.base, self.random.randbytes(300_000))
+        self.sync(self.base, b"")
+        self.sync(b"", self.base[:10_000])
+        self.sync(b"abc", b"abd")
+        zeros = bytes(5 * MIN_BLOCK_SIZE)
+        self.sync(zeros, zeros + b"1" + zeros)
+
+    def test_copy_outside_basis(self):
+        path = os.path.join(self.folder.name, "basis")
+        with open(path, 'wb') as f: f.write(bytes(MIN_BLOCK_SIZE))
+        with DeltaPatcher(path, MIN_BLOCK_SIZE, Sink()) as patcher:
+            for index, count in ((1, 1), (-1, 1), (0, 0)):
+                with self.assertRaises(ProtocolError): patcher.copy(index, count)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_server import FileServer, ServerObserver
+
+class Observer(ServerObserver):
+    def __init__(self): self.events = []
+    def log_event(self, category, ip="-", details=""): self.events.append((category, details))
+
+class ResolveRequestedFileTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory(); self.addCleanup(folder.cleanup)
+        self.share, secret = os.path.join(folder.name, "share"), os.path.join(folder.name, "share-secret")
+        os.makedirs(os.path.join(self.share, "sub")); os.makedirs(secret)
+        for path in (os.path.join(self.share, "a.txt"), os.path.join(self.share, "sub", "b.txt"), os.path.join(secret, "x")):
+            with open(path, 'w') as f: f.write("data")
+        self.observer = Observer()
+        self.server = FileServer(self.observer)
+        self.server.shared_path, self.server.share_mode = self.share, 'directory'
+
+    def resolve(self, name): return self.server._resolve_requested_file("127.0.0.1", name)
+
+    def test_files_inside_the_share(self):
+        self.assertEqual(self.resolve("a.txt"), (os.path.join(self.share, "a.txt"), "a.txt"))
+        self.assertEqual(self.resolve(os.path.join("sub", "b.txt"))[0], os.path.join(self.share, "sub", "b.txt"))
+        self.assertEqual(self.resolve(os.path.join("sub", "..", "a.txt"))[0], os.path.join(self.share, "a.txt"))
+        self.assertIsNone(self.resolve("missing.txt"))
+        self.assertIsNone(self.resolve("sub"))
+
+    def test_traversal(self):
+        # "../share-secret/x" passed the old string-prefix check because "share-secret" starts with "share".
+        for name in (os.path.join("..", "share-secret", "x"), os.path.join("sub", "..", "..", "share-secret", "x"), os.path.abspath(__file__)):
+            self.assertIsNone(self.resolve(name), name)
+        self.assertEqual([category for category, _ in self.observer.events], ["Security Alert"] * 3)
+
+    @unittest.skipUnless(hasattr(os, "symlink") and os.name != 'nt', "needs symlinks")
+    def test_symlink_out_of_the_share(self):
+        os.symlink(os.path.join(os.path.dirname(self.share), "share-secret", "x"), os.path.join(self.share, "link"))
+        self.assertIsNone(self.resolve("link"))
+
+    def test_single_file_share(self):
+        self.server.shared_path, self.server.share_mode = os.path.join(self.share, "a.txt"), 'file'
+        for name in (os.path.join("..", "share-secret", "x"), os.path.join("..", "sub", "b.txt")):
+            self.assertIsNone(self.resolve(name), name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compression import CODEC_ZLIB, Decompressor
+from protocol import (FRAME_HEADER, MAX_FRAME_SIZE, MSG_BATCH, MSG_COMMAND, MSG_DATA, MSG_END, MSG_ERROR, PROTOCOL_VERSION, FrameSocket,
+                      ProtocolError, pack_batch_index, pack_header, split_batch, unpack_channel_header, unpack_header)
+from transfer import FileBatch
+
+class HeaderTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(unpack_header(pack_header(MSG_DATA, 1234)), (MSG_DATA, 1234))
+        self.assertEqual(unpack_channel_header(pack_header(MSG_END, 0, 7)), (MSG_END, 7, 0))
+        self.assertEqual(unpack_header(pack_header(MSG_DATA, MAX_FRAME_SIZE)), (MSG_DATA, MAX_FRAME_SIZE))
+
+    def test_rejects_oversized_frame(self):
+        with self.assertRaises(ProtocolError): unpack_header(FRAME_HEADER.pack(PROTOCOL_VERSION, MSG_DATA, 0, MAX_FRAME_SIZE + 1))
+
+    def test_rejects_other_version(self):
+        with self.assertRaises(ProtocolError): unpack_header(FRAME_HEADER.pack(PROTOCOL_VERSION + 1, MSG_DATA, 0, 0))
+
+class FrameSocketTest(unittest.TestCase):
+    def setUp(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close); self.addCleanup(b.close)
+        self.sender, self.receiver = FrameSocket(a), FrameSocket(b, buffer_size=16)
+
+    def test_messages_and_data(self):
+        self.sender.send_message(MSG_COMMAND, {'cmd': "LIST_FILES", 'path': "ä/b"})
+        self.sender.send_frame(MSG_DATA, b"x" * 100) # Larger than the receive buffer, which has to grow.
+        self.sender.send_frame(MSG_END)
+        self.assertEqual(self.receiver.read_message(MSG_COMMAND), (MSG_COMMAND, {'cmd': "LIST_FILES", 'path': "ä/b"}))
+        msg_type, payload = self.receiver.read_message(MSG_DATA)
+        self.assertEqual((msg_type, bytes(payload)), (MSG_DATA, b"x" * 100))
+        self.assertEqual(self.receiver.read_message(MSG_END), (MSG_END, {}))
+
+    def test_unexpected_type_and_remote_error(self):
+        self.sender.send_frame(MSG_DATA, b"data")
+        self.sender.send_message(MSG_ERROR, {'message': "No such file"})
+        with self.assertRaisesRegex(ProtocolError, "Expected"): self.receiver.read_message(MSG_END)
+        with self.assertRaisesRegex(ProtocolError, "No such file"): self.receiver.read_message(MSG_DATA)
+
+    def test_eof(self):
+        self.sender.sock.close()
+        self.assertEqual(self.receiver.read_message(eof_ok=True), (None, None))
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory(); self.addCleanup(self.folder.cleanup)
+        self.files = {'a.txt': b"hello " * 1000, 'empty': b"", 'sub/b.bin': os.urandom(3000)}
+        for name, data in self.files.items():
+            os.makedirs(os.path.dirname(os.path.join(self.folder.name, name)), exist_ok=True)
+            with open(os.path.join(self.folder.name, name), 'wb') as f: f.write(data)
+
+    def take(self, codec):
+        batch = FileBatch(codec=codec)
+        for name, data in self.files.items(): batch.add(os.path.join(self.folder.name, name), name, len(data))
+        frame, count = batch.take()
+        self.assertEqual((count, batch.index, batch.size), (len(self.files), [], 0))
+        msg_type, length = unpack_header(frame[:FRAME_HEADER.size])
+        self.assertEqual((msg_type, length), (MSG_BATCH, len(frame) - FRAME_HEADER.size))
+        return split_batch(frame[FRAME_HEADER.size:])
+
+    def unpack(self, index, data):
+        if index['codec']: data = Decompressor(index['codec']).decompress(data, sum(length for _, length, _ in index['files']))
+        files, offset = {}, 0
+        for name, length, _ in index['files']: files[name] = bytes(data[offset:offset + length]); offset += length
+        return files
+
+    def test_round_trip(self):
+        index, data = self.take(None)
+        self.assertIsNone(index['codec'])
+        self.assertEqual(self.unpack(index, data), self.files)
+
+    def test_round_trip_compressed(self):
+        index, data = self.take(CODEC_ZLIB)
+        self.assertEqual(index['codec'], CODEC_ZLIB)
+        self.assertEqual(self.unpack(index, data), self.files)
+
+    def test_truncated(self):
+        with self.assertRaises(ProtocolError): split_batch(b"abc") # Shorter than the trailer.
+        with self.assertRaises(ProtocolError): split_batch(pack_batch_index([["a", 4, ""]])[1:]) # Index longer than the frame.
+
+if __name__ == "__main__":
+    unittest.main()
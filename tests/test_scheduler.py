@@ -0,0 +1,50 @@
+import math
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import ACTIVE_WINDOW, BandwidthScheduler
+
+class SchedulerTest(unittest.TestCase):
+    def active(self, scheduler, *keys):
+        for key in keys: scheduler.try_acquire(key, 1)
+
+    def test_unlimited(self):
+        scheduler = BandwidthScheduler()
+        scheduler.set_client("a", 1000)
+        self.active(scheduler, "a", "b")
+        self.assertEqual(scheduler.rates(), {'a': 1000, 'b': math.inf})
+        self.assertEqual(scheduler.try_acquire("b", 10**9), 0)
+
+    def test_weighted_shares(self):
+        scheduler = BandwidthScheduler(3000)
+        scheduler.set_client("a", weight=2.0)
+        self.active(scheduler, "a", "b")
+        self.assertEqual(scheduler.rates(), {'a': 2000, 'b': 1000})
+
+    def test_capped_client_hands_back_its_share(self):
+        scheduler = BandwidthScheduler(3000)
+        scheduler.set_client("a", 500)
+        self.active(scheduler, "a", "b", "c")
+        self.assertEqual(scheduler.rates(), {'a': 500, 'b': 1250, 'c': 1250})
+
+    def test_idle_clients_drop_out(self):
+        scheduler = BandwidthScheduler(3000)
+        self.active(scheduler, "a", "b")
+        self.assertEqual(scheduler.rates(), {'a': 1500, 'b': 1500})
+        self.assertEqual(scheduler.rates(time.monotonic() + ACTIVE_WINDOW + 0.1), {})
+
+    def test_debt_and_pause(self):
+        scheduler = BandwidthScheduler(1000)
+        self.assertEqual(scheduler.try_acquire("a", 500), 0) # One window may go into debt...
+        self.assertGreater(scheduler.try_acquire("a", 500), 0.4) # ...and then the bucket has to refill.
+        scheduler.pause()
+        self.assertEqual(scheduler.try_acquire("b", 1), math.inf)
+        scheduler.close()
+        self.assertEqual(scheduler.try_acquire("b", 1), 0)
+        self.assertEqual(scheduler.sent_bytes(), {'a': 500})
+
+if __name__ == "__main__":
+    unittest.main()
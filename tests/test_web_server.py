@@ -0,0 +1,59 @@
+import gzip
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import web_server
+from web_server import EncodedBodyCache, choose_encoding, parse_range
+
+class ParseRangeTest(unittest.TestCase):
+    def test_satisfiable(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=500-", 1000), (500, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-5000", 1000), (0, 999)) # Suffix longer than the file: the whole file.
+        self.assertEqual(parse_range("bytes=990-5000", 1000), (990, 999))
+        self.assertEqual(parse_range("bytes=999-999", 1000), (999, 999))
+
+    def test_ignored(self):
+        # Missing, malformed and multi-range headers fall back to the whole file.
+        for header in (None, "", "items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=-", "bytes=10-5", "bytes=-1-5"):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        for header, size in (("bytes=1000-", 1000), ("bytes=1000-2000", 1000), ("bytes=-0", 1000), ("bytes=-10", 0), ("bytes=0-", 0)):
+            with self.assertRaises(ValueError, msg=header): parse_range(header, size)
+
+class ChooseEncodingTest(unittest.TestCase):
+    def test_gzip(self):
+        self.assertEqual(choose_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(choose_encoding("GZIP;q=0.5"), "gzip")
+        self.assertEqual(choose_encoding("*"), web_server.brotli and "br" or "gzip")
+
+    def test_identity(self):
+        for header in (None, "", "identity", "deflate", "gzip;q=0", "gzip;q=0, br;q=0", "*;q=0", "gzip;q=x"):
+            self.assertIsNone(choose_encoding(header), header)
+
+    @unittest.skipUnless(web_server.brotli, "brotli is not installed")
+    def test_prefers_brotli(self):
+        self.assertEqual(choose_encoding("gzip, br"), "br")
+        self.assertEqual(choose_encoding("br;q=0, gzip"), "gzip")
+
+class EncodedBodyCacheTest(unittest.TestCase):
+    def test_encodes_once_per_etag(self):
+        cache = EncodedBodyCache()
+        body = cache.get("/a.txt", '"1-1-gzip"', io.BytesIO(b"hello " * 100), "gzip")
+        self.assertEqual(gzip.decompress(body), b"hello " * 100)
+        self.assertIs(cache.get("/a.txt", '"1-1-gzip"', io.BytesIO(b"unused"), "gzip"), body)
+        self.assertEqual(gzip.decompress(cache.get("/a.txt", '"1-2-gzip"', io.BytesIO(b"changed"), "gzip")), b"changed")
+
+    def test_byte_limit(self):
+        cache = EncodedBodyCache(capacity=100)
+        for etag in "abc": cache.get("/f", etag, io.BytesIO(os.urandom(40)), "gzip") # About 60 bytes each once gzipped.
+        self.assertEqual(list(cache.bodies), [("/f", "c")])
+        self.assertEqual(cache.size, len(cache.bodies["/f", "c"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import socket
+import ssl
+import threading
+import time
+
+SESSION_TICKETS = 4
+HANDSHAKE_TIMEOUT = 10.0
+
+def enable_session_tickets(context):
+    # Stateless tickets let a client resume on any of the server's ports (file, chat, web share one context).
+    context.options &= ~ssl.OP_NO_TICKET
+    if hasattr(context, 'num_tickets'): context.num_tickets = SESSION_TICKETS
+    return context
+
+def describe(tls_sock):
+    return f"{tls_sock.version()}, {'resumed' if tls_sock.session_reused else 'full'}"
+
+class HandshakeStats:
+    # Server-side handshake counts and time, split into full and resumed handshakes.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'full': 0, 'resumed': 0, 'failed': 0}
+        self.seconds = {'full': 0.0, 'resumed': 0.0}
+
+    def record(self, seconds, resumed):
+        kind = 'resumed' if resumed else 'full'
+        with self.lock: self.counts[kind] += 1; self.seconds[kind] += seconds
+
+    def failed(self):
+        with self.lock: self.counts['failed'] += 1
+
+    def summary(self):
+        with self.lock:
+            average = {kind: self.seconds[kind] * 1000 / self.counts[kind] if self.counts[kind] else 0.0 for kind in self.seconds}
+            return (f"{self.counts['full']} full ({average['full']:.1f} ms avg), {self.counts['resumed']} resumed "
+                    f"({average['resumed']:.1f} ms avg), {self.counts['failed']} failed")
+
+class TLSConnector:
+    # One client context for every connection to a server, keeping the last session per host so the
+    # chat, parallel stream and retry connections resume it instead of paying a full handshake each.
+    # Sessions belong to the context that made them, which is why the context is shared too.
+    def __init__(self):
+        self.context = ssl.create_default_context(); self.context.check_hostname = False; self.context.verify_mode = ssl.CERT_NONE
+        self.sessions, self.lock = {}, threading.Lock()
+        self.full, self.resumed, self.last_handshake = 0, 0, 0.0
+
+    def connect(self, host, port):
+        with self.lock: session = self.sessions.get(host)
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            started = time.perf_counter()
+            tls_sock = self.context.wrap_socket(sock, server_hostname=host, session=session)
+        except (OSError, ValueError):
+            sock.close()
+            if session is None: raise
+            self.forget(host) # A session the server no longer accepts; fall back to a full handshake.
+            return self.connect(host, port)
+        with self.lock:
+            self.last_handshake = time.perf_counter() - started
+            if tls_sock.session_reused: self.resumed += 1
+            else: self.full += 1
+        return tls_sock
+
+    def remember(self, host, tls_sock):
+        # TLS 1.3 tickets arrive after the handshake, so call this once the server has sent something.
+        session = tls_sock.session
+        if session is not None:
+            with self.lock: self.sessions[host] = session
+
+    def forget(self, host):
+        with self.lock: self.sessions.pop(host, None)
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from compression import SAMPLE_SIZE, Compressor, compressible
+from protocol import FRAME_HEADER, MSG_DATA, MSG_BATCH, pack_batch_index, pack_header
+
+SEND_WINDOW = 1024 * 1024
+BATCH_SIZE = 1024 * 1024
+BATCH_FILE_LIMIT = 64 * 1024
+
+class IntegrityError(OSError):
+    pass
+
+def enable_ktls(context):
+    # OP_ENABLE_KTLS only exists on Python 3.12+ built against OpenSSL 3 with kTLS support.
+    option = getattr(ssl, 'OP_ENABLE_KTLS', 0)
+    if option: context.options |= option
+    return bool(option)
+
+def uses_kernel_send(sock):
+    sslobj = getattr(sock, '_sslobj', None)
+    if isinstance(sock, ssl.SSLSocket):
+        uses_ktls = getattr(sslobj, 'uses_ktls_for_send', None)
+        return bool(uses_ktls and uses_ktls())
+    return isinstance(sock, socket.socket) and hasattr(os, 'sendfile')
+
+class FileSender:
+    # With framed=True every window goes out as one MSG_DATA frame; the buffered path packs the
+    # frame header in front of the file bytes so header and payload leave in a single sendall.
+    # A compressor (framed only) sends each window compressed and forces the buffered path; so does a
+    # digest, which is updated with every window as it is read, before compression.
+    def __init__(self, sock, window=SEND_WINDOW, framed=False):
+        self.sock = sock
+        self.window = window
+        self.framed = framed
+        self.zero_copy = uses_kernel_send(sock)
+        self.mode = "kernel sendfile" if self.zero_copy else "buffered readinto"
+        self._prefix = FRAME_HEADER.size if framed else 0
+        self._buffer = None if self.zero_copy else bytearray(self._prefix + window)
+
+    def send_range(self, f, offset, count, on_progress=None, before_window=None, compressor=None, digest=None):
+        sent, zero_copy = 0, self.zero_copy and compressor is None and digest is None
+        if not zero_copy:
+            f.seek(offset)
+            if self._buffer is None: self._buffer = bytearray(self._prefix + self.window)
+        while sent < count:
+            size = min(self.window, count - sent)
+            if before_window: before_window(size)
+            n = self._send_zero_copy(f, offset + sent, size) if zero_copy else self._send_buffered(f, size, compressor, digest)
+            if not n: raise OSError(f"File shrank during transfer ({sent} of {count} bytes sent)")
+            sent += n
+            if on_progress: on_progress(sent)
+        return sent
+
+    def _send_zero_copy(self, f, offset, size):
+        if self.framed:
+            size = min(size, os.fstat(f.fileno()).st_size - offset)
+            if size <= 0: return 0
+            self.sock.sendall(pack_header(MSG_DATA, size))
+            # The header has promised `size` bytes; a file truncated meanwhile would leave the frame short and
+            # the client reading the next header as data, so the connection has to be dropped instead.
+            if (n := self.sock.sendfile(f, offset, size)) < size: raise OSError(f"File shrank during transfer ({n} of {size} bytes of a frame sent)")
+            return n
+        return self.sock.sendfile(f, offset, size)
+
+    def _send_buffered(self, f, size, compressor=None, digest=None):
+        view = memoryview(self._buffer)
+        n = f.readinto(view[self._prefix:self._prefix + size])
+        if not n: return 0
+        if digest: digest.update(view[self._prefix:self._prefix + n])
+        if compressor:
+            payload = compressor.compress(view[self._prefix:self._prefix + n])
+            self.sock.sendall(pack_header(MSG_DATA, len(payload)) + payload)
+            return n
+        if self.framed: self._buffer[:self._prefix] = pack_header(MSG_DATA, n)
+        self.sock.sendall(view[:self._prefix + n])
+        return n
+
+class FileBatch:
+    # Small files packed into one MSG_BATCH frame (see protocol.split_batch). Files are read straight into
+    # the frame buffer behind a reserved header, so a full batch leaves in one sendall and one run of
+    # full TLS records, instead of a header frame and a data frame, each a record of its own, per file.
+    # Digests come from the bytes just read, and with a codec the whole batch is compressed as one block
+    # when a sample of it shrinks, so no file pays for a hash cache entry or a compression probe of its own.
+    def __init__(self, limit=BATCH_SIZE, codec=None):
+        self.limit, self.codec = limit, codec
+        self.index, self._buffer = [], bytearray(FRAME_HEADER.size)
+
+    @property
+    def size(self): return len(self._buffer) - FRAME_HEADER.size
+
+    def fits(self, length): return not self.index or self.size + length <= self.limit
+
+    def add(self, path, name, length):
+        with open(path, 'rb') as f: data = f.read(length)
+        if len(data) < length: raise OSError(f"File shrank during transfer ({len(data)} of {length} bytes read)")
+        self._buffer += data
+        self.index.append([name, length, hashlib.sha256(data).hexdigest()])
+
+    def take(self):
+        # Returns the finished frame and its file count, and leaves the batch empty.
+        frame, self._buffer = self._buffer, bytearray(FRAME_HEADER.size)
+        codec = self.codec if self.codec and compressible(frame[FRAME_HEADER.size:FRAME_HEADER.size + SAMPLE_SIZE]) else None
+        if codec: frame = frame[:FRAME_HEADER.size] + Compressor(codec).compress(frame[FRAME_HEADER.size:])
+        frame += pack_batch_index(self.index, codec)
+        frame[:FRAME_HEADER.size] = pack_header(MSG_BATCH, len(frame) - FRAME_HEADER.size)
+        count, self.index = len(self.index), []
+        return frame, count
+
+def fsync_directory(directory):
+    # Makes renames into `directory` durable; only possible where directories can be opened (not Windows).
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+
+def partial_path(target_path):
+    return os.path.join(os.path.dirname(target_path), f".{os.path.basename(target_path)}.part")
+
+def hash_file_prefix(path, length, block_size=SEND_WINDOW):
+    with open(path, 'rb') as f: digest = hash_prefix(f, length, block_size)
+    return digest and digest.hexdigest()
+
+def hash_prefix(f, length, block_size=SEND_WINDOW):
+    digest, remaining = hashlib.sha256(), length
+    while remaining > 0 and (block := f.read(min(block_size, remaining))):
+        digest.update(block); remaining -= len(block)
+    return digest if remaining == 0 else None
+
+class FileSink:
+    # Received bytes go to a hidden temp file next to the target; commit() fsyncs and renames it into
+    # place, so a half-written download never shows up under the final name. Resumable sinks use a
+    # stable ".<name>.part" file that survives abort() and can be continued from `offset`.
+    # With sha256 the bytes are hashed as they are written (a resumed part is hashed once up front)
+    # and commit() refuses, and deletes, a file that does not match. With trailer they are hashed the
+    # same way and the digest, sent after the data, is set on `expected` before commit().
+    def __init__(self, target_path, offset=0, resumable=False, sha256=None, trailer=False):
+        self.target_path = target_path
+        self.directory = os.path.dirname(target_path)
+        self.resumable = resumable
+        os.makedirs(self.directory, exist_ok=True)
+        if resumable:
+            self.temp_path = partial_path(target_path)
+            self.file = open(self.temp_path, 'r+b' if offset and os.path.exists(self.temp_path) else 'wb')
+            self.file.seek(offset); self.file.truncate()
+        else:
+            fd, self.temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(target_path)}.", suffix=".part", dir=self.directory)
+            self.file = os.fdopen(fd, 'wb')
+        self.written = offset
+        self.expected, self.digest = sha256, None
+        if (sha256 or trailer) and not offset: self.digest = hashlib.sha256()
+        elif sha256 and self.file.readable():
+            self.file.seek(0); self.digest = hash_prefix(self.file, offset); self.file.seek(offset)
+
+    def write(self, data):
+        self.file.write(data)
+        if self.digest: self.digest.update(data)
+        self.written += len(data)
+
+    def commit(self):
+        self.file.flush(); os.fsync(self.file.fileno()); self.file.close()
+        if self.expected and (self.digest is None or self.digest.hexdigest() != self.expected):
+            os.remove(self.temp_path)
+            raise IntegrityError(f"Checksum mismatch for {os.path.basename(self.target_path)}")
+        os.replace(self.temp_path, self.target_path)
+        fsync_directory(self.directory)
+        return True
+
+    def abort(self):
+        if not self.file.closed: self.file.close()
+        if self.resumable: return
+        try: os.remove(self.temp_path)
+        except FileNotFoundError: pass
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type: self.abort()
+        return False
+
+class BatchSink:
+    # The files of one batch frame. Each is written and fsynced to its own hidden temp file as it is added;
+    # commit() renames them all into place and then fsyncs every folder it touched once, not once per file.
+    def __init__(self):
+        self.pending, self.directories = [], set()
+
+    def add(self, target_path, data, sha256=None):
+        if sha256 and hashlib.sha256(data).hexdigest() != sha256: raise IntegrityError(f"Checksum mismatch for {os.path.basename(target_path)}")
+        directory = os.path.dirname(target_path)
+        if directory not in self.directories: os.makedirs(directory, exist_ok=True); self.directories.add(directory)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(target_path)}.", suffix=".part", dir=directory)
+        self.pending.append((temp_path, target_path))
+        try:
+            view = memoryview(data)
+            while view: view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally: os.close(fd)
+
+    def commit(self):
+        for temp_path, target_path in self.pending: os.replace(temp_path, target_path)
+        self.pending = []
+        for directory in self.directories: fsync_directory(directory)
+        return True
+
+    def abort(self):
+        for temp_path, _ in self.pending:
+            try: os.remove(temp_path)
+            except FileNotFoundError: pass
+        self.pending = []
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type: self.abort()
+        return False
+
+class StripedFile:
+    # A file fetched as concurrent byte ranges. Every range writes through its own handle into one
+    # preallocated temp file, and the last range to finish fsyncs it and renames it into place.
+    def __init__(self, target_path, size):
+        self.target_path, self.size = target_path, size
+        self.directory = os.path.dirname(target_path)
+        os.makedirs(self.directory, exist_ok=True)
+        self.temp_path = os.path.join(self.directory, f".{os.path.basename(target_path)}.parallel.part")
+        with open(self.temp_path, 'wb') as f: f.truncate(size)
+        self.remaining, self.lock = size, threading.Lock()
+
+    def open_range(self, offset):
+        return StripeSink(self, offset)
+
+    def range_done(self, nbytes):
+        with self.lock:
+            self.remaining -= nbytes
+            if self.remaining: return False
+        os.replace(self.temp_path, self.target_path)
+        return True
+
+    def abort(self):
+        try: os.remove(self.temp_path)
+        except FileNotFoundError: pass
+
+class StripeSink:
+    def __init__(self, striped, offset):
+        self.striped = striped
+        self.file = open(striped.temp_path, 'r+b')
+        self.file.seek(offset)
+        self.written = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.written += len(data)
+
+    def commit(self):
+        self.file.flush(); os.fsync(self.file.fileno()); self.file.close()
+        return self.striped.range_done(self.written)
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.file.closed: self.file.close()
+        return False
+
+class ResumeJournal:
+    # Per save folder record of which files finished and how far partial ones got, so a retry only
+    # asks the server for the missing bytes. Checkpoints are rate limited; save(force=True) on exit.
+    FILENAME = ".transfer-journal.json"
+    CHECKPOINT_INTERVAL = 1.0
+
+    def __init__(self, save_path):
+        self.path = os.path.join(save_path, self.FILENAME)
+        self.save_path = save_path
+        self.entries, self._last_save = {}, 0.0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: self.entries = json.load(f).get('files', {})
+        except (FileNotFoundError, ValueError): pass
+
+    def plan(self, files):
+        pending, resume = [], {}
+        for name in files:
+            entry = self.entries.get(name, {})
+            target = os.path.join(self.save_path, name)
+            if entry.get('done') and os.path.isfile(target) and os.path.getsize(target) == entry.get('size'): continue
+            pending.append(name)
+            part = partial_path(target)
+            if entry and not entry.get('done') and os.path.isfile(part):
+                offset = min(os.path.getsize(part), entry.get('size', 0))
+                if offset and (digest := hash_file_prefix(part, offset)): resume[name] = {'offset': offset, 'sha256': digest}
+        return pending, resume
+
+    def start(self, name, size, offset):
+        self.entries[name] = {'size': size, 'received': offset, 'done': False}
+        self.save()
+
+    def progress(self, name, received):
+        self.entries[name]['received'] = received
+        self.save()
+
+    def complete(self, name, size=None):
+        entry = self.entries.setdefault(name, {'size': size})
+        entry.update(received=entry['size'], done=True)
+        self.save()
+
+    def save(self, force=False):
+        if not force and time.monotonic() - self._last_save < self.CHECKPOINT_INTERVAL: return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f: f.write(json.dumps({'files': self.entries})) # dumps uses the C encoder; dump streams through the Python one.
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def clear(self):
+        self.entries = {}
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
@@ -0,0 +1,310 @@
+import collections
+import email.utils
+import gzip
+import html
+import http.server
+import io
+import os
+import sys
+import threading
+import urllib.parse
+from compression import MIN_COMPRESS_SIZE
+from tls import HANDSHAKE_TIMEOUT
+from transfer import FileSender
+
+try:
+    import brotli
+except ImportError: brotli = None # gzip is always available; br is offered only when the brotli package is installed.
+
+WEB_IDLE_TIMEOUT = 60
+LISTING_CACHE_DIRS = 64
+LISTING_PAGE_SIZE = 500
+MAX_LISTING_PAGE_SIZE = 5000
+LISTING_SORT_KEYS = ("name", "size", "mtime")
+WEB_COMPRESS_LIMIT = 8 * 1024 * 1024
+WEB_BODY_CACHE_BYTES = 64 * 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = {"application/javascript", "application/json", "application/xml", "image/svg+xml"}
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def parse_range(header, size):
+    # (start, end) of a single "bytes=" range, end inclusive. None means send the whole file, which RFC 9110
+    # allows for malformed and multi-range headers; ValueError means the range cannot be satisfied (416).
+    if not header or not header.startswith("bytes=") or "," in header: return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try: start, end = int(first) if first else None, int(last) if last else None
+    except ValueError: return None
+    if start is None:
+        if end is None: return None
+        if end == 0 or size == 0: raise ValueError("Empty suffix range.")
+        return max(0, size - end), size - 1
+    if start < 0 or end is not None and end < start: return None
+    if start >= size: raise ValueError("Range starts past the end of the file.")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+def choose_encoding(accept_encoding):
+    # Best content coding the browser accepts (q > 0), preferring br over gzip; None for identity.
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().lower().partition(";")
+        try: accepted[coding.strip()] = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError: continue
+    for coding in (("br", "gzip") if brotli else ("gzip",)):
+        if accepted.get(coding, accepted.get("*", 0)) > 0: return coding
+    return None
+
+def encode_body(data, coding):
+    return brotli.compress(data, quality=BROTLI_QUALITY) if coding == "br" else gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def _http_date(value):
+    try: return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError): return None
+
+class DirectoryListing:
+    # One scan of a directory: (name, is_dir, size, mtime) entries plus each sort order, built on first use.
+    def __init__(self, path, mtime_ns):
+        self.mtime_ns, self.entries, self._orders = mtime_ns, [], {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    stat = entry.stat()
+                except OSError: continue # Vanished or unreadable since the scan started.
+                self.entries.append((entry.name, is_dir, 0 if is_dir else stat.st_size, stat.st_mtime))
+
+    def sorted(self, key, reverse=False):
+        if (key, reverse) not in self._orders:
+            index = {"name": 0, "size": 2, "mtime": 3}[key]
+            ordered = sorted(self.entries, key=lambda e: e[index].lower() if index == 0 else e[index], reverse=reverse)
+            self._orders[key, reverse] = sorted(ordered, key=lambda e: not e[1]) # Folders first; the sort is stable.
+        return self._orders[key, reverse]
+
+class ListingCache:
+    # Recently viewed directories, rescanned only when a directory's mtime changes (an entry was added,
+    # removed or renamed). Like FileIndex polling, a file rewritten in place shows its new size after the next change.
+    def __init__(self, capacity=LISTING_CACHE_DIRS):
+        self.capacity, self.lock, self.listings = capacity, threading.Lock(), collections.OrderedDict()
+
+    def get(self, path):
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing and listing.mtime_ns == mtime_ns: self.listings.move_to_end(path); return listing
+        listing = DirectoryListing(path, mtime_ns)
+        with self.lock:
+            self.listings[path] = listing; self.listings.move_to_end(path)
+            while len(self.listings) > self.capacity: self.listings.popitem(last=False)
+        return listing
+
+class EncodedBodyCache:
+    # Compressed file bodies by (path, representation ETag), so a text file is compressed once per change rather
+    # than on every request. The ETag carries size, mtime and coding; least recently used bodies are dropped
+    # once the cache holds more than 'capacity' bytes.
+    def __init__(self, capacity=WEB_BODY_CACHE_BYTES):
+        self.capacity, self.size, self.lock, self.bodies = capacity, 0, threading.Lock(), collections.OrderedDict()
+
+    def get(self, path, etag, f, coding):
+        key = (path, etag)
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None: self.bodies.move_to_end(key); return body
+        body = encode_body(f.read(), coding)
+        with self.lock:
+            if key not in self.bodies: self.bodies[key] = body; self.size += len(body)
+            while self.size > self.capacity: self.size -= len(self.bodies.popitem(last=False)[1])
+        return body
+
+class SecureHTTPServer(http.server.ThreadingHTTPServer):
+    # One thread per connection, and the TLS handshake happens on that thread rather than in accept(),
+    # so neither a slow download nor a stalled handshake holds up other browsers.
+    daemon_threads = True
+
+    def __init__(self, server_address, HandlerClass, ssl_context):
+        super().__init__(server_address, HandlerClass)
+        self.ssl_context = ssl_context
+
+    def finish_request(self, request, client_address):
+        request.settimeout(HANDSHAKE_TIMEOUT)
+        try: tls_request = self.ssl_context.wrap_socket(request, server_side=True)
+        except OSError: return # Browsers drop the connection while the user decides about the certificate.
+        try: self.RequestHandlerClass(tls_request, client_address, self)
+        finally: tls_request.close()
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], OSError): super().handle_error(request, client_address)
+
+class ShareHandler(http.server.SimpleHTTPRequestHandler):
+    # Files are sent with ETag/Last-Modified validators, single byte ranges and HEAD support; bodies go
+    # through FileSender (kernel sendfile when kTLS is on) and the server's bandwidth scheduler. Listings
+    # come from the ListingCache, paged and sorted by query parameters; listings and text files are
+    # compressed when the browser accepts it (ranges are always sent uncompressed), text files through the EncodedBodyCache.
+    protocol_version = "HTTP/1.1"
+    timeout = WEB_IDLE_TIMEOUT
+    file_server, listings, bodies = None, None, None
+    sender, body_range = None, None
+
+    def do_GET(self):
+        if self.refuse(): return
+        super().do_GET()
+
+    def do_HEAD(self):
+        if self.refuse(): return
+        super().do_HEAD()
+
+    def refuse(self):
+        if not self.file_server.password: return False
+        body = b"<h1>403 Forbidden</h1><p>Web access is disabled when server is password-protected.</p>"
+        self.send_response(403); self.send_header("Content-type", "text/html; charset=utf-8"); self.send_header("Content-Length", str(len(body))); self.end_headers()
+        if self.command != "HEAD": self.wfile.write(body)
+        return True
+
+    def send_head(self):
+        self.body_range = None
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path) or self.path.endswith("/"): return super().send_head() # Listings, redirects and 404s.
+        try: f = open(path, 'rb')
+        except OSError: self.send_error(404, "File not found"); return None
+        try:
+            stat = os.fstat(f.fileno())
+            etag, size, ctype = file_etag(stat), stat.st_size, self.guess_type(path)
+            coding = self.compressible(ctype, size) and "Range" not in self.headers and choose_encoding(self.headers.get("Accept-Encoding"))
+            if coding: etag = f'{etag[:-1]}-{coding}"'
+            if self.not_modified(etag, stat.st_mtime):
+                self.send_response(304); self.send_header("ETag", etag); self.end_headers()
+                f.close(); return None
+            if coding:
+                with f: return self.send_body(self.bodies.get(path, etag, f, coding), ctype, etag, stat.st_mtime, coding)
+            try: byte_range = parse_range(self.headers.get("Range"), size) if self.range_applies(etag, stat.st_mtime) else None
+            except ValueError:
+                self.send_response(416); self.send_header("Content-Range", f"bytes */{size}"); self.send_header("Content-Length", "0"); self.end_headers()
+                f.close(); return None
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range: self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            if self.compressible(ctype, size): self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+            self.send_header("Cache-Control", "no-cache") # Shared files change; let browsers revalidate with the ETag.
+            self.end_headers()
+            self.body_range = (start, end - start + 1)
+            return f
+        except Exception:
+            f.close(); raise
+
+    @staticmethod
+    def compressible(ctype, size):
+        return MIN_COMPRESS_SIZE <= size <= WEB_COMPRESS_LIMIT and (ctype.startswith("text/") or ctype in COMPRESSIBLE_TYPES)
+
+    def send_body(self, body, ctype, etag, mtime, coding=None):
+        # Headers for an in-memory body, already encoded with 'coding' if one is given; returns it as a file for do_GET to copy.
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if coding: self.send_header("Content-Encoding", coding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def list_directory(self, path):
+        try: listing = self.listings.get(path)
+        except OSError: self.send_error(404, "No permission to list directory"); return None
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).items()}
+        sort = query.get("sort") if query.get("sort") in LISTING_SORT_KEYS else "name"
+        descending = query.get("order") == "desc"
+        try: per_page = max(1, min(int(query.get("per_page", LISTING_PAGE_SIZE)), MAX_LISTING_PAGE_SIZE))
+        except ValueError: per_page = LISTING_PAGE_SIZE
+        entries = listing.sorted(sort, descending)
+        pages = max(1, -(-len(entries) // per_page))
+        try: page = max(1, min(int(query.get("page", 1)), pages))
+        except ValueError: page = 1
+        coding = choose_encoding(self.headers.get("Accept-Encoding"))
+        etag = f'W/"{listing.mtime_ns:x}-{sort}-{int(descending)}-{page}-{per_page}{f"-{coding}" if coding else ""}"'
+        mtime = listing.mtime_ns / 1e9
+        if self.not_modified(etag, mtime):
+            self.send_response(304); self.send_header("ETag", etag); self.end_headers()
+            return None
+        body = self.render_listing(entries[(page - 1) * per_page:page * per_page], len(entries), sort, descending, page, pages, per_page)
+        coding = coding if len(body) >= MIN_COMPRESS_SIZE else None
+        return self.send_body(encode_body(body, coding) if coding else body, "text/html; charset=utf-8", etag, mtime, coding)
+
+    def render_listing(self, entries, total, sort, descending, page, pages, per_page):
+        base = urllib.parse.urlsplit(self.path).path
+        def link(text, **params):
+            params = {'sort': sort, 'order': "desc" if descending else "asc", 'page': page, 'per_page': per_page, **params}
+            return f'<a href="{html.escape(base + "?" + urllib.parse.urlencode(params))}">{text}</a>'
+        def heading(key, label):
+            # Clicking the current column flips the order; another column starts ascending.
+            return link(label + (" ▼" if descending else " ▲") if key == sort else label, sort=key, order="asc" if key != sort or descending else "desc", page=1)
+        title = f"Directory listing for {html.escape(urllib.parse.unquote(base, errors='surrogatepass'), quote=False)}"
+        pager = f"Page {page} of {pages} ({total} entries)"
+        if page > 1: pager = f"{link('&laquo; Previous', page=page - 1)} &middot; {pager}"
+        if page < pages: pager = f"{pager} &middot; {link('Next &raquo;', page=page + 1)}"
+        rows = [f'<tr><td><a href="{urllib.parse.quote(name + ("/" if is_dir else ""), errors="surrogatepass")}">{html.escape(name + ("/" if is_dir else ""), quote=False)}</a></td>'
+                f'<td align="right">{"-" if is_dir else size}</td><td>{self.date_time_string(mtime)}</td></tr>' for name, is_dir, size, mtime in entries]
+        document = ['<!DOCTYPE HTML>', '<html lang="en">', '<head>', '<meta charset="utf-8">', f'<title>{title}</title>\n</head>',
+                    f'<body>\n<h1>{title}</h1>', f'<p>{pager}</p>', '<hr>\n<table>',
+                    f'<tr><th align="left">{heading("name", "Name")}</th><th align="right">{heading("size", "Size")}</th><th align="left">{heading("mtime", "Modified")}</th></tr>',
+                    *rows, '</table>\n<hr>', f'<p>{pager}</p>', '</body>\n</html>\n']
+        return '\n'.join(document).encode('utf-8', 'surrogateescape')
+
+    def not_modified(self, etag, mtime):
+        # If-None-Match wins over If-Modified-Since, and compares weakly.
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        since = _http_date(self.headers.get("If-Modified-Since"))
+        return since is not None and int(mtime) <= since
+
+    def range_applies(self, etag, mtime):
+        # If-Range: resume only if the file is still the one the partial download came from.
+        if_range = self.headers.get("If-Range")
+        if if_range is None: return True
+        if if_range.strip().startswith(('"', 'W/')): return if_range.strip() == etag
+        date = _http_date(if_range)
+        return date is not None and int(mtime) <= date
+
+    def copyfile(self, source, outputfile):
+        if self.body_range is None: return super().copyfile(source, outputfile)
+        offset, length = self.body_range
+        if self.sender is None: self.sender = FileSender(self.connection)
+        client_ip, scheduler = self.client_address[0], self.file_server.scheduler
+        self.sender.send_range(source, offset, length, before_window=lambda size: scheduler.acquire(client_ip, size))
+
+class MetricsHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    # GET /metrics in the Prometheus text format, on a plain HTTP port of its own (localhost by default), so
+    # scrapers need neither the share's certificate nor access to the share, and work with a password set.
+    file_server = None
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/metrics": self.send_error(404); return
+        body = self.file_server.metrics.render(self.file_server).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): pass # A scrape every few seconds would flood stderr.
+
+def metrics_handler_factory(server_instance):
+    class CustomMetricsHandler(MetricsHandler):
+        file_server = server_instance
+    return CustomMetricsHandler
+
+def handler_factory(directory, server_instance):
+    class CustomHandler(ShareHandler):
+        file_server, listings, bodies = server_instance, ListingCache(), EncodedBodyCache()
+        def __init__(self, *args, **kwargs): super().__init__(*args, directory=directory, **kwargs)
+    return CustomHandler